@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Time `moneybot.analytics.report` (every metric plus bootstrap intervals)
+over `--windows` backtest windows of `--steps` values, as a sweep would for
+each configuration, against working out the per window metrics one value at
+a time with `RunningMetrics`.
+
+    python3 benchmarks/analytics_report.py --windows 12 --steps 720
+    python3 benchmarks/analytics_report.py --configs 1000 --samples 200
+"""
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+
+from moneybot.analytics import report
+from moneybot.analytics import window_metrics
+from moneybot.metrics import RunningMetrics
+
+
+def main(args):
+    rng = np.random.RandomState(0)
+    shape = (args.configs, args.windows, args.steps)
+    values = 1000 * np.cumprod(1 + rng.normal(0, 0.01, size=shape), axis=2)
+
+    timings = [
+        ('running', lambda v: [RunningMetrics.of(w.tolist()).as_dict() for w in v]),
+        ('metrics', lambda v: window_metrics(v, periods_per_year=args.per_year)),
+        ('report', lambda v: report(
+            v,
+            periods_per_year=args.per_year,
+            samples=args.samples,
+        )),
+    ]
+    for name, run in timings:
+        start = perf_counter()
+        for config in values:
+            run(config)
+        seconds = (perf_counter() - start) / args.configs
+        print(f'{name:>8}: {seconds * 1000:10.3f} ms/config')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-c', '--configs', default=100, type=int)
+    parser.add_argument('-w', '--windows', default=12, type=int)
+    parser.add_argument('-s', '--steps', default=720, type=int)
+    parser.add_argument('--per-year', default=365 * 24, type=float)
+    parser.add_argument('--samples', default=1000, type=int)
+    main(parser.parse_args())
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Compare ways of getting a backtest window's metrics from the generator
+`Fund.run_backtest` returns: keeping every value in a list (as `evaluate`
+used to), streaming them through `RunningMetrics`, and `batch_metrics` over
+an array of many windows at once.
+
+Reports the time and peak memory (from tracemalloc, in a second run) each takes for
+`--windows` windows of `--steps` values, e.g. two years of 5 minute steps:
+
+    python3 benchmarks/backtest_metrics.py --steps 210240 --windows 4
+"""
+import tracemalloc
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+
+from moneybot.metrics import batch_metrics
+from moneybot.metrics import RunningMetrics
+
+
+def values(steps: int, seed: int):
+    # Stands in for Fund.run_backtest, a few values at a time
+    rng = np.random.RandomState(seed)
+    value = 1000.0
+    for start in range(0, steps, 1024):
+        for r in rng.normal(0, 0.001, size=min(1024, steps - start)).tolist():
+            value *= 1 + r
+            yield value
+
+
+def listed(steps: int, windows: int):
+    results = []
+    for seed in range(windows):
+        window = list(values(steps, seed))
+        peak = np.maximum.accumulate(window)
+        results.append((
+            (window[-1] - window[0]) / window[0],
+            float(((peak - window) / peak).max()),
+        ))
+    return results
+
+
+def streamed(steps: int, windows: int):
+    return [
+        RunningMetrics.of(values(steps, seed)).as_dict()
+        for seed in range(windows)
+    ]
+
+
+def batched(steps: int, windows: int):
+    return batch_metrics(np.array([
+        np.fromiter(values(steps, seed), float, steps)
+        for seed in range(windows)
+    ]))
+
+
+def main(args):
+    for name, run in [
+        ('list', listed),
+        ('running', streamed),
+        ('batch', batched),
+    ]:
+        start = perf_counter()
+        run(args.steps, args.windows)
+        seconds = perf_counter() - start
+        # Tracing slows everything down, so measure memory separately
+        tracemalloc.start()
+        run(args.steps, args.windows)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f'{name:>8}: {seconds * 1000:10.1f} ms '
+            f'{peak / 2 ** 20:10.2f} MiB peak'
+        )
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-s', '--steps', default=210240, type=int)
+    parser.add_argument('-w', '--windows', default=4, type=int)
+    main(parser.parse_args())
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Compare the ways a backtest can get its charts: parsing the JSON mock data,
+opening a snapshot written by `ChartStore.save` (mapped or read), and, with
+`--postgres`, querying `scraped_chart` directly.
+
+Reports how long each takes to open, and then the mean time of a `latest()`
+and a 30 day `asset_history()` lookup at random times.
+
+    python3 benchmarks/chart_snapshot.py --number 200
+    python3 benchmarks/chart_snapshot.py -c config.yml --postgres
+
+Snapshot timings are with the file already in the page cache; the first open
+after a reboot will also pay to read whatever pages are touched.
+"""
+import json
+import os
+import tempfile
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+from pandas import Timestamp
+
+from moneybot import load_config
+from moneybot.market.history import MarketHistory
+from moneybot.market.store import ChartStore
+from moneybot.market.store import ColumnarMarketHistory
+
+
+def from_json() -> ColumnarMarketHistory:
+    with open('tests/mock-data/charts.json', 'r') as f:
+        return ColumnarMarketHistory(ChartStore.from_charts(json.load(f)))
+
+
+def time_queries(history, times) -> float:
+    start = perf_counter()
+    for time in times:
+        history.latest(time)
+        history.asset_history(time, 'BTC', 'ETH', days_back=30)
+    return (perf_counter() - start) / len(times)
+
+
+def main(args):
+    json_store = from_json().store
+    first, last = (Timestamp(t) for t in json_store.times[[0, -1]])
+    rng = np.random.RandomState(0)
+    times = [first + (last - first) * x for x in rng.uniform(size=args.number)]
+
+    path = os.path.join(tempfile.mkdtemp(), 'charts.snapshot')
+    json_store.save(path)
+    print(
+        f'{len(json_store.times)} x {len(json_store.pairs)} charts, '
+        f'{os.path.getsize(path) / 1024:.0f} KiB snapshot'
+    )
+
+    sources = [
+        ('json', from_json),
+        ('mmap', lambda: ColumnarMarketHistory(ChartStore.load(path))),
+        ('read', lambda: ColumnarMarketHistory(
+            ChartStore.load(path, mmap=False),
+        )),
+    ]
+    if args.postgres:
+        load_config(args.config)
+        sources.append(('postgres', MarketHistory))
+
+    for name, open_history in sources:
+        start = perf_counter()
+        history = open_history()
+        opened = perf_counter() - start
+        seconds = time_queries(history, times)
+        print(
+            f'{name:>10}: {opened * 1000:10.2f} ms to open '
+            f'{seconds * 1000:10.3f} ms/query'
+        )
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-c', '--config', default='config-example.yml')
+    parser.add_argument('-n', '--number', default=200, type=int)
+    parser.add_argument(
+        '--postgres',
+        action='store_true',
+        help='also time queries against scraped_chart',
+    )
+    main(parser.parse_args())
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Compare the old `DISTINCT ON` query for `MarketHistory.latest()` against
+the per-pair `LATERAL` lookup it was replaced with, at random times.
+
+Needs a Postgres holding scraped data (see local-services/ and
+examples/schema.py). Run it before and after `examples/schema.py migrate` to
+see what partitioning and the (currency_pair, time) index buy.
+
+    python3 benchmarks/latest_query.py -c config.yml --number 20
+"""
+from argparse import ArgumentParser
+from datetime import timedelta
+from time import perf_counter
+
+import numpy as np
+from pandas import Timestamp
+
+from moneybot import load_config
+from moneybot.clients import Postgres
+from moneybot.market.history import MarketHistory
+
+
+DISTINCT_ON = (
+    'SELECT DISTINCT ON (currency_pair) * FROM scraped_chart '
+    'WHERE time <= %s AND time > %s '
+    'ORDER BY currency_pair, time DESC'
+)
+
+
+def distinct_on(history: MarketHistory, time: Timestamp) -> int:
+    with Postgres.connection() as conn, conn.cursor() as cursor:
+        cursor.execute(DISTINCT_ON, (time, time - timedelta(days=1)))
+        return len(cursor.fetchall())
+
+
+def lateral(history: MarketHistory, time: Timestamp) -> int:
+    return len(history.latest(time))
+
+
+def main(args):
+    load_config(args.config)
+    history = MarketHistory()
+    with Postgres.connection() as conn, conn.cursor() as cursor:
+        cursor.execute('SELECT min(time), max(time) FROM scraped_chart')
+        first, last = (Timestamp(t) for t in cursor.fetchone())
+
+    rng = np.random.RandomState(0)
+    times = [first + (last - first) * x for x in rng.uniform(size=args.number)]
+
+    start = perf_counter()
+    pairs = history.currency_pairs()
+    print(f'{len(pairs)} pairs listed in {perf_counter() - start:.3f} s')
+
+    for name, fn in [('distinct', distinct_on), ('lateral', lateral)]:
+        start = perf_counter()
+        counts = [fn(history, time) for time in times]
+        seconds = (perf_counter() - start) / len(times)
+        print(
+            f'{name:>10}: {seconds * 1000:10.1f} ms/call '
+            f'({np.mean(counts):.0f} rows/call)'
+        )
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-c', '--config', default='config-example.yml')
+    parser.add_argument('-n', '--number', default=20, type=int)
+    main(parser.parse_args())
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Compare the per-step cost of protecting MarketState from the Strategy by
+deep-copying it against taking a read-only snapshot.
+
+    python3 benchmarks/market_state_snapshot.py --pairs 300
+"""
+import json
+import tracemalloc
+from argparse import ArgumentParser
+from copy import deepcopy
+from datetime import datetime
+from timeit import timeit
+
+from moneybot.market.state import MarketState
+
+
+def make_state(n_pairs: int) -> MarketState:
+    with open('tests/mock-data/charts.json', 'r') as f:
+        charts = json.load(f)
+    rows = next(iter(charts.values()))
+    # Pad out with synthetic markets until we reach the requested size
+    template = rows['BTC_ETH']
+    chart_data = dict(rows)
+    for i in range(len(chart_data), n_pairs):
+        chart_data[f'BTC_X{i}'] = dict(template)
+    balances = {market.split('_')[1]: 1.0 for market in chart_data}
+    return MarketState(chart_data, balances, datetime.now(), 'BTC')
+
+
+def allocated(fn) -> int:
+    tracemalloc.start()
+    result = fn()  # noqa: F841 (keep the copy alive while measuring)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main(args):
+    state = make_state(args.pairs)
+    print(f'{len(state.chart_data)} markets, {args.number} steps')
+    for name, fn in [
+        ('deepcopy', lambda: deepcopy(state)),
+        ('snapshot', lambda: state.snapshot()),
+    ]:
+        seconds = timeit(fn, number=args.number) / args.number
+        print(
+            f'{name:>10}: {seconds * 1e6:10.1f} us/step '
+            f'{allocated(fn) / 1024:10.1f} KiB/step'
+        )
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-p', '--pairs', default=100, type=int)
+    parser.add_argument('-n', '--number', default=1000, type=int)
+    main(parser.parse_args())
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Compare writing scraped chart rows one INSERT at a time against the bulk
+COPY + upsert path in `moneybot.market.scrape.write_rows`.
+
+Needs a Postgres with a `scraped_chart` table (see local-services/). Rows are
+written to a temporary copy of the table, so nothing is left behind.
+
+    python3 benchmarks/scrape_ingest.py --rows 100000
+"""
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+from pandas import DataFrame
+from pandas import date_range
+
+from moneybot import load_config
+from moneybot.clients import Postgres
+from moneybot.market.scrape import COLUMNS
+from moneybot.market.scrape import write_rows
+
+
+TABLE = 'scraped_chart_bench'
+
+
+def make_rows(n_rows: int, n_pairs: int = 100) -> DataFrame:
+    times = date_range('2017-01-01', periods=n_rows // n_pairs, freq='5min')
+    rng = np.random.RandomState(0)
+    rows = DataFrame({
+        'time': np.repeat(times, n_pairs),
+        'currency_pair': [f'BTC_X{i}' for i in range(n_pairs)] * len(times),
+    })
+    for column in COLUMNS[2:]:
+        rows[column] = rng.uniform(size=len(rows))
+    return rows
+
+
+def insert_each(cursor, rows: DataFrame) -> None:
+    query = (
+        f'INSERT INTO {TABLE} ({", ".join(COLUMNS)}) '
+        f'VALUES ({", ".join(f"%({c})s" for c in COLUMNS)})'
+    )
+    for _, row in rows.iterrows():
+        cursor.execute(query, row.to_dict())
+
+
+def timed(client, fn, rows: DataFrame, truncate: bool = True) -> float:
+    cursor = client.cursor()
+    if truncate:
+        cursor.execute(f'TRUNCATE {TABLE}')
+    start = perf_counter()
+    fn(cursor, rows)
+    client.commit()
+    elapsed = perf_counter() - start
+    cursor.close()
+    return elapsed
+
+
+def main(args):
+    load_config(args.config)
+    # Temporary tables belong to one connection, so hold on to it
+    with Postgres.connection() as client:
+        cursor = client.cursor()
+        cursor.execute(f'CREATE TEMP TABLE {TABLE} (LIKE scraped_chart)')
+        client.commit()
+        cursor.close()
+        run(client, make_rows(args.rows))
+
+
+def run(client, rows: DataFrame) -> None:
+    print(f'{len(rows)} rows')
+    for name, fn in [
+        ('insert', insert_each),
+        ('copy', lambda cursor, rows: write_rows(cursor, rows, TABLE)),
+    ]:
+        seconds = timed(client, fn, rows)
+        print(f'{name:>10}: {seconds:8.2f} s {len(rows) / seconds:12.0f} rows/s')
+
+    # Writing the same rows again exercises the update half of the upsert
+    seconds = timed(
+        client,
+        lambda cursor, rows: write_rows(cursor, rows, TABLE),
+        rows,
+        truncate=False,
+    )
+    print(f'{"upsert":>10}: {seconds:8.2f} s {len(rows) / seconds:12.0f} rows/s')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-c', '--config', default='config-example.yml')
+    parser.add_argument('-r', '--rows', default=100000, type=int)
+    main(parser.parse_args())
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Compare marshalling Poloniex chart data row by row (`apply`/`asof`/
+`iterrows`, as `historical_prices_of` used to) against the vectorized
+`moneybot.market.scrape.marshall_chart_data`, on a year of 5-minute candles.
+
+The row-wise version is very slow, so it only runs over `--rowwise-pairs`
+pairs and is extrapolated to the rest.
+
+    python3 benchmarks/scrape_marshall.py --pairs 100
+"""
+from argparse import ArgumentParser
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+from pandas import DataFrame
+from pandas import Series
+from pandas import date_range
+
+from moneybot.market.scrape import marshall_chart_data
+
+
+PERIOD = 300
+YEAR_IN_SECS = 60 * 60 * 24 * 365
+
+
+def make_chart_data(n_candles: int, rng: np.random.RandomState):
+    start = datetime(2017, 1, 1).timestamp()
+    prices = rng.uniform(0.01, 0.1, n_candles)
+    return [
+        {
+            'date': start + PERIOD * i,
+            'high': price,
+            'low': price,
+            'open': price,
+            'close': price,
+            'volume': 1.0,
+            'quoteVolume': 1.0 / price,
+            'weightedAverage': price,
+        }
+        for i, price in enumerate(prices.tolist())
+    ]
+
+
+def rowwise(ex_trades, btc_price_history, pair):
+    def contemporary_usd_price(row: Series) -> float:
+        contemporary_btc_price = btc_price_history['price_usd'].asof(row.name)
+        return row['weightedAverage'] * contemporary_btc_price
+    ts_df = DataFrame(ex_trades, dtype=float)
+    ts_df['time'] = [datetime.fromtimestamp(t) for t in ts_df['date']]
+    ts_df.index = ts_df['time']
+    ts_df['price_usd'] = ts_df.apply(contemporary_usd_price, axis=1)
+    ts_df['currency_pair'] = ts_df.apply(lambda x: pair, axis=1)
+    ts_df = ts_df.rename(index=str, columns={
+        'quoteVolume': 'quote_volume',
+        'weightedAverage': 'weighted_average',
+    })
+    return DataFrame([
+        row for _, row in ts_df.iterrows()
+        if not (row['volume'] == 0 and row['weighted_average'] == 0)
+    ])
+
+
+def main(args):
+    rng = np.random.RandomState(0)
+    n_candles = YEAR_IN_SECS // PERIOD
+    btc_price_history = DataFrame(
+        {'price_usd': rng.uniform(800, 3000, 400)},
+        index=date_range('2016-12-01', periods=400),
+    )
+    chart_data = make_chart_data(n_candles, rng)
+    print(f'{args.pairs} pairs x {n_candles} candles')
+
+    start = perf_counter()
+    for i in range(args.pairs):
+        marshall_chart_data(chart_data, btc_price_history, f'BTC_X{i}')
+    vectorized = perf_counter() - start
+
+    start = perf_counter()
+    for i in range(args.rowwise_pairs):
+        rowwise(chart_data, btc_price_history, f'BTC_X{i}')
+    row_by_row = (perf_counter() - start) / args.rowwise_pairs * args.pairs
+
+    print(f'{"rowwise":>10}: {row_by_row:8.1f} s (extrapolated)')
+    print(f'{"vectorized":>10}: {vectorized:8.1f} s')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-p', '--pairs', default=100, type=int)
+    parser.add_argument('-r', '--rowwise-pairs', default=1, type=int)
+    main(parser.parse_args())
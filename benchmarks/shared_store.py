@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Compare sending a ChartStore to worker processes by value (as pickling it
+did before) with sending it shared, via `ChartStore.shared`.
+
+Builds a synthetic store of `--days` of 15 minute candles for `--pairs`
+currency pairs, then starts `--workers` fresh (spawned) processes which each
+unpickle the store, time that (the attach time), and read every column, as a
+backtest eventually would. Each worker then reports its resident memory,
+split into private (anonymous) pages and pages of mapped files and shared
+memory, which are counted in every process mapping them but held once.
+
+    python3 benchmarks/shared_store.py --workers 8
+    python3 benchmarks/shared_store.py --days 730 --pairs 200 --workers 32
+
+Linux only, since memory is read from /proc/self/status.
+"""
+import multiprocessing
+import pickle
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from typing import Dict
+
+import numpy as np
+
+from moneybot.market.store import ChartStore
+
+
+COLUMNS = [
+    'close', 'high', 'low', 'open', 'price_usd', 'quote_volume', 'volume',
+    'weighted_average',
+]
+
+
+def synthetic_store(days: int, pairs: int) -> ChartStore:
+    times = np.arange(
+        np.datetime64('2017-01-01'),
+        np.datetime64('2017-01-01') + np.timedelta64(days, 'D'),
+        np.timedelta64(15, 'm'),
+    ).astype('datetime64[ns]')
+    shape = (len(times), pairs)
+    rng = np.random.RandomState(0)
+    columns = {name: rng.uniform(size=shape) for name in COLUMNS}
+    names = [f'BTC_{i:04d}' for i in range(pairs)]
+    return ChartStore(times, names, columns, np.ones(shape, dtype=bool))
+
+
+def memory() -> Dict[str, int]:
+    '''
+    Resident memory of this process, in KiB, from /proc/self/status.
+    '''
+    fields = {}
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in ('VmRSS', 'RssAnon', 'RssFile', 'RssShmem'):
+                fields[name] = int(value.split()[0])
+    return fields
+
+
+def warm_up(_: int) -> None:
+    pass
+
+
+def attach(data: bytes) -> Dict[str, float]:
+    before = memory()
+    start = perf_counter()
+    store = pickle.loads(data)
+    seconds = perf_counter() - start
+    total = sum(float(store.column(name).sum()) for name in store.column_names)
+    after = memory()
+    result = {name: after[name] - before[name] for name in after}
+    result.update(seconds=seconds, total=total)
+    return result
+
+
+def report(name: str, data: bytes, workers: int) -> None:
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context) as executor:
+        # Start every worker before timing anything
+        list(executor.map(warm_up, range(workers)))
+        results = list(executor.map(attach, [data] * workers))
+
+    def mean(key: str) -> float:
+        return sum(result[key] for result in results) / len(results)
+
+    private = mean('RssAnon') / 1024
+    shared = (mean('RssFile') + mean('RssShmem')) / 1024
+    print(
+        f'{name:>7}: {len(data) / 2 ** 20:9.1f} MiB pickled '
+        f'{mean("seconds") * 1000:9.2f} ms to attach '
+        f'{private:9.1f} MiB private {shared:9.1f} MiB shared per worker'
+    )
+
+
+def main(args):
+    store = synthetic_store(args.days, args.pairs)
+    size = sum(store.column(name).nbytes for name in store.column_names)
+    print(
+        f'{len(store.times)} x {len(store.pairs)} charts, '
+        f'{size / 2 ** 20:.1f} MiB of columns, {args.workers} workers'
+    )
+    report('copied', pickle.dumps(store), args.workers)
+    with store.shared() as shared:
+        report('shared', pickle.dumps(shared), args.workers)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-d', '--days', default=365, type=int)
+    parser.add_argument('-p', '--pairs', default=100, type=int)
+    parser.add_argument('-w', '--workers', default=4, type=int)
+    main(parser.parse_args())
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Measure what instrumenting a Fund costs: backtest the mock data with no
+observers, and with a HistogramCollector (and a FileExporter writing
+Prometheus text after every step), then print the collected phase timings.
+
+    python3 benchmarks/step_instrumentation.py --number 5
+"""
+import json
+import logging
+import os
+import tempfile
+from argparse import ArgumentParser
+from time import perf_counter
+
+from moneybot import load_config
+from moneybot.examples.strategies import BuffedCoinStrategy
+from moneybot.fund import Fund
+from moneybot.instrumentation import FileExporter
+from moneybot.instrumentation import HistogramCollector
+from moneybot.market.adapters.backtest import BacktestMarketAdapter
+from moneybot.market.store import ChartStore
+from moneybot.market.store import ColumnarMarketHistory
+
+
+def make_fund(store) -> Fund:
+    adapter = BacktestMarketAdapter(
+        'BTC',
+        ColumnarMarketHistory(store),
+        {'BTC': 1.0},
+    )
+    return Fund(BuffedCoinStrategy('BTC', 86400), adapter)
+
+
+def main(args):
+    load_config(args.config)
+    with open('tests/mock-data/charts.json', 'r') as f:
+        store = ChartStore.from_charts(json.load(f))
+    path = os.path.join(tempfile.mkdtemp(), 'metrics.prom')
+    start, end = '2017-05-01', '2017-06-01'
+
+    collector = HistogramCollector()
+    for name in ['plain', 'collector', 'exporter']:
+        elapsed = 0.0
+        for _ in range(args.number):
+            fund = make_fund(store)
+            if name != 'plain':
+                fund.add_observer(collector)
+            if name == 'exporter':
+                fund.add_observer(FileExporter(collector, path))
+            begin = perf_counter()
+            steps = len(list(fund.run_backtest(start, end)))
+            elapsed += perf_counter() - begin
+        per_step = elapsed / args.number / steps
+        print(f'{name:>10}: {per_step * 1000:8.3f} ms/step')
+
+    for sample in collector.snapshot()['histograms']:
+        mean = sample['sum'] / sample['count']
+        print(
+            f"{sample['name']}{sample['labels']}: {sample['count']} "
+            f'calls, {mean * 1000:.3f} ms mean'
+        )
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-c', '--config', default='config-example.yml')
+    parser.add_argument('-n', '--number', default=5, type=int)
+    # Orders failing validation would otherwise be logged on every step
+    logging.getLogger().setLevel(logging.ERROR)
+    main(parser.parse_args())
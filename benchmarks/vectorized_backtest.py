@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Time a backtest of a target-weight strategy on the mock data, stepping a
+Fund through BacktestMarketAdapter and with `moneybot.vectorized`, and report
+how far apart their results are.
+
+    python3 benchmarks/vectorized_backtest.py --strategy equal-weight
+    python3 benchmarks/vectorized_backtest.py --number 20 --strategy buy-hold
+"""
+import json
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+
+from moneybot import load_config
+from moneybot import vectorized
+from moneybot.examples.strategies import BuyHoldStrategy
+from moneybot.examples.strategies import EqualWeightStrategy
+from moneybot.fund import Fund
+from moneybot.market.adapters.backtest import BacktestMarketAdapter
+from moneybot.market.store import ChartStore
+from moneybot.market.store import ColumnarMarketHistory
+
+
+strategies = {
+    'buy-hold': BuyHoldStrategy,
+    'equal-weight': EqualWeightStrategy,
+}
+
+
+def step(strategy, store, start, end):
+    adapter = BacktestMarketAdapter(
+        strategy.fiat,
+        ColumnarMarketHistory(store),
+        {'BTC': 1.0},
+    )
+    return np.array(list(Fund(strategy, adapter).run_backtest(start, end)))
+
+
+def vector(strategy, store, start, end):
+    return vectorized.run_backtest(strategy, store, {'BTC': 1.0}, start, end)
+
+
+def main(args):
+    load_config(args.config)
+    with open('tests/mock-data/charts.json', 'r') as f:
+        store = ChartStore.from_charts(json.load(f))
+    strategy = strategies[args.strategy]('BTC', args.interval)
+    start, end = '2017-05-01', '2017-06-01'
+
+    results = {}
+    for name, run in [('step', step), ('vectorized', vector)]:
+        start_time = perf_counter()
+        for _ in range(args.number):
+            results[name] = run(strategy, store, start, end)
+        seconds = (perf_counter() - start_time) / args.number
+        print(f'{name:>10}: {seconds * 1000:10.2f} ms/backtest')
+
+    steps = len(results['step'])
+    difference = np.abs(results['vectorized'] / results['step'] - 1).max()
+    print(f'{steps} steps, max relative difference {difference:.2e}')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-c', '--config', default='config-example.yml')
+    parser.add_argument(
+        '-s', '--strategy',
+        default='equal-weight',
+        choices=strategies.keys(),
+    )
+    parser.add_argument('-i', '--interval', default=86400, type=int)
+    parser.add_argument('-n', '--number', default=5, type=int)
+    main(parser.parse_args())
@@ -1,21 +1,35 @@
 # -*- coding: utf-8 -*-
 import logging
 from argparse import ArgumentParser
+from contextlib import nullcontext
+
+from pandas import Timestamp
 
 from moneybot import config
 from moneybot import load_config
 from moneybot.evaluate import evaluate
 from moneybot.examples.strategies import BuffedCoinStrategy
 from moneybot.examples.strategies import BuyHoldStrategy
+from moneybot.examples.strategies import EqualWeightStrategy
 from moneybot.examples.strategies import PeakRiderStrategy
 from moneybot.fund import Fund
 from moneybot.market.adapters.backtest import BacktestMarketAdapter
+from moneybot.market.fills import ExecutionModel
+from moneybot.market.fills import realistic
 from moneybot.market.history import MarketHistory
+from moneybot.market.store import ChartStore
+from moneybot.market.store import ColumnarMarketHistory
+
 
+fill_models = {
+    'ideal': ExecutionModel,
+    'realistic': realistic,
+}
 
 strategies = {
     'buffed-coin': BuffedCoinStrategy,
     'buy-hold': BuyHoldStrategy,
+    'equal-weight': EqualWeightStrategy,
     'peak-rider': PeakRiderStrategy,
 }
 
@@ -28,20 +42,34 @@ def main(args):
         fiat,
         config.read_int('trading.interval'),
     )
-    adapter = BacktestMarketAdapter(
-        fiat,
-        MarketHistory(),
-        {'BTC': 1.0},
-    )
-    fund = Fund(strategy, adapter)
+    start, end = '2017-01-01', '2017-06-29'
+    if args.snapshot:
+        store = ChartStore.load(args.snapshot)
+    else:
+        # Load the whole backtest range into memory once, rather than
+        # querying Postgres on every step
+        store = MarketHistory().chart_store(Timestamp(start), Timestamp(end))
+    # Every worker is sent the Fund, and so the store; shared, that's just
+    # the path of one copy in shared memory
+    shared = store.shared() if args.workers > 1 else nullcontext(store)
+    with shared as store:
+        history = ColumnarMarketHistory(store)
+        adapter = BacktestMarketAdapter(
+            fiat,
+            history,
+            {'BTC': 1.0},
+            fill_models[args.fills](),
+        )
+        fund = Fund(strategy, adapter)
 
-    summary = evaluate(
-        fund,
-        '2017-01-01',
-        '2017-06-29',
-        duration_days=30,
-        window_distance_days=14,
-    )
+        summary = evaluate(
+            fund,
+            start,
+            end,
+            duration_days=30,
+            window_distance_days=14,
+            workers=args.workers,
+        )
 
     print(summary)
 
@@ -67,6 +95,26 @@ if __name__ == '__main__':
         type=str,
         choices=strategies.keys(),
     )
+    parser.add_argument(
+        '-w', '--workers',
+        default=1,
+        type=int,
+        help='number of processes to run backtest windows in',
+    )
+    parser.add_argument(
+        '--fills',
+        default='ideal',
+        type=str,
+        choices=fill_models.keys(),
+        help='fill orders at their price with no fees, or with fees, '
+        'slippage and a candle of delay',
+    )
+    parser.add_argument(
+        '--snapshot',
+        type=str,
+        help='read charts from a file made by examples/export_charts.py '
+        'instead of Postgres',
+    )
 
     args = parser.parse_args()
     logging.getLogger().setLevel(args.log_level)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import logging
+from argparse import ArgumentParser
+from datetime import datetime
+
+from pandas import Timestamp
+
+from moneybot import load_config
+from moneybot.market.history import MarketHistory
+
+
+def main(args):
+    load_config(args.config)
+    store = MarketHistory().chart_store(
+        Timestamp(args.start),
+        Timestamp(args.end),
+        days_back=args.days_back,
+    )
+    store.save(args.output)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Save a range of scraped_chart to a snapshot file, for '
+        'backtesting without Postgres (see examples/backtest.py --snapshot)',
+    )
+    parser.add_argument(
+        '-c', '--config',
+        default='config-example.yml',
+        type=str,
+        help='path to config file',
+    )
+    parser.add_argument(
+        '-l', '--log-level',
+        default='INFO',
+        type=str,
+        choices=['NOTSET', 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Python logging level',
+    )
+    parser.add_argument('-s', '--start', default='2017-01-01', type=str)
+    parser.add_argument(
+        '-e', '--end',
+        default=f'{datetime.now():%Y-%m-%d}',
+        type=str,
+    )
+    parser.add_argument(
+        '-d', '--days-back',
+        default=30,
+        type=int,
+        help='days of history before START to include, for lookbacks',
+    )
+    parser.add_argument('-o', '--output', required=True, type=str)
+
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger('staticconf.config').setLevel(logging.WARNING)
+    main(args)
@@ -8,7 +8,10 @@ from moneybot.examples.strategies import BuffedCoinStrategy
 from moneybot.examples.strategies import BuyHoldStrategy
 from moneybot.examples.strategies import PeakRiderStrategy
 from moneybot.fund import Fund
+from moneybot.instrumentation import FileExporter
+from moneybot.instrumentation import HistogramCollector
 from moneybot.market.adapters.poloniex import PoloniexMarketAdapter
+from moneybot.market.cache import CachedMarketHistory
 from moneybot.market.history import MarketHistory
 
 
@@ -27,13 +30,25 @@ def main(args):
         fiat,
         config.read_int('trading.interval'),
     )
+    history = CachedMarketHistory(MarketHistory())
     # TODO: Shouldn't be necessary to provide initial balances for live trading
     adapter = PoloniexMarketAdapter(
         fiat,
-        MarketHistory(),
+        history,
         {},  # Actual balances will be fetched from Poloniex
     )
     fund = Fund(strategy, adapter)
+    if args.metrics:
+        collector = HistogramCollector()
+        collector.add_stats(
+            'moneybot_history_cache',
+            history.stats,
+            counters=('hits', 'misses', 'evictions'),
+        )
+        fund.add_observer(collector)
+        fund.add_observer(
+            FileExporter(collector, args.metrics, args.metrics_format),
+        )
 
     if args.force_rebalance is True:
         confirm = input('Are you sure you want to rebalance your fund? [y/N] ')
@@ -63,6 +78,18 @@ if __name__ == '__main__':
         type=str,
         choices=strategies.keys(),
     )
+    parser.add_argument(
+        '--metrics',
+        type=str,
+        help='file to write step timings, order counts and API latencies '
+        'to after every step',
+    )
+    parser.add_argument(
+        '--metrics-format',
+        default='prometheus',
+        type=str,
+        choices=FileExporter.formats.keys(),
+    )
 
     parser.add_argument(
         '--force-rebalance',
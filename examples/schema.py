@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import logging
+from argparse import ArgumentParser
+from datetime import datetime
+
+from pandas import Timestamp
+
+from moneybot import load_config
+from moneybot.clients import Postgres
+from moneybot.market import schema
+
+
+def main(args):
+    load_config(args.config)
+    with Postgres.connection() as conn, conn.cursor() as cursor:
+        if args.command == 'bootstrap':
+            schema.bootstrap(cursor, Timestamp(args.start), Timestamp(args.end))
+        elif args.command == 'migrate':
+            schema.migrate(cursor, drop=args.drop)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Create the scraped_chart table, or partition an old one',
+    )
+    parser.add_argument(
+        '-c', '--config',
+        default='config-example.yml',
+        type=str,
+        help='path to config file',
+    )
+    parser.add_argument(
+        '-l', '--log-level',
+        default='INFO',
+        type=str,
+        choices=['NOTSET', 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Python logging level',
+    )
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    bootstrap = commands.add_parser(
+        'bootstrap',
+        help='create scraped_chart with monthly partitions from START to END',
+    )
+    bootstrap.add_argument('-s', '--start', default='2017-01-01', type=str)
+    bootstrap.add_argument(
+        '-e', '--end',
+        default=f'{datetime.now():%Y-%m-%d}',
+        type=str,
+    )
+
+    migrate = commands.add_parser(
+        'migrate',
+        help='move an unpartitioned scraped_chart into a partitioned one',
+    )
+    migrate.add_argument(
+        '--drop',
+        action='store_true',
+        help='drop the old table once its rows have been moved',
+    )
+
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger('staticconf.config').setLevel(logging.WARNING)
+    main(args)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import logging
+from argparse import ArgumentParser
+
+from pandas import Timestamp
+
+from moneybot import config
+from moneybot import load_config
+from moneybot.examples.strategies import BuffedCoinStrategy
+from moneybot.examples.strategies import PeakRiderStrategy
+from moneybot.market.history import MarketHistory
+from moneybot.market.store import ChartStore
+from moneybot.sweep import Sweep
+
+
+intervals = [3600, 4 * 3600, 86400]
+
+grids = {
+    'buffed-coin': (BuffedCoinStrategy, {
+        'magic_number': [1.1, 1.25, 1.5, 2, 3],
+        'trade_interval': intervals,
+    }),
+    'peak-rider': (PeakRiderStrategy, {
+        'shortw': [24, 48, 96, 192],
+        'longw': [600, 1200, 2400, 4800],
+        'trade_interval': intervals,
+    }),
+}
+
+
+def main(args):
+    load_config(args.config)
+    fiat = config.read_string('trading.fiat')
+    strategy_cls, grid = grids[args.strategy]
+
+    start, end = '2017-01-01', '2017-06-29'
+    if args.snapshot:
+        store = ChartStore.load(args.snapshot)
+    else:
+        store = MarketHistory().chart_store(Timestamp(start), Timestamp(end))
+
+    sweep = Sweep(
+        strategy_cls,
+        store,
+        start,
+        end,
+        fiat=fiat,
+        duration_days=30,
+        window_distance_days=14,
+    )
+    for row in sweep.run(grid, args.output, workers=args.workers):
+        print(f"{row['config']}: mean ROI {row['mean']:.4f}, "
+              f"sterling ratio {row['sterling_ratio']:.4f}")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument(
+        '-c', '--config',
+        default='config-example.yml',
+        type=str,
+        help='path to config file',
+    )
+    parser.add_argument(
+        '-l', '--log-level',
+        default='INFO',
+        type=str,
+        choices=['NOTSET', 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Python logging level',
+    )
+    parser.add_argument(
+        '-s', '--strategy',
+        default='buffed-coin',
+        type=str,
+        choices=grids.keys(),
+    )
+    parser.add_argument(
+        '-o', '--output',
+        default='sweep.csv',
+        type=str,
+        help='CSV file of results; configurations already in it are skipped',
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        default=1,
+        type=int,
+        help='number of processes to evaluate configurations in',
+    )
+    parser.add_argument(
+        '--snapshot',
+        type=str,
+        help='read charts from a file made by examples/export_charts.py '
+        'instead of Postgres',
+    )
+
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger('staticconf.config').setLevel(logging.WARNING)
+    main(args)
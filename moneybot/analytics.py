@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import warnings
+from typing import Callable
+from typing import Optional
+
+import numpy as np
+from pandas import DataFrame
+
+
+def _divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    '''
+    `numerator / denominator`, or NaN wherever the denominator is 0 or NaN.
+    '''
+    numerator, denominator = np.broadcast_arrays(numerator, denominator)
+    return np.divide(
+        numerator,
+        denominator,
+        out=np.full(numerator.shape, np.nan),
+        where=(denominator != 0) & ~np.isnan(denominator),
+    )
+
+
+def drawdowns(values: np.ndarray) -> np.ndarray:
+    '''
+    How far each value is below the highest value before it, as a fraction
+    of that peak, for every window of a (window x step) array.
+    '''
+    values = np.atleast_2d(values)
+    peaks = np.maximum.accumulate(values, axis=1)
+    return _divide(peaks - values, peaks)
+
+
+def time_under_water(drawdowns: np.ndarray) -> np.ndarray:
+    '''
+    The most consecutive steps each window spent below a previous peak.
+    '''
+    under = drawdowns > 0
+    steps = np.arange(under.shape[1])
+    # The last step at or before each one that was at a peak
+    surfaced = np.maximum.accumulate(np.where(under, -1, steps), axis=1)
+    return (steps - surfaced).max(axis=1, initial=0)
+
+
+def window_metrics(
+    values: np.ndarray,
+    periods_per_year: float = 365,
+    traded: Optional[np.ndarray] = None,
+    risk_free_rate: float = 0.0,
+) -> DataFrame:
+    '''
+    Performance metrics of every window of a (window x step) array of fund
+    values, e.g. one row per backtest window, all of the same length. Returns
+    a DataFrame with a row for each window.
+
+    Volatility and the Sharpe, Sortino and Calmar ratios are annualized,
+    given how many steps there are in a year (365 for daily steps), as is
+    `risk_free_rate`. `traded` is how much (in the same currency as
+    `values`) was traded at each step; without it, turnover is NaN.
+    '''
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    n_windows, n_steps = values.shape
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        returns = values[:, 1:] / values[:, :-1] - 1
+        growth = values[:, -1] / values[:, 0]
+        years = (n_steps - 1) / periods_per_year
+        if years:
+            annual_return = growth ** (1 / years) - 1
+        else:
+            annual_return = np.full(n_windows, np.nan)
+
+    dd = drawdowns(values)
+    # Falls from a peak of 0 (NaN) don't count, as in RunningMetrics
+    max_drawdown = np.fmax.reduce(dd, axis=1, initial=0.0)
+
+    if n_steps > 1:
+        excess = returns.mean(axis=1) - risk_free_rate / periods_per_year
+        downside = np.sqrt((np.minimum(returns, 0) ** 2).mean(axis=1))
+        hit_rate = (returns > 0).mean(axis=1)
+    else:
+        excess = downside = hit_rate = np.full(n_windows, np.nan)
+    if n_steps > 2:
+        volatility = returns.std(axis=1, ddof=1)
+    else:
+        volatility = np.full(n_windows, np.nan)
+    annualize = np.sqrt(periods_per_year)
+
+    if traded is not None:
+        turnover = _divide(
+            np.atleast_2d(traded).sum(axis=1),
+            values.mean(axis=1),
+        )
+    else:
+        turnover = np.full(n_windows, np.nan)
+
+    return DataFrame({
+        'roi': _divide(values[:, -1] - values[:, 0], values[:, 0]),
+        'annual_return': annual_return,
+        'max_drawdown': max_drawdown,
+        'time_under_water': time_under_water(dd),
+        'volatility': volatility * annualize,
+        'sharpe_ratio': _divide(excess, volatility) * annualize,
+        'sortino_ratio': _divide(excess, downside) * annualize,
+        'calmar_ratio': _divide(annual_return, max_drawdown),
+        'turnover': turnover,
+        'hit_rate': hit_rate,
+    })
+
+
+def bootstrap(
+    metrics: DataFrame,
+    statistic: Callable[..., np.ndarray] = np.nanmean,
+    samples: int = 1000,
+    confidence: float = 0.95,
+    seed: Optional[int] = None,
+) -> DataFrame:
+    '''
+    `statistic` (by default, the mean) of every column of `metrics` across
+    windows, with a bootstrap confidence interval: the statistic is worked
+    out for `samples` resamplings (with replacement) of the windows, all at
+    once, and the interval is the central `confidence` of those.
+
+    `statistic` is called with a (sample x window x metric) array and
+    `axis=1`. Returns a DataFrame indexed by metric.
+    '''
+    data = metrics.to_numpy(dtype=float)
+    rng = np.random.RandomState(seed)
+    tail = (1 - confidence) / 2 * 100
+    # Metrics that are all NaN (e.g. turnover, without trades) just get NaN
+    with np.errstate(all='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        estimate = statistic(data[np.newaxis], axis=1)[0]
+        picks = rng.randint(len(data), size=(samples, len(data)))
+        if statistic is np.nanmean:
+            # Count how many times each window is picked in each resampling;
+            # the means are then matrix products, without building every
+            # resampling
+            offsets = np.arange(samples)[:, np.newaxis] * len(data)
+            counts = np.bincount(
+                (picks + offsets).ravel(),
+                minlength=samples * len(data),
+            ).reshape(samples, len(data)).astype(float)
+            known = ~np.isnan(data)
+            estimates = (counts @ np.where(known, data, 0)) / (counts @ known)
+        else:
+            estimates = statistic(data[picks], axis=1)
+        # nanpercentile is much slower, so only where it's needed
+        lower, upper = np.percentile(estimates, [tail, 100 - tail], axis=0)
+        missing = np.isnan(estimates).any(axis=0)
+        if missing.any():
+            lower[missing], upper[missing] = np.nanpercentile(
+                estimates[:, missing],
+                [tail, 100 - tail],
+                axis=0,
+            )
+    return DataFrame(
+        {'estimate': estimate, 'lower': lower, 'upper': upper},
+        index=metrics.columns,
+    )
+
+
+def report(
+    values: np.ndarray,
+    periods_per_year: float = 365,
+    traded: Optional[np.ndarray] = None,
+    samples: int = 1000,
+    confidence: float = 0.95,
+    seed: Optional[int] = None,
+) -> DataFrame:
+    '''
+    The mean of every metric in `window_metrics` across windows, with
+    bootstrap confidence intervals.
+    '''
+    metrics = window_metrics(values, periods_per_year, traded)
+    return bootstrap(metrics, samples=samples, confidence=confidence, seed=seed)
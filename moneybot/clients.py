@@ -1,31 +1,202 @@
 # -*- coding: utf-8 -*-
+import os
+from contextlib import contextmanager
+from logging import getLogger
+from threading import BoundedSemaphore
+from threading import Lock
+from time import monotonic
+from time import sleep
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
 import psycopg2
+import tenacity
+from psycopg2.pool import ThreadedConnectionPool
 from pyloniex import PoloniexPrivateAPI
 from pyloniex import PoloniexPublicAPI
+from pyloniex.api import _retry_poloniex_error
+from pyloniex.errors import PoloniexRequestError
+from pyloniex.errors import PoloniexServerError
+from pyloniex.utils import protect_floats
+from requests import Request
 
 from moneybot import config
 
 
+logger = getLogger(__name__)
+
+
 class Postgres:
+    '''
+    A pool of Postgres connections, shared by every thread in the process.
+
+    Check a connection out for the length of a `with` block:
+
+        with Postgres.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(...)
+
+    Connections that have been idle for `postgres.health_check_seconds` are
+    pinged before they're handed out, and broken ones are replaced. A forked
+    child process (e.g. a parallel backtest) starts a pool of its own.
+    '''
+
+    _pool: Optional[Tuple[ThreadedConnectionPool, BoundedSemaphore]] = None
+    _pid: Optional[int] = None
+    _lock = Lock()
+    _last_used: Dict[int, float] = {}
 
-    _client = None
+    @classmethod
+    def get_pool(cls) -> ThreadedConnectionPool:
+        return cls._get_pool()[0]
+
+    @classmethod
+    def _get_pool(cls) -> Tuple[ThreadedConnectionPool, BoundedSemaphore]:
+        with cls._lock:
+            # Connections inherited from a parent process are still the
+            # parent's to use, so leave them alone and start afresh
+            if cls._pool is None or cls._pid != os.getpid():
+                pool_max = config.read_int('postgres.pool_max', default=8)
+                pool = ThreadedConnectionPool(
+                    config.read_int('postgres.pool_min', default=1),
+                    pool_max,
+                    host=config.read_string('postgres.host'),
+                    port=config.read_int('postgres.port'),
+                    dbname=config.read_string('postgres.dbname'),
+                    user=config.read_string('postgres.username'),
+                    password=config.read_string('postgres.password'),
+                )
+                # The pool raises rather than waits when it's exhausted, so
+                # we do the waiting
+                cls._pool = (pool, BoundedSemaphore(pool_max))
+                cls._pid = os.getpid()
+                cls._last_used = {}
+            return cls._pool
+
+    @classmethod
+    def _is_healthy(cls, conn) -> bool:
+        if conn.closed:
+            return False
+        idle = monotonic() - cls._last_used.get(id(conn), 0)
+        if idle < config.read_float('postgres.health_check_seconds', default=30):
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @classmethod
+    def _checkout(cls, pool: ThreadedConnectionPool):
+        # After a restart every idle connection may be dead, so keep going
+        # until one works: at worst, once through the pool, and then once
+        # more for a new connection
+        for _ in range(pool.maxconn + 1):
+            conn = pool.getconn()
+            if cls._is_healthy(conn):
+                return conn
+            logger.warning('Replacing broken Postgres connection')
+            cls._last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError('No working Postgres connection')
 
     @classmethod
-    def get_client(cls):
-        if cls._client is None:
-            host = config.read_string('postgres.host')
-            port = config.read_int('postgres.port')
-            user = config.read_string('postgres.username')
-            pswd = config.read_string('postgres.password')
-            dbname = config.read_string('postgres.dbname')
-            cls._client = psycopg2.connect(
-                host=host,
-                port=port,
-                dbname=dbname,
-                user=user,
-                password=pswd,
+    @contextmanager
+    def connection(cls) -> Iterator:
+        '''
+        Check a connection out of the pool. It is committed when the block
+        exits normally and rolled back if it raises.
+        '''
+        pool, slots = cls._get_pool()
+        slots.acquire()
+        try:
+            conn = cls._checkout(pool)
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                if conn.closed:
+                    cls._last_used.pop(id(conn), None)
+                else:
+                    cls._last_used[id(conn)] = monotonic()
+                pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            slots.release()
+
+
+class SerializedPrivateAPI(PoloniexPrivateAPI):
+    '''
+    A PoloniexPrivateAPI that can be shared between threads, e.g. those
+    OrderScheduler submits orders on.
+
+    Poloniex rejects any request whose nonce isn't higher than the last one
+    it saw. pyloniex takes the nonce from the clock before waiting on its
+    rate limiter and sending, and resends the same nonce when it retries, so
+    concurrent requests could arrive out of order. Here requests wait on a
+    shared rate limiter and back off between retries on their own; only
+    taking a nonce and sending happen under one lock, and every attempt gets
+    a fresh nonce. Nonces go up even if the clock doesn't.
+    '''
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._lock = Lock()
+        self._limiter = RateLimiter(self._requests_per_second)
+        self._last_nonce = 0
+
+    # Locks can't be copied or pickled (e.g. along with a Fund, per backtest
+    # window); copies get their own
+    def __getstate__(self) -> Dict:
+        state = dict(self.__dict__)
+        del state['_lock']
+        del state['_limiter']
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._lock = Lock()
+        self._limiter = RateLimiter(self._requests_per_second)
+
+    # The same retries as pyloniex's `request`
+    @tenacity.retry(
+        retry=tenacity.retry_if_exception(_retry_poloniex_error),
+        wait=tenacity.wait_exponential() + tenacity.wait_random(0, 1),
+        stop=tenacity.stop_after_attempt(4) | tenacity.stop_after_delay(8),
+        reraise=True,
+    )
+    def private_request(self, params: Dict[str, Any]):
+        cls = type(self)
+        data = protect_floats(params)
+        self._limiter.wait()
+        with self._lock:
+            nonce = max(cls.nonce(), self._last_nonce + 1)
+            self._last_nonce = nonce
+            data['nonce'] = nonce
+            prepared = self._session.prepare_request(
+                Request('POST', cls.host, data=data),
             )
-        return cls._client
+            response = self._session.send(prepared)
+
+        status = response.status_code
+        if 200 <= status < 300:
+            try:
+                return response.json()
+            except ValueError:
+                logger.exception('Error decoding response JSON')
+                return None
+        elif 400 <= status < 500:
+            raise PoloniexRequestError(response)
+        elif status >= 500:
+            raise PoloniexServerError(response)
+        return None
 
 
 class Poloniex:
@@ -35,7 +206,7 @@ class Poloniex:
     @classmethod
     def get_private(cls) -> PoloniexPrivateAPI:
         if cls._private is None:
-            cls._private = PoloniexPrivateAPI(
+            cls._private = SerializedPrivateAPI(
                 key=config.read_string('poloniex.key'),
                 secret=config.read_string('poloniex.secret'),
             )
@@ -48,3 +219,35 @@ class Poloniex:
         if cls._public is None:
             cls._public = PoloniexPublicAPI()
         return cls._public
+
+
+class RateLimiter:
+    '''
+    A token bucket that can be shared between threads, e.g. to keep several
+    concurrent API clients under one exchange-wide request limit.
+
+    `wait()` blocks until the caller may make a request. At most `burst`
+    requests go out at once, and `per_second` after that.
+    '''
+
+    def __init__(self, per_second: float, burst: float = 1) -> None:
+        self._per_second = per_second
+        self._burst = burst
+        self._tokens = burst
+        self._last = monotonic()
+        self._lock = Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(
+                self._burst,
+                self._tokens + (now - self._last) * self._per_second,
+            )
+            self._last = now
+            # Taking a token we don't have yet reserves the next one, so
+            # waiting threads are let through in the order they arrived
+            self._tokens -= 1
+            delay = -self._tokens / self._per_second
+        if delay > 0:
+            sleep(delay)
@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
 from logging import getLogger
 from typing import List
 from typing import Iterable
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
 
 from numpy import mean
 from pandas import date_range
@@ -9,61 +15,133 @@ from pandas import Series
 from pandas import Timestamp
 
 from moneybot.fund import Fund
+from moneybot.instrumentation import HistogramCollector
+from moneybot.metrics import RunningMetrics
 
 
 logger = getLogger(__name__)
 
+# The Fund being backtested in this process, set up once per worker
+_fund: Optional[Fund] = None
 
-def roi(values: List[float]) -> float:
-    return (values[-1] - values[0]) / values[0]
 
+def roi(values: Iterable[float]) -> float:
+    return RunningMetrics.of(values).roi
 
-def max_drawdown(values: List[float]) -> float:
-    maximum = max(values)
-    idxmax = values.index(maximum)
-    subsequent = values[idxmax:]
-    return (maximum - min(subsequent)) / maximum
+
+def max_drawdown(values: Iterable[float]) -> float:
+    return RunningMetrics.of(values).max_drawdown
+
+
+def _metrics(results: Union[RunningMetrics, Iterable[float]]) -> RunningMetrics:
+    if isinstance(results, RunningMetrics):
+        return results
+    return RunningMetrics.of(results)
 
 
 def sterling_ratio(
-    many_values: List[List[float]],
+    many_results: Sequence[Union[RunningMetrics, Iterable[float]]],
     days_per_simulation: int,
     risk_free_rate: float = 0.0091,
 ) -> float:
+    '''
+    `many_results` are the backtests' RunningMetrics (as `backtests` yields)
+    or their lists of values.
+    '''
     rate_per_day = risk_free_rate / 90
     adjusted_rate = rate_per_day * days_per_simulation
-    rs = [roi(v) for v in many_values]
-    max_drawdowns = list(map(max_drawdown, many_values))
+    many_metrics = [_metrics(results) for results in many_results]
+    rs = [metrics.roi for metrics in many_metrics]
+    max_drawdowns = [metrics.max_drawdown for metrics in many_metrics]
     return (mean(rs) - adjusted_rate) / mean(max_drawdowns)
 
 
-# # return over max drawdown
-# def RoMaD (values):
-#     my_roi = roi(values)
-#     max_dd = max_drawdown(values)
-#     if max_dd != 0:
-#         return  my_roi / max_dd
-#     return my_roi
-
-
 def summary(
-    many_values: List[List[float]],
+    many_results: Sequence[Union[RunningMetrics, Iterable[float]]],
     days_per_simulation: int,
 ) -> Series:
-    rois = Series([roi(values) for values in many_values])
+    many_metrics = [_metrics(results) for results in many_results]
+    rois = Series([metrics.roi for metrics in many_metrics])
     rois_desc = rois.describe()
-    rois_desc['sterling_ratio'] = sterling_ratio(many_values, days_per_simulation)
+    rois_desc['sterling_ratio'] = sterling_ratio(many_metrics, days_per_simulation)
     return rois_desc
 
 
+def backtest(fund: Fund, start_time: str, end_time: str) -> RunningMetrics:
+    '''
+    Backtests `fund` from `start_time` to `end_time`, keeping only the
+    metrics of its values rather than every one of them.
+    '''
+    logger.info(f'Testing from {start_time} to {end_time}')
+    return RunningMetrics.of(fund.run_backtest(start_time, end_time))
+
+
 def backtests(
         fund: Fund,
-        start_times: List[str]
-) -> Iterable[List[float]]:
-    for i, start_time in enumerate(start_times[:-1]):
-        end_time = start_times[i + 1]
-        logger.info(f'Testing from {start_time} to {end_time}')
-        yield list(fund.run_backtest(start_time, end_time))
+        start_times: List[str],
+        workers: int = 1,
+) -> Iterable[RunningMetrics]:
+    '''
+    Backtests `fund` over each window between consecutive `start_times`,
+    yielding the RunningMetrics of each. (This used to yield each window's
+    list of values; `summary` and `sterling_ratio` take either.)
+
+    Every window starts from its own copy of `fund` (and so its own
+    MarketAdapter balances and Strategy state), which keeps windows
+    independent and lets them run in `workers` processes at once. `fund` is
+    handed to each worker once, when it starts, rather than with every
+    window. Results are yielded in window order either way.
+
+    The copies report to `fund`'s HistogramCollectors: directly, or from
+    workers by merging what each window collected once it's done.
+    '''
+    end_times = start_times[1:]
+    start_times = start_times[:-1]
+    if workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(fund,),
+        ) as executor:
+            windows = executor.map(_backtest_window, start_times, end_times)
+            for metrics, collected in windows:
+                for collector, window in zip(_collectors(fund), collected):
+                    collector.merge(window)
+                yield metrics
+    else:
+        for start_time, end_time in zip(start_times, end_times):
+            yield backtest(deepcopy(fund), start_time, end_time)
+
+
+def _init_worker(fund: Fund) -> None:
+    global _fund
+    _fund = fund
+
+
+def _collectors(fund: Fund) -> List[HistogramCollector]:
+    return [
+        observer for observer in fund.instrumentation.observers
+        if isinstance(observer, HistogramCollector)
+    ]
+
+
+def _backtest_window(
+    start_time: str,
+    end_time: str,
+) -> Tuple[RunningMetrics, List[HistogramCollector]]:
+    '''
+    Backtests a copy of this worker's Fund, returning its metrics and what
+    the copy's collectors gathered in this window alone.
+    '''
+    assert _fund is not None
+    collected = {
+        id(collector): HistogramCollector(collector.buckets)
+        for collector in _collectors(_fund)
+    }
+    # Copy the Fund with fresh collectors in place of its own
+    fund = deepcopy(_fund, dict(collected))
+    metrics = backtest(fund, start_time, end_time)
+    return metrics, list(collected.values())
 
 
 def evaluate(
@@ -72,9 +150,10 @@ def evaluate(
     end_date: str,
     duration_days: int = 90,
     window_distance_days: int = 30,
+    workers: int = 1,
 ) -> Series:
     start = Timestamp(start_date)
     end = Timestamp(end_date)
     start_times = date_range(start, end, freq='{!s}d'.format(window_distance_days))
-    backtest_results = list(backtests(fund, start_times))
+    backtest_results = list(backtests(fund, start_times, workers))
     return summary(backtest_results, duration_days)
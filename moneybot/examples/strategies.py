@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 from typing import Dict
-from typing import Tuple
+from typing import List
 
+import numpy as np
 from numpy import median
-from pandas import DataFrame
-from pandas import Series
 
+from moneybot.indicators import IndicatorCache
+from moneybot.market import format_currency_pair
 from moneybot.strategy import Strategy
+from moneybot.vectorized import equal_weights
 
 
 class BuyHoldStrategy(Strategy):
@@ -20,12 +22,31 @@ class BuyHoldStrategy(Strategy):
         # if we hold things other than BTC, hold.
         return
 
+    def target_weights(self, prices, holdings):
+        # Rebalance once, at the start, if all we have is fiat
+        rebalance = np.zeros(len(prices), dtype=bool)
+        held = np.flatnonzero(holdings > 0)
+        rebalance[:1] = list(held) == [0]
+        return equal_weights(prices), rebalance
+
+
+class EqualWeightStrategy(Strategy):
+    '''
+    Rebalance to an equal value of every available coin at every step.
+    '''
+
+    def propose_trades(self, market_state, market_history):
+        return self.propose_trades_for_total_rebalancing(market_state)
+
+    def target_weights(self, prices, holdings):
+        return equal_weights(prices), np.ones(len(prices), dtype=bool)
+
 
 class BuffedCoinStrategy(Strategy):
 
-    # HACK HACK HACK HACK HACK
-    magic_number = 1.5  # HACK
-    # HACK HACK HACK HACK HACK
+    # How many times the median value a coin must be worth to be buffed; set
+    # it on an instance to tune it (e.g. in a sweep)
+    magic_number = 1.5
 
     def median(self, est_values: Dict[str, float]) -> float:
         return median(list(est_values.values()))
@@ -36,7 +57,7 @@ class BuffedCoinStrategy(Strategy):
         coin_values: Dict[str, float]
     ) -> bool:
         median_value = self.median(coin_values)
-        return coin_values[coin] > (median_value * type(self).magic_number)
+        return coin_values[coin] > (median_value * self.magic_number)
 
     def find_buffed_coins(self, market_state):
         est_values = market_state.estimate_values(
@@ -67,40 +88,14 @@ class BuffedCoinStrategy(Strategy):
 
 class PeakRiderStrategy(BuffedCoinStrategy):
 
-    def emas(
-        self,
-        price_series: Series,
-        shortw=96,
-        longw=2400,
-        **kwargs,
-    ) -> Tuple[Series, Series]:
-        long_ema = price_series.ewm(com=longw).mean()
-        short_ema = price_series.ewm(com=shortw).mean()
-        return long_ema, short_ema
-
-    def percentage_price_oscillator(
-        self,
-        price_series: Series,
-        **kwargs,
-    ) -> Series:
-        longe, shorte = self.emas(price_series, **kwargs)
-        ppo = (shorte - longe) / longe
-        return ppo
-
-    def ppo_histogram(
-        self,
-        price_series: Series,
-        **kwargs,
-    ) -> DataFrame:
-        ppo = self.percentage_price_oscillator(price_series)
-        ppo_ema = ppo.ewm(com=9).mean()
-        ppo_hist = DataFrame(ppo - ppo_ema)
-        return ppo_hist
-
-    def latest_ppo_hist(self, price_series: Series) -> float:
-        ppo_hist = self.ppo_histogram(price_series)
-        latest = ppo_hist.iloc[-1].values[0]
-        return latest
+    # Centres of mass of the short and long EMAs behind the PPO histogram
+    shortw = 96
+    longw = 2400
+
+    def __init__(self, fiat: str, trade_interval: int) -> None:
+        super().__init__(fiat, trade_interval)
+        # EMA state for every coin we've checked, fed one candle at a time
+        self.indicators = IndicatorCache(warmup_days=30)
 
     def is_buffed(self, coin: str, coin_values: Dict[str, float]) -> bool:
         # HACK HACK HACK HACK HACK
@@ -117,15 +112,24 @@ class PeakRiderStrategy(BuffedCoinStrategy):
                 return True
         return False
 
+    def crashing_coins(self, coins, time, market_history) -> List[str]:
+        pairs = {
+            coin: format_currency_pair(self.fiat, coin)
+            for coin in coins
+            if coin != self.fiat
+        }
+        # One history lookup for all of them
+        latest = self.indicators.ppo_histograms(
+            market_history,
+            time,
+            list(pairs.values()),
+            shortw=self.shortw,
+            longw=self.longw,
+        )
+        return [coin for coin, pair in pairs.items() if latest[pair] > 0]
+
     def is_crashing(self, coin, time, market_history):
-        if coin == self.fiat:
-            prices = market_history.asset_history(time, 'USD', self.fiat)
-        else:
-            prices = market_history.asset_history(time, self.fiat, coin)
-            latest = self.latest_ppo_hist(prices)
-            if latest > 0:
-                return True
-            return False
+        return coin in self.crashing_coins([coin], time, market_history)
 
     def propose_trades(self, market_state, market_history):
         # First of all, if we only hold fiat,
@@ -136,12 +140,11 @@ class PeakRiderStrategy(BuffedCoinStrategy):
         # If we do have stuff other than fiat,
         # see if any of those holdings are buffed
         buffed_coins = self.find_buffed_coins(market_state)
-        buffed_and_crashing = [
-            coin
-            for coin
-            in buffed_coins
-            if self.is_crashing(coin, market_state.time, market_history)
-        ]
+        buffed_and_crashing = self.crashing_coins(
+            buffed_coins,
+            market_state.time,
+            market_history,
+        )
         # if any of them are,
         if len(buffed_and_crashing):
             # sell them so as to reallocate their value eqaully
@@ -1,15 +1,18 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
 from logging import getLogger
+from time import perf_counter
 from time import sleep
 from time import time
 from typing import Generator
-from copy import deepcopy
 
 import pandas as pd
 from pyloniex.errors import PoloniexServerError
 
+from moneybot.instrumentation import Instrumentation
+from moneybot.instrumentation import Observer
 from moneybot.market.adapters import MarketAdapter
+from moneybot.market.scheduler import OrderScheduler
 from moneybot.strategy import Strategy
 
 
@@ -39,79 +42,112 @@ class Fund:
         self.strategy = strategy
         # MarketAdapter executes trades, fetches balances
         self.market_adapter = adapter
+        # OrderScheduler submits independent orders concurrently, where the
+        # adapter allows it
+        self.order_scheduler = OrderScheduler(adapter)
         # MarketHistory stores historical market data
         self.market_history = adapter.market_history
         # A boolean the caller can set
         # to force a rebalance on the next trading step
         # (after that rebalance, this will be reset to `False`)
         self.force_rebalance_next_step = False
+        # Passes timings and counts from each step on to any observers
+        self.instrumentation = Instrumentation()
+
+    def add_observer(self, observer: Observer) -> None:
+        '''
+        Have `observer` receive how long each phase of every step takes, how
+        many orders are attempted and filled, and the latency of every call
+        the MarketAdapter makes to the market history and exchange.
+        '''
+        if not self.instrumentation:
+            # Only pay for timing API calls once somebody is listening
+            self.market_adapter.instrument(self.instrumentation)
+            self.market_history = self.market_adapter.market_history
+        self.instrumentation.observers.append(observer)
 
     def step(
         self,
         time: datetime,
         force_rebalance: bool = False,
     ) -> float:
-        self.market_adapter.update_market_state(time)
-        # Copy MarketState to prevent mutation by the Strategy (even
-        # accidentally). The Strategy's sole means of communication with the
-        # MarketAdapter and Fund is the list of ProposedTrades it creates.
-        # TODO: Make this unnecessary, either by making MarketState immutable
-        # or by other means.
-        market_state = deepcopy(self.market_adapter.market_state)
-
-        if force_rebalance is True:
-            proposed_trades = self.strategy.propose_trades_for_total_rebalancing(market_state)
-        else:
-            # Generally, the Strategy decides when to rebalance. If you're
-            # writing your own, this is the method you'll implement!
-            proposed_trades = self.strategy.propose_trades(
-                market_state,
-                self.market_history,
-            )
+        instrumentation = self.instrumentation
+        step_start = perf_counter()
+        with instrumentation.phase('update_market_state'):
+            self.market_adapter.update_market_state(time)
+        # Take a read-only snapshot of the MarketState to prevent mutation by
+        # the Strategy (even accidentally). The Strategy's sole means of
+        # communication with the MarketAdapter and Fund is the list of
+        # ProposedTrades it creates.
+        with instrumentation.phase('snapshot'):
+            market_state = self.market_adapter.market_state.snapshot()
+
+        with instrumentation.phase('propose_trades'):
+            if force_rebalance is True:
+                proposed_trades = self.strategy.propose_trades_for_total_rebalancing(market_state)
+            else:
+                # Generally, the Strategy decides when to rebalance. If you're
+                # writing your own, this is the method you'll implement!
+                proposed_trades = self.strategy.propose_trades(
+                    market_state,
+                    self.market_history,
+                )
 
         if proposed_trades:
             # We "reify" (n. make (something abstract) more concrete or real)
             # our proposed AbstractTrades to produce Orders that our
             # MarketAdapter actually knows how to execute.
-            orders = self.market_adapter.reify_trades(
-                proposed_trades,
-                market_state,
-            )
+            with instrumentation.phase('reify_trades'):
+                orders = self.market_adapter.reify_trades(
+                    proposed_trades,
+                    market_state,
+                )
             logger.debug(
                 f'Attempting to execute {len(orders)} orders based on '
                 f'{len(proposed_trades)} proposed trades'
             )
-            successful_order_ids = []
-            for order in orders:
-                # Each concrete subclass of MarketAdapter decides what it means
-                # to execute an order. For example, PoloniexMarketAdapter
-                # actually sends requests to Poloniex's trading API, but
-                # BacktestMarketAdapter just mutates some of its own internal
-                # state.
-                #
-                # In general we don't want this to be side-effect-y, so the way
-                # BacktestMarketAdapter is a little gross. We should try to fix
-                # that.
-                #
-                # MarketAdapter::execute_order returns an Optional[int] that we
-                # currently ignore: an order identifier if the execution was
-                # "successful" (whatever that means for the adapter subclass),
-                # or None otherwise.
-                order_id = self.market_adapter.execute_order(order)
-                if order_id is not None:
-                    successful_order_ids.append(order_id)
+            # Each concrete subclass of MarketAdapter decides what it means
+            # to execute an order. For example, PoloniexMarketAdapter
+            # actually sends requests to Poloniex's trading API, but
+            # BacktestMarketAdapter just mutates some of its own internal
+            # state.
+            #
+            # In general we don't want this to be side-effect-y, so the way
+            # BacktestMarketAdapter is a little gross. We should try to fix
+            # that.
+            #
+            # The OrderScheduler submits orders that don't depend on each
+            # other (e.g. a rebalance's sells into fiat) at once, and the
+            # orders spending their proceeds once they've filled. We
+            # currently only count the OrderResults it returns.
+            with instrumentation.phase('execute_orders'):
+                results = self.order_scheduler.run(orders)
+            for result in results:
+                logger.debug(f'{result}')
+            filled = sum(result.filled for result in results)
             logger.info(
-                f'{len(successful_order_ids)} of {len(orders)} orders '
-                'executed successfully'
+                f'{filled} of {len(orders)} orders executed successfully'
             )
+            if instrumentation:
+                for result in results:
+                    instrumentation.on_order(
+                        result.order.market,
+                        result.filled,
+                        result.seconds,
+                    )
+                instrumentation.on_orders(len(orders), filled)
 
         # After the dust has settled, we update our view of the market state.
-        self.market_adapter.update_market_state(time)
+        with instrumentation.phase('refresh_market_state'):
+            self.market_adapter.update_market_state(time)
 
         # Finally, return the aggregate USD value of our fund.
-        return self.market_adapter.market_state.estimate_total_value_usd(
+        value = self.market_adapter.market_state.estimate_total_value_usd(
             self.market_adapter.market_state.balances,
         )
+        if instrumentation:
+            instrumentation.on_step(time, perf_counter() - step_start, value)
+        return value
 
     def run_live(self):
         period = self.strategy.trade_interval
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from datetime import timedelta
+from logging import getLogger
+from math import isnan
+from math import nan
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import List
+
+from pandas import Timestamp
+
+from moneybot.market.store import to_datetime64
+
+
+logger = getLogger(__name__)
+
+
+class EMA:
+    '''
+    An exponential moving average, updated one value at a time.
+
+    Agrees with pandas' `Series.ewm(com=com).mean()` (`adjust=True`),
+    including how it treats missing values: a NaN adds no weight of its own,
+    but still decays the weight of everything before it.
+    '''
+
+    def __init__(self, com: float) -> None:
+        self._decay = com / (1 + com)  # i.e. 1 - alpha
+        self._num = 0.0
+        self._den = 0.0
+
+    def update(self, value: float) -> float:
+        self._num *= self._decay
+        self._den *= self._decay
+        if not isnan(value):
+            self._num += value
+            self._den += 1
+        return self.value
+
+    @property
+    def value(self) -> float:
+        if not self._den:
+            return nan
+        return self._num / self._den
+
+
+class PPOHistogram:
+    '''
+    The percentage price oscillator histogram: the PPO (short EMA - long EMA,
+    over the long EMA) minus an EMA of the PPO itself, updated one price at a
+    time.
+    '''
+
+    def __init__(
+        self,
+        shortw: float = 96,
+        longw: float = 2400,
+        signalw: float = 9,
+    ) -> None:
+        self._short = EMA(shortw)
+        self._long = EMA(longw)
+        self._signal = EMA(signalw)
+        self._value = nan
+
+    def update(self, price: float) -> float:
+        short = self._short.update(price)
+        long = self._long.update(price)
+        ppo = (short - long) / long
+        self._value = ppo - self._signal.update(ppo)
+        return self._value
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class IndicatorCache:
+    '''
+    Keeps indicator state per (currency pair, indicator, parameters), so a
+    Strategy can ask for an indicator at every step and only pay for the
+    candles that arrived since it last asked. Asking for many pairs at once
+    costs a single `asset_histories` call.
+
+    The first time an indicator is requested it is warmed up with
+    `warmup_days` of history. If it is later requested for an earlier time
+    (e.g. a new backtest window) it starts over.
+    '''
+
+    def __init__(self, warmup_days: float = 30) -> None:
+        self.warmup_days = warmup_days
+        self._indicators: Dict[Hashable, Any] = {}
+        self._last_seen: Dict[Hashable, Timestamp] = {}
+
+    def _update(
+        self,
+        kind: Hashable,
+        factory: Callable[[], Any],
+        market_history,
+        time: datetime,
+        currency_pairs: List[str],
+    ) -> Dict[str, float]:
+        '''
+        Bring the `kind` indicator for each of `currency_pairs` up to `time`,
+        fetching every pair's new candles with one `asset_histories` call.
+        '''
+        time = Timestamp(to_datetime64(time))
+        since = {}
+        for pair in currency_pairs:
+            key = (pair, kind)
+            last_seen = self._last_seen.get(key)
+            if last_seen is None or time < last_seen:
+                self._indicators[key] = factory()
+                self._last_seen.pop(key, None)
+                last_seen = time - timedelta(days=self.warmup_days)
+            if last_seen < time:
+                since[pair] = last_seen
+
+        if since:
+            days_back = (time - min(since.values())) / timedelta(days=1)
+            prices = market_history.asset_histories(
+                time,
+                list(since),
+                days_back,
+            ).sort_index()
+            for pair, last_seen in since.items():
+                # Only feed candles we haven't seen, oldest first
+                column = prices[pair].dropna()
+                column = column[(column.index > last_seen) & (column.index <= time)]
+                indicator = self._indicators[(pair, kind)]
+                for price in column.tolist():
+                    indicator.update(price)
+                # Only now, so candles a failed fetch missed are asked for
+                # again next time
+                self._last_seen[(pair, kind)] = time
+            logger.debug(f'Fed {len(prices)} candles to {kind} for {list(since)}')
+
+        return {
+            pair: self._indicators[(pair, kind)].value
+            for pair in currency_pairs
+        }
+
+    def emas(
+        self,
+        market_history,
+        time: datetime,
+        currency_pairs: List[str],
+        com: float,
+    ) -> Dict[str, float]:
+        return self._update(
+            ('ema', com),
+            lambda: EMA(com),
+            market_history,
+            time,
+            currency_pairs,
+        )
+
+    def ema(
+        self,
+        market_history,
+        time: datetime,
+        base: str,
+        quote: str,
+        com: float,
+    ) -> float:
+        pair = f'{base}_{quote}'
+        return self.emas(market_history, time, [pair], com)[pair]
+
+    def ppo_histograms(
+        self,
+        market_history,
+        time: datetime,
+        currency_pairs: List[str],
+        shortw: float = 96,
+        longw: float = 2400,
+        signalw: float = 9,
+    ) -> Dict[str, float]:
+        return self._update(
+            ('ppo_histogram', shortw, longw, signalw),
+            lambda: PPOHistogram(shortw, longw, signalw),
+            market_history,
+            time,
+            currency_pairs,
+        )
+
+    def ppo_histogram(
+        self,
+        market_history,
+        time: datetime,
+        base: str,
+        quote: str,
+        shortw: float = 96,
+        longw: float = 2400,
+        signalw: float = 9,
+    ) -> float:
+        pair = f'{base}_{quote}'
+        return self.ppo_histograms(
+            market_history,
+            time,
+            [pair],
+            shortw,
+            longw,
+            signalw,
+        )[pair]
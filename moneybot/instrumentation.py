@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextlib import nullcontext
+from datetime import datetime
+from logging import getLogger
+from threading import Lock
+from time import perf_counter
+from typing import Any
+from typing import Callable
+from typing import ContextManager
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Sequence
+from typing import Tuple
+
+
+logger = getLogger(__name__)
+
+# Upper bounds of histogram buckets, in seconds; anything slower goes in the
+# implicit +Inf bucket
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+class Observer:
+    '''
+    Receives measurements from a Fund as it steps (see `Fund.add_observer`).
+    Every method does nothing by default, so subclasses implement only what
+    they need.
+
+    Phases of a step are `update_market_state` (the history query and
+    balance lookup), `snapshot`, `propose_trades`, `reify_trades`,
+    `execute_orders` and `refresh_market_state` (after executing). API calls
+    are every call made to the market history (`service` 'market_history')
+    or, for PoloniexMarketAdapter, Poloniex's trading API ('poloniex'),
+    including those made by the strategy and from order threads.
+    '''
+
+    def on_phase(self, phase: str, seconds: float) -> None:
+        pass
+
+    def on_api_call(
+        self,
+        service: str,
+        method: str,
+        seconds: float,
+        error: bool,
+    ) -> None:
+        pass
+
+    def on_order(self, market: str, filled: bool, seconds: float) -> None:
+        pass
+
+    def on_orders(self, attempted: int, filled: int) -> None:
+        pass
+
+    def on_step(self, time: datetime, seconds: float, value: float) -> None:
+        pass
+
+
+class Instrumentation(Observer):
+    '''
+    Passes every measurement on to each of a Fund's observers, in the order
+    they were added. An observer that raises is logged rather than allowed to
+    stop trading.
+    '''
+
+    def __init__(self) -> None:
+        self.observers: List[Observer] = []
+
+    def __bool__(self) -> bool:
+        return bool(self.observers)
+
+    def _notify(self, method: str, *args: Any) -> None:
+        for observer in self.observers:
+            try:
+                getattr(observer, method)(*args)
+            except Exception:
+                logger.exception(f'{observer!r}.{method} raised an error')
+
+    def phase(self, phase: str) -> ContextManager:
+        '''
+        Times the body of a `with` block as `phase`; free when nobody is
+        listening.
+        '''
+        if not self.observers:
+            return nullcontext()
+        return self._timed(phase)
+
+    @contextmanager
+    def _timed(self, phase: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.on_phase(phase, perf_counter() - start)
+
+    def on_phase(self, phase, seconds):
+        self._notify('on_phase', phase, seconds)
+
+    def on_api_call(self, service, method, seconds, error):
+        self._notify('on_api_call', service, method, seconds, error)
+
+    def on_order(self, market, filled, seconds):
+        self._notify('on_order', market, filled, seconds)
+
+    def on_orders(self, attempted, filled):
+        self._notify('on_orders', attempted, filled)
+
+    def on_step(self, time, seconds, value):
+        self._notify('on_step', time, seconds, value)
+
+
+class Instrumented:
+    '''
+    Wraps an API client (or a MarketHistory), reporting how long every
+    method call takes, and whether it raised, to `observer` as calls to
+    `service`. Anything that isn't a method is passed straight through.
+    '''
+
+    def __init__(self, target: Any, service: str, observer: Observer) -> None:
+        self.target = target
+        self.service = service
+        self.observer = observer
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes we don't have; `target` itself may not
+        # be set yet while unpickling
+        if name == 'target':
+            raise AttributeError(name)
+        attribute = getattr(self.target, name)
+        if not callable(attribute):
+            return attribute
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            error = True
+            try:
+                result = attribute(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                self.observer.on_api_call(
+                    self.service,
+                    name,
+                    perf_counter() - start,
+                    error,
+                )
+
+        return timed
+
+
+class Histogram:
+    '''
+    Counts of observations falling under each of `buckets` (upper bounds,
+    ascending), plus their number and sum, as Prometheus histograms keep.
+    '''
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        # The last count is for anything above every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        '''
+        (upper bound, observations at or under it) for every bucket,
+        including +Inf.
+        '''
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> float:
+        '''
+        An estimate of the `q` quantile: the upper bound of the bucket it
+        falls in.
+        '''
+        if not self.count:
+            return float('nan')
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+Labels = Tuple[Tuple[str, str], ...]
+Stats = Callable[[], Dict[str, float]]
+
+
+class HistogramCollector(Observer):
+    '''
+    Aggregates everything a Fund reports into histograms of durations and
+    counters, in constant memory however long it runs. Safe to use from
+    order threads.
+
+    Metrics are named and labelled as they're exported (see
+    `prometheus_text`):
+
+        moneybot_step_seconds
+        moneybot_phase_seconds{phase}
+        moneybot_api_call_seconds{service, method}
+        moneybot_api_errors_total{service, method}
+        moneybot_order_seconds{filled}
+        moneybot_orders_attempted_total
+        moneybot_orders_filled_total
+        moneybot_fund_value_usd
+
+    plus whatever is added with `add_stats`.
+    '''
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self._init_metrics()
+
+    def _init_metrics(self) -> None:
+        self._lock = Lock()
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.gauges: Dict[Tuple[str, Labels], float] = {}
+        self._stats: List[Tuple[str, Stats, Tuple[str, ...]]] = []
+
+    # Copies of a Fund (e.g. evaluate's, one per backtest window) report to
+    # the same collector
+    def __deepcopy__(self, memo: Dict) -> 'HistogramCollector':
+        return self
+
+    # Locks can't be pickled; a pickled collector (e.g. sent back from a
+    # backtest worker to be merged) keeps its metrics, but not its stats
+    def __getstate__(self) -> Dict:
+        with self._lock:
+            return {
+                'buckets': self.buckets,
+                'histograms': dict(self.histograms),
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+            }
+
+    def __setstate__(self, state: Dict) -> None:
+        self.buckets = state['buckets']
+        self._init_metrics()
+        self.histograms.update(state['histograms'])
+        self.counters.update(state['counters'])
+        self.gauges.update(state['gauges'])
+
+    def merge(self, other: 'HistogramCollector') -> None:
+        '''
+        Add `other`'s metrics to ours, e.g. those collected by a copy of the
+        Fund in another process. Gauges take `other`'s values.
+        '''
+        if other.buckets != self.buckets:
+            raise ValueError('Can only merge collectors with the same buckets')
+        with other._lock:
+            histograms = dict(other.histograms)
+            counters = dict(other.counters)
+            gauges = dict(other.gauges)
+        with self._lock:
+            for key, theirs in histograms.items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = Histogram(self.buckets)
+                    self.histograms[key] = histogram
+                histogram.counts = [
+                    a + b for a, b in zip(histogram.counts, theirs.counts)
+                ]
+                histogram.count += theirs.count
+                histogram.sum += theirs.sum
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            self.gauges.update(gauges)
+
+    def _observe(self, name: str, labels: Labels, value: float) -> None:
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = Histogram(self.buckets)
+                self.histograms[(name, labels)] = histogram
+            histogram.observe(value)
+
+    def _increment(self, name: str, labels: Labels, value: float = 1) -> None:
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def on_phase(self, phase, seconds):
+        self._observe('moneybot_phase_seconds', (('phase', phase),), seconds)
+
+    def on_api_call(self, service, method, seconds, error):
+        labels = (('service', service), ('method', method))
+        self._observe('moneybot_api_call_seconds', labels, seconds)
+        if error:
+            self._increment('moneybot_api_errors_total', labels)
+
+    def on_order(self, market, filled, seconds):
+        labels = (('filled', 'true' if filled else 'false'),)
+        self._observe('moneybot_order_seconds', labels, seconds)
+
+    def on_orders(self, attempted, filled):
+        self._increment('moneybot_orders_attempted_total', (), attempted)
+        self._increment('moneybot_orders_filled_total', (), filled)
+
+    def on_step(self, time, seconds, value):
+        self._observe('moneybot_step_seconds', (), seconds)
+        with self._lock:
+            self.gauges[('moneybot_fund_value_usd', ())] = value
+
+    def add_stats(
+        self,
+        name: str,
+        stats: Stats,
+        counters: Sequence[str] = (),
+    ) -> None:
+        '''
+        Export the numbers `stats()` returns, read whenever metrics are, e.g.
+        a CachedMarketHistory's:
+
+            collector.add_stats(
+                'moneybot_history_cache',
+                history.stats,
+                counters=('hits', 'misses', 'evictions'),
+            )
+
+        Each is a gauge named `{name}_{key}`, or for keys in `counters`, a
+        counter named `{name}_{key}_total`. Pickled copies of the collector
+        don't keep them.
+        '''
+        with self._lock:
+            self._stats.append((name, stats, tuple(counters)))
+
+    def _read_stats(self) -> None:
+        with self._lock:
+            sources = list(self._stats)
+        for name, stats, counters in sources:
+            try:
+                values = stats()
+            except Exception:
+                logger.exception(f'Reading {name} stats raised an error')
+                continue
+            with self._lock:
+                for key, value in values.items():
+                    if key in counters:
+                        self.counters[(f'{name}_{key}_total', ())] = value
+                    else:
+                        self.gauges[(f'{name}_{key}', ())] = value
+
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        '''
+        Every metric as plain data: lists of samples under 'histograms',
+        'counters' and 'gauges', each with its name and labels.
+        '''
+        self._read_stats()
+        with self._lock:
+            histograms = [
+                {
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'buckets': [
+                        [str(bound), total]
+                        for bound, total in histogram.cumulative()
+                    ],
+                    'p50': histogram.quantile(0.5),
+                    'p99': histogram.quantile(0.99),
+                }
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ]
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            gauges = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.gauges.items())
+            ]
+        return {
+            'histograms': histograms,
+            'counters': counters,
+            'gauges': gauges,
+        }
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"'),
+        )
+        for name, value in labels.items()
+    )
+    return f'{{{pairs}}}'
+
+
+def _format_bound(bound: str) -> str:
+    return '+Inf' if bound == 'inf' else bound
+
+
+def prometheus_text(collector: HistogramCollector) -> str:
+    '''
+    The collector's metrics in Prometheus' text exposition format.
+    '''
+    snapshot = collector.snapshot()
+    lines: List[str] = []
+    typed = set()
+
+    def declare(name: str, kind: str) -> None:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f'# TYPE {name} {kind}')
+
+    for sample in snapshot['histograms']:
+        name = sample['name']
+        declare(name, 'histogram')
+        for bound, total in sample['buckets']:
+            bucket = dict(sample['labels'], le=_format_bound(bound))
+            lines.append(f'{name}_bucket{_format_labels(bucket)} {total}')
+        labels = _format_labels(sample['labels'])
+        lines.append(f'{name}_sum{labels} {sample["sum"]!r}')
+        lines.append(f'{name}_count{labels} {sample["count"]}')
+    for kind in ('counters', 'gauges'):
+        for sample in snapshot[kind]:
+            name = sample['name']
+            declare(name, 'counter' if kind == 'counters' else 'gauge')
+            labels = _format_labels(sample['labels'])
+            lines.append(f'{name}{labels} {sample["value"]!r}')
+    return '\n'.join(lines) + '\n'
+
+
+def json_text(collector: HistogramCollector) -> str:
+    return json.dumps(collector.snapshot(), indent=2, sort_keys=True)
+
+
+class FileExporter(Observer):
+    '''
+    Writes a collector's metrics to `path` after every step, as Prometheus
+    text (e.g. for node_exporter's textfile collector) or, with
+    `format='json'`, JSON. The file is replaced whole, so readers never see
+    half of it.
+
+    Add it to a Fund after the collector, so each write includes the step
+    just finished.
+    '''
+
+    formats = {
+        'prometheus': prometheus_text,
+        'json': json_text,
+    }
+
+    def __init__(
+        self,
+        collector: HistogramCollector,
+        path: str,
+        format: str = 'prometheus',
+    ) -> None:
+        if format not in self.formats:
+            raise ValueError(f'Unknown metrics format {format!r}')
+        self.collector = collector
+        self.path = path
+        self.format = format
+
+    def write(self) -> None:
+        text = self.formats[self.format](self.collector)
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(text)
+        os.replace(temp_path, self.path)
+
+    def on_step(self, time, seconds, value):
+        self.write()
@@ -3,12 +3,18 @@ from abc import ABCMeta
 from abc import abstractmethod
 from datetime import datetime
 from logging import getLogger
+from typing import Any
 from typing import Dict
 from typing import List
+from typing import Mapping
 from typing import Optional
 
+from moneybot.instrumentation import Instrumented
+from moneybot.instrumentation import Observer
 from moneybot.market import Order
 from moneybot.market.history import MarketHistory
+from moneybot.market.scheduler import OrderFill
+from moneybot.market.scheduler import OrderScheduler
 from moneybot.market.state import MarketState
 from moneybot.trade import AbstractTrade
 
@@ -54,6 +60,25 @@ class MarketAdapter(metaclass=ABCMeta):
     def market_state(self) -> MarketState:
         return self._market_state
 
+    @property
+    def concurrency(self) -> int:
+        '''
+        How many orders may be submitted at once (see OrderScheduler).
+        '''
+        return 1
+
+    def instrument(self, observer: Observer) -> None:
+        """Report the latency of every call to the market history to
+        `observer`. Adapters that call other APIs should time those too.
+        """
+        # Stands in for the MarketHistory it wraps
+        history: Any = Instrumented(
+            self._market_history,
+            'market_history',
+            observer,
+        )
+        self._market_history = history
+
     def update_market_state(self, time: datetime):
         # Get the latest chart data from the market
         charts = self.market_history.latest(time)
@@ -64,8 +89,64 @@ class MarketAdapter(metaclass=ABCMeta):
     def get_balances(self) -> Dict[str, float]:
         raise NotImplementedError
 
+    @classmethod
     @abstractmethod
+    def validate_order(cls, order: Order, balances: Mapping[str, float]):
+        """Raise an OrderValidationError if `order` can't be placed while
+        holding `balances`.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def submit_order(
+        self,
+        order: Order,
+        balances: Mapping[str, float],
+        attempts: int = 8,
+    ) -> Optional[int]:
+        """Place an order already validated against `balances`, returning an
+        order identifier if it was filled or None otherwise.
+        """
+        raise NotImplementedError
+
+    def fill_order(
+        self,
+        order: Order,
+        balances: Mapping[str, float],
+        attempts: int = 8,
+    ) -> OrderFill:
+        """Place an order already validated against `balances` (see
+        `submit_order`), reporting how it was filled, so our balances can be
+        kept up to date without looking them up again.
+
+        By default an order given an identifier is taken to have filled in
+        full at its price; adapters that know better should say so.
+        """
+        order_id = self.submit_order(order, balances, attempts)
+        return OrderFill(order_id, order if order_id is not None else None)
+
+    def prepare_orders(self, orders: List[Order]) -> None:
+        """Called with every order about to be executed together, before any
+        is submitted, for adapters that can do some of the work for all of
+        them at once.
+        """
+        pass
+
     def execute_order(self, order: Order, attempts: int = 8) -> Optional[int]:
         """Execute an order, returning an order identifier.
         """
-        raise NotImplementedError
+        return self.execute_orders([order], attempts)[0]
+
+    def execute_orders(
+        self,
+        orders: List[Order],
+        attempts: int = 8,
+    ) -> List[Optional[int]]:
+        """Execute orders one at a time, in turn, returning an order
+        identifier (or None, if it wasn't filled) for each.
+
+        Balances are looked up once, and the whole list is validated against
+        them up front; see OrderScheduler, which does the work.
+        """
+        results = OrderScheduler(self, max_workers=1).run(orders, attempts)
+        return [result.order_id for result in results]
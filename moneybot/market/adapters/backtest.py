@@ -1,11 +1,21 @@
 # -*- coding: utf-8 -*-
+from datetime import timedelta
 from logging import getLogger
+from typing import Any
 from typing import Dict
+from typing import List
+from typing import Mapping
 from typing import Optional
+from typing import Tuple
 
-from moneybot.errors import OrderValidationError
 from moneybot.market import Order
 from moneybot.market.adapters.poloniex import PoloniexMarketAdapter
+from moneybot.market.fills import Charts
+from moneybot.market.fills import ExecutionModel
+from moneybot.market.fills import OrderBatch
+from moneybot.market.history import MarketHistory
+from moneybot.market.scheduler import OrderFill
+from moneybot.market.store import to_datetime64
 from moneybot.utils import simulate_order
 
 
@@ -14,22 +24,100 @@ logger = getLogger(__name__)
 
 class BacktestMarketAdapter(PoloniexMarketAdapter):
 
+    def __init__(
+        self,
+        fiat: str,
+        history: MarketHistory,
+        initial_balances: Dict[str, float],
+        execution_model: Optional[ExecutionModel] = None,
+    ) -> None:
+        super().__init__(fiat, history, initial_balances)
+        # By default, orders fill in full at their own price with no fees
+        if execution_model is None:
+            execution_model = ExecutionModel()
+        self.execution_model = execution_model
+        # (price, fee) for each prepared order, by id()
+        self._fills: Dict[int, Tuple[float, float]] = {}
+
+    @property
+    def concurrency(self) -> int:
+        # Simulated orders share one set of balances, and take no time
+        return 1
+
     def get_balances(self) -> Dict[str, float]:
-        return self.market_state.balances.copy()
-
-    def execute_order(self, order: Order, attempts: int = 8) -> Optional[int]:
-        try:
-            type(self).validate_order(order, self.market_state.balances)
-        except OrderValidationError as e:
-            logger.warning(f'Order failed validation: {e}')
-            return None
-
-        logger.debug(f'Simulating order: {order}')
-        updated_balances = simulate_order(order, self.market_state.balances)
-        # We mutate the MarketState's balances directly here, which...
+        return dict(self.market_state.balances)
+
+    def prepare_orders(self, orders: List[Order]) -> None:
+        # Work out how every order in the step will fill in one go
+        model = self.execution_model
+        later_charts = None
+        if model.delay:
+            later_charts = self._later_charts(model.delay)
+        fills = model.fill(
+            OrderBatch(orders),
+            self.market_state.chart_data,
+            later_charts,
+        )
+        self._fills = {
+            id(order): (price, fee)
+            for order, price, fee
+            in zip(orders, fills.prices.tolist(), fills.fees.tolist())
+        }
+
+    def _later_charts(self, delay: float) -> Charts:
+        """The charts `delay` seconds from now, without those of markets
+        with no candle after their current one: `latest` looks back for a
+        reading, so would give us the current candle again. Orders in those
+        markets fill at the current candle instead.
+        """
+        time = self.market_state.time
+        charts: Any = self.market_state.chart_data
+        later_charts: Any = self.market_history.latest(
+            time + timedelta(seconds=delay),
+        )
+        stale = sorted(
+            market for market, row in later_charts.items()
+            if market in charts and
+            to_datetime64(row['time']) <= to_datetime64(charts[market]['time'])
+        )
+        if stale:
+            logger.warning(
+                f'No candle within {delay} s of {time} for {len(stale)} '
+                f'markets ({", ".join(stale)}); filling their orders at the '
+                'current candle'
+            )
+        return {
+            market: row for market, row in later_charts.items()
+            if market not in stale
+        }
+
+    def fill_order(
+        self,
+        order: Order,
+        balances: Mapping[str, float],
+        attempts: int = 8,
+    ) -> OrderFill:
+        if id(order) not in self._fills:
+            self.prepare_orders([order])
+        price, fee = self._fills.pop(id(order))
+
+        amount = order.amount
+        if order.direction == Order.Direction.BUY and price > order.price:
+            # Buy what we can afford at the worse price
+            held = self.market_state.balances.get(order.base_currency, 0)
+            amount = min(amount, held / price)
+        filled = Order(order.market, price, amount, order.direction, order.type)
+
+        logger.debug(f'Simulating order: {order}, filled as {filled}')
+        updated_balances = simulate_order(
+            filled,
+            self.market_state.balances,
+            fee,
+        )
+        # We replace the MarketState's balances directly here, which...
         # ¯\_(ツ)_/¯
-        self.market_state.balances.update(updated_balances)
+        self.market_state.balances = updated_balances
 
-        # Return value is meaningless except for being non-None to indicate
-        # "success"
-        return 0
+        # The order number is meaningless except for being non-None to
+        # indicate "success"
+        return OrderFill(0, filled, fee)
@@ -1,23 +1,28 @@
 # -*- coding: utf-8 -*-
 from logging import getLogger
-from typing import Any
 from typing import Dict
 from typing import List
+from typing import Mapping
 from typing import Optional
 
 from pyloniex.constants import OrderType
-from pyloniex.errors import PoloniexRequestError
 
+from moneybot import config
 from moneybot.clients import Poloniex
 from moneybot.errors import InsufficientBalanceError
 from moneybot.errors import NoMarketAvailableError
 from moneybot.errors import OrderTooSmallError
-from moneybot.errors import OrderValidationError
+from moneybot.instrumentation import Instrumented
+from moneybot.instrumentation import Observer
 from moneybot.market import format_currency_pair
 from moneybot.market import Order
 from moneybot.market import split_currency_pair
 from moneybot.market.adapters import MarketAdapter
+from moneybot.market.execution import OrderExecutor
+from moneybot.market.execution import PercentStep
+from moneybot.market.execution import RETRY_ERRORS
 from moneybot.market.history import MarketHistory
+from moneybot.market.scheduler import OrderFill
 from moneybot.market.state import MarketState
 from moneybot.trade import AbstractTrade
 
@@ -28,29 +33,22 @@ logger = getLogger(__name__)
 class PoloniexMarketAdapter(MarketAdapter):
 
     MINIMUM_ORDER_TOTAL = 0.0001
-    ORDER_ADJUSTMENT = 0.001
+    # Percentage of the price to move by when retrying an unfilled order
+    PRICE_STEP_PERCENT = 0.1
 
     # Class methods
 
     @classmethod
-    def reify_trade(
+    def _reify_hop(
         cls,
+        sell_coin: str,
+        market: str,
         trade: AbstractTrade,
         market_state: MarketState,
-    ) -> List[Order]:
-        """Given an abstract trade, return a list of concrete orders that will
-        accomplish the higher-level transaction described.
+    ) -> Order:
+        """Return the order selling `sell_coin` in `market` for the value
+        described by `trade`.
         """
-        markets = market_state.available_markets()
-
-        market = format_currency_pair(trade.sell_coin, trade.buy_coin)
-        if market not in markets:
-            market = format_currency_pair(trade.buy_coin, trade.sell_coin)
-        if market not in markets:
-            raise NoMarketAvailableError(
-                f'No market available between {trade.sell_coin} and '
-                f'{trade.buy_coin} and indirect trades are not yet supported'
-            )
         base, quote = split_currency_pair(market)
 
         # Price is given as base currency / quote currency
@@ -64,24 +62,55 @@ class PoloniexMarketAdapter(MarketAdapter):
         )
 
         # Order direction is given with respect to the quote currency
-        if trade.sell_coin == base:
+        if sell_coin == base:
             # Buy quote currency; sell base currency
             direction = Order.Direction.BUY
-        elif trade.sell_coin == quote:
+        else:
             # Sell quote currency; buy quote currency
             direction = Order.Direction.SELL
-        else:
-            raise
-
-        return [
-            Order(
-                market,
-                price,
-                quote_amount,
-                direction,
-                OrderType.fill_or_kill,
+
+        return Order(
+            market,
+            price,
+            quote_amount,
+            direction,
+            OrderType.fill_or_kill,
+        )
+
+    @classmethod
+    def reify_trade(
+        cls,
+        trade: AbstractTrade,
+        market_state: MarketState,
+    ) -> List[Order]:
+        """Given an abstract trade, return a list of concrete orders that will
+        accomplish the higher-level transaction described.
+
+        If there's no market between the two coins, the trade is routed
+        through other markets, with one order per hop.
+        """
+        markets = market_state.available_markets()
+
+        market = format_currency_pair(trade.sell_coin, trade.buy_coin)
+        if market not in markets:
+            market = format_currency_pair(trade.buy_coin, trade.sell_coin)
+        if market in markets:
+            return [cls._reify_hop(trade.sell_coin, market, trade, market_state)]
+
+        path = market_state.conversion_path(trade.sell_coin, trade.buy_coin)
+        if path is None:
+            raise NoMarketAvailableError(
+                f'No markets connect {trade.sell_coin} and {trade.buy_coin}'
             )
-        ]
+        orders = []
+        for sell_coin, buy_coin in zip(path, path[1:]):
+            market = format_currency_pair(sell_coin, buy_coin)
+            if market not in market_state.chart_data:
+                market = format_currency_pair(buy_coin, sell_coin)
+            orders.append(
+                cls._reify_hop(sell_coin, market, trade, market_state),
+            )
+        return orders
 
     @classmethod
     def reify_trades(
@@ -105,7 +134,7 @@ class PoloniexMarketAdapter(MarketAdapter):
         return orders
 
     @classmethod
-    def validate_order(cls, order: Order, balances: Dict[str, float]):
+    def validate_order(cls, order: Order, balances: Mapping[str, float]):
         """Ensure that the given order is actually valid according to the
         constraints imposed by our balances and Poloniex's rules.
         """
@@ -145,6 +174,23 @@ class PoloniexMarketAdapter(MarketAdapter):
     ) -> None:
         super().__init__(fiat, history, initial_balances)
         self.private_api = Poloniex.get_private()
+        self.executor = OrderExecutor(
+            self.private_api,
+            type(self).validate_order,
+            PercentStep(type(self).PRICE_STEP_PERCENT),
+        )
+
+    @property
+    def concurrency(self) -> int:
+        # Requests are sent one at a time, in nonce order (see
+        # SerializedPrivateAPI), but orders overlap their rate limiting, the
+        # backoff between retries, and the executor's waits for fills
+        return config.read_int('poloniex.order_concurrency', default=4)
+
+    def instrument(self, observer: Observer) -> None:
+        super().instrument(observer)
+        self.private_api = Instrumented(self.private_api, 'poloniex', observer)
+        self.executor.private_api = self.private_api
 
     def get_balances(self) -> Dict[str, float]:
         response = self.private_api.return_complete_balances()
@@ -154,71 +200,46 @@ class PoloniexMarketAdapter(MarketAdapter):
             in response.items()
         }
 
-    def execute_order(self, order: Order, attempts: int = 8) -> Optional[int]:
-        """Submit an order, returning the order number if the order is filled
-        successfully or None otherwise.
+    def submit_order(
+        self,
+        order: Order,
+        balances: Mapping[str, float],
+        attempts: int = 8,
+    ) -> Optional[int]:
+        """Submit an order, returning the number of the last order placed if
+        any of it was filled, or None otherwise.
         """
-        if attempts <= 0:
-            logger.warning(f'Attempts exhausted; not executing order [{order}]')
-            return None
+        return self.fill_order(order, balances, attempts).order_id
 
-        balances = self.get_balances()
-        try:
-            type(self).validate_order(order, balances)
-        except OrderValidationError as e:
-            logger.warning(f'Order failed validation: {e}')
-            return None
-
-        if order.direction == Order.Direction.BUY:
-            method = self.private_api.buy
-        else:
-            method = self.private_api.sell
-
-        response: Dict[Any, Any] = {}
-        error = None
-
-        try:
-            response = method(
-                currency_pair=order.market,
-                rate=order.price,
-                amount=order.amount,
-                order_type=order.type,
-            )
-        except PoloniexRequestError as e:
-            logger.warning(
-                f'Order [{order}] resulted in an error from Poloniex: {e}'
-            )
-            logger.warning(
-                f'{e.request.method} {e.request.url} {e.request.body}'
-            )
-            error = e.message
-        else:
-            error = response.get('error')
-
-        if 'orderNumber' in response:
+    def fill_order(
+        self,
+        order: Order,
+        balances: Mapping[str, float],
+        attempts: int = 8,
+    ) -> OrderFill:
+        """Submit an order, reporting how much of it was filled, and at what
+        average price, from the trades Poloniex says it made.
+        """
+        execution = self.executor.execute(order, balances, attempts)
+        logger.info(f'{execution}')
+        if execution.filled:
             logger.info(f'Order [{order}] filled successfully')
-            response['currencyPair'] = order.market
-            logger.info(f'{response}')
-            return response['orderNumber']
-
-        # TODO: Magic strings suck; find a better way to do this
-        if error == 'Unable to fill order completely.':
-            adjustment = type(self).ORDER_ADJUSTMENT
-
-            if order.direction == Order.Direction.BUY:
-                # Adjust price up a little
-                new_price = order.price + adjustment
-            else:
-                # Adjust price down a little
-                new_price = order.price - adjustment
-            # Recurse and try again
-            new_order = Order(
+        order_ids = execution.order_ids
+        fill = OrderFill(order_ids[-1] if order_ids else None)
+        if execution.filled_amount:
+            fill.filled = Order(
                 order.market,
-                new_price,
-                order.amount,
+                execution.average_price or order.price,
+                execution.filled_amount,
                 order.direction,
                 order.type,
             )
-            return self.execute_order(new_order, attempts - 1)
-
-        return None
+        # Poloniex refused the order outright, which (since it passed
+        # validation) suggests our balances aren't what we thought
+        errors = [
+            attempt.error for attempt in execution.attempts
+            if attempt.error is not None and attempt.error not in RETRY_ERRORS
+        ]
+        if errors and not execution.filled_amount:
+            fill.error = errors[-1]
+        return fill
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import sys
+from collections import OrderedDict
+from datetime import datetime
+from logging import getLogger
+from threading import Lock
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from pandas import DataFrame
+from pandas import Series
+from pandas import Timestamp
+
+
+logger = getLogger(__name__)
+
+
+def _copy(value: Any) -> Any:
+    '''
+    Copy a cached result, so callers can't change what's in the cache.
+    '''
+    if isinstance(value, (DataFrame, Series)):
+        return value.copy()
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    return value
+
+
+def _sizeof(value: Any) -> int:
+    '''
+    Roughly how many bytes `value` takes up.
+    '''
+    if isinstance(value, DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            sys.getsizeof(k) + _sizeof(v) for k, v in value.items()
+        )
+    return sys.getsizeof(value)
+
+
+class CachedMarketHistory:
+    '''
+    Wraps a MarketHistory, remembering the results of `latest`,
+    `asset_history` and `asset_histories` so repeated lookups (e.g. the two
+    `latest()` calls in every `Fund.step`) don't go back to the database.
+
+    Entries are keyed by the exact time asked for, so results are always
+    the same as the wrapped history's. Given a `period` in seconds, times
+    are instead floored to the start of their candle, both in the cache key
+    and in the query passed on, so every call within a candle shares one
+    entry; readings after the start of the candle are then left out. The
+    least recently used entries are evicted once results take up more than
+    `max_bytes`. Everything is forgotten when `scrape_latest` brings in new
+    data.
+
+    `stats()` counts hits, misses and evictions, e.g. to export with
+    `HistogramCollector.add_stats`.
+
+    Anything else is passed straight through to the wrapped history.
+    '''
+
+    def __init__(
+        self,
+        history,
+        max_bytes: int = 64 * 2 ** 20,
+        period: Optional[int] = None,
+    ) -> None:
+        self.history = history
+        self.max_bytes = max_bytes
+        self.period = period
+        self._init_cache()
+
+    def _init_cache(self) -> None:
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, int]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Copies (e.g. of a Fund, per backtest window) start with an empty cache
+    def __getstate__(self) -> Dict:
+        return {
+            'history': self.history,
+            'max_bytes': self.max_bytes,
+            'period': self.period,
+        }
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._init_cache()
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes we don't have; `history` itself may not
+        # be set yet while unpickling
+        if name == 'history':
+            raise AttributeError(name)
+        return getattr(self.history, name)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def floor(self, time: datetime) -> datetime:
+        if self.period is None:
+            return time
+        return Timestamp(time).floor(f'{self.period}s')
+
+    def _cached(self, key: Hashable, fetch: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _copy(entry[0])
+            self.misses += 1
+
+        # Don't hold the lock while querying; at worst two threads both miss
+        value = fetch()
+        size = _sizeof(value)
+        with self._lock:
+            if key not in self._entries and size <= self.max_bytes:
+                self._entries[key] = (value, size)
+                self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+        return _copy(value)
+
+    def scrape_latest(self) -> Any:
+        result = self.history.scrape_latest()
+        self.clear()
+        logger.debug('Cleared market history cache after scraping')
+        return result
+
+    def latest(self, time: datetime) -> Dict[str, Dict[str, Any]]:
+        time = self.floor(time)
+        return self._cached(
+            ('latest', time),
+            lambda: self.history.latest(time),
+        )
+
+    def asset_history(
+        self,
+        time: datetime,
+        base: str,
+        quote: str,
+        days_back: float = 30,
+        key: str = 'price_usd',
+    ) -> Series:
+        time = self.floor(time)
+        return self._cached(
+            ('asset_history', time, base, quote, days_back, key),
+            lambda: self.history.asset_history(
+                time,
+                base,
+                quote,
+                days_back,
+                key,
+            ),
+        )
+
+    def asset_histories(
+        self,
+        time: datetime,
+        currency_pairs: List[str],
+        days_back: float = 30,
+        key: str = 'price_usd',
+    ) -> DataFrame:
+        time = self.floor(time)
+        return self._cached(
+            ('asset_histories', time, tuple(currency_pairs), days_back, key),
+            lambda: self.history.asset_histories(
+                time,
+                currency_pairs,
+                days_back,
+                key,
+            ),
+        )
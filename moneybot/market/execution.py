@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+import random
+from abc import ABCMeta
+from abc import abstractmethod
+from collections import deque
+from logging import getLogger
+from time import monotonic
+from time import perf_counter
+from time import sleep
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Mapping
+from typing import Optional
+
+from pyloniex.constants import OrderType
+from pyloniex.errors import PoloniexRequestError
+
+from moneybot.errors import OrderValidationError
+from moneybot.market import Order
+from moneybot.utils import simulate_order
+
+
+logger = getLogger(__name__)
+
+# Errors from Poloniex worth trying again (at another price) after
+RETRY_ERRORS = {'Unable to fill order completely.'}
+
+
+def _toward_fill(order: Order, step: float) -> float:
+    """Move an order's price by `step` in the direction more likely to fill:
+    up when buying, down when selling.
+    """
+    if order.direction == Order.Direction.BUY:
+        return order.price + step
+    return order.price - step
+
+
+class PriceStep(metaclass=ABCMeta):
+    """Decides the price to try next after an order couldn't be filled.
+    """
+
+    @abstractmethod
+    def next_price(self, order: Order) -> float:
+        raise NotImplementedError
+
+
+class FixedStep(PriceStep):
+    """Step by a fixed amount of the base currency, whatever the price.
+    """
+
+    def __init__(self, step: float = 0.001) -> None:
+        self.step = step
+
+    def next_price(self, order: Order) -> float:
+        return _toward_fill(order, self.step)
+
+
+class PercentStep(PriceStep):
+    """Step by a percentage of the current price.
+    """
+
+    def __init__(self, percent: float = 0.1) -> None:
+        self.percent = percent
+
+    def next_price(self, order: Order) -> float:
+        return _toward_fill(order, order.price * self.percent / 100)
+
+
+class OrderBookStep(PriceStep):
+    """Move to the price at which the order book holds enough volume to fill
+    the order, but never more than `max_percent` from the current price.
+    """
+
+    def __init__(
+        self,
+        public_api,
+        depth: int = 50,
+        max_percent: float = 1.0,
+    ) -> None:
+        self.public_api = public_api
+        self.depth = depth
+        self.max_percent = max_percent
+
+    def next_price(self, order: Order) -> float:
+        book = self.public_api.return_order_book(
+            currency_pair=order.market,
+            depth=self.depth,
+        )
+        # We buy from the asks and sell to the bids
+        side = 'asks' if order.direction == Order.Direction.BUY else 'bids'
+        price = order.price
+        needed = order.amount
+        for level_price, level_amount in book.get(side, []):
+            price = float(level_price)
+            needed -= float(level_amount)
+            if needed <= 0:
+                break
+
+        limit = _toward_fill(order, order.price * self.max_percent / 100)
+        if order.direction == Order.Direction.BUY:
+            return min(price, limit)
+        return max(price, limit)
+
+
+class Attempt:
+    """One order placed on the market, and what came of it.
+    """
+
+    def __init__(
+        self,
+        order: Order,
+        seconds: float,
+        filled_amount: float = 0,
+        average_price: Optional[float] = None,
+        order_id: Optional[int] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        self.order = order
+        self.seconds = seconds
+        self.filled_amount = filled_amount
+        self.average_price = average_price
+        self.order_id = order_id
+        self.error = error
+
+    def __repr__(self) -> str:
+        return (
+            f'Attempt({self.order}, filled={self.filled_amount}, '
+            f'average_price={self.average_price}, order_id={self.order_id}, '
+            f'error={self.error!r}, seconds={self.seconds:.3f})'
+        )
+
+
+class Execution:
+    """Every attempt made at filling an order.
+    """
+
+    def __init__(self, order: Order) -> None:
+        self.order = order
+        self.attempts: List[Attempt] = []
+
+    def __repr__(self) -> str:
+        return (
+            f'Execution({self.order}, filled={self.filled_amount}, '
+            f'slippage={self.slippage}, attempts={len(self.attempts)}, '
+            f'seconds={self.seconds:.3f})'
+        )
+
+    @property
+    def filled_amount(self) -> float:
+        return sum(attempt.filled_amount for attempt in self.attempts)
+
+    @property
+    def remaining_amount(self) -> float:
+        return self.order.amount - self.filled_amount
+
+    @property
+    def filled(self) -> bool:
+        # Allow for rounding in the amounts Poloniex reports back
+        return self.remaining_amount <= self.order.amount * 1e-9
+
+    @property
+    def order_ids(self) -> List[int]:
+        return [
+            attempt.order_id
+            for attempt in self.attempts
+            if attempt.order_id is not None
+        ]
+
+    @property
+    def average_price(self) -> Optional[float]:
+        filled = self.filled_amount
+        if not filled:
+            return None
+        return sum(
+            attempt.average_price * attempt.filled_amount
+            for attempt in self.attempts
+            if attempt.average_price is not None
+        ) / filled
+
+    def slippage_of(self, price: Optional[float]) -> Optional[float]:
+        """How much worse than the order's price `price` is, as a fraction of
+        the order's price (negative if it's better).
+        """
+        if price is None:
+            return None
+        slippage = (price - self.order.price) / self.order.price
+        if self.order.direction == Order.Direction.SELL:
+            return -slippage
+        return slippage
+
+    @property
+    def slippage(self) -> Optional[float]:
+        return self.slippage_of(self.average_price)
+
+    @property
+    def seconds(self) -> float:
+        return sum(attempt.seconds for attempt in self.attempts)
+
+
+class OrderExecutor:
+    """Places an order on Poloniex, trying again at a new price (chosen by
+    `price_step`) for whatever wasn't filled.
+
+    Attempts are spaced by an exponential backoff from `backoff` seconds up
+    to `max_backoff`, scaled by a random factor between 0.5 and 1 so
+    concurrent orders don't retry in lockstep. No attempt is started once
+    `deadline` seconds have passed. Every retry is checked with
+    `validate_order` against our balances, less what has been filled.
+
+    The most recent executions are kept in `history`.
+    """
+
+    def __init__(
+        self,
+        private_api,
+        validate_order: Callable[[Order, Mapping[str, float]], None],
+        price_step: Optional[PriceStep] = None,
+        backoff: float = 0.25,
+        max_backoff: float = 4.0,
+        deadline: float = 30.0,
+        history: int = 1000,
+    ) -> None:
+        self.private_api = private_api
+        self.validate_order = validate_order
+        self.price_step = price_step if price_step is not None else PercentStep()
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.history: Deque[Execution] = deque(maxlen=history)
+
+    def delay(self, retry: int) -> float:
+        """Seconds to wait before the `retry`th retry (counting from 1).
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** (retry - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def execute(
+        self,
+        order: Order,
+        balances: Mapping[str, float],
+        attempts: int = 8,
+    ) -> Execution:
+        """Try to fill `order`, which has already been validated against
+        `balances`, making at most `attempts` attempts.
+        """
+        execution = Execution(order)
+        self.history.append(execution)
+        start = monotonic()
+        current = order
+
+        for attempt in range(attempts):
+            if attempt:
+                delay = self.delay(attempt)
+                if monotonic() - start + delay > self.deadline:
+                    logger.warning(
+                        f'Deadline of {self.deadline} s passed; giving up on '
+                        f'order [{order}]'
+                    )
+                    break
+                sleep(delay)
+                remaining = Order(
+                    current.market,
+                    current.price,
+                    execution.remaining_amount,
+                    current.direction,
+                    current.type,
+                )
+                current = Order(
+                    current.market,
+                    self.price_step.next_price(remaining),
+                    remaining.amount,
+                    current.direction,
+                    current.type,
+                )
+                try:
+                    self.validate_order(current, balances)
+                except OrderValidationError as e:
+                    logger.warning(f'Order failed validation: {e}')
+                    break
+
+            result = self.place(current)
+            execution.attempts.append(result)
+            logger.debug(
+                f'{result} slippage={execution.slippage_of(result.average_price)}'
+            )
+            if result.filled_amount:
+                filled = Order(
+                    current.market,
+                    result.average_price or current.price,
+                    result.filled_amount,
+                    current.direction,
+                    current.type,
+                )
+                balances = simulate_order(filled, balances)
+            if execution.filled:
+                break
+            # A partial fill is always worth another go for the rest
+            if not result.filled_amount and result.error not in RETRY_ERRORS:
+                break
+        else:
+            if not execution.filled:
+                logger.warning(
+                    f'Attempts exhausted; order [{order}] not filled'
+                )
+        return execution
+
+    def place(self, order: Order) -> Attempt:
+        """Place a single order, returning what was filled.
+        """
+        if order.direction == Order.Direction.BUY:
+            method = self.private_api.buy
+        else:
+            method = self.private_api.sell
+
+        start = perf_counter()
+        response: Dict[Any, Any] = {}
+        try:
+            response = method(
+                currency_pair=order.market,
+                rate=order.price,
+                amount=order.amount,
+                order_type=order.type,
+            )
+        except PoloniexRequestError as e:
+            logger.warning(
+                f'Order [{order}] resulted in an error from Poloniex: {e}'
+            )
+            logger.warning(
+                f'{e.request.method} {e.request.url} {e.request.body}'
+            )
+            return Attempt(order, perf_counter() - start, error=e.message)
+        seconds = perf_counter() - start
+
+        if 'orderNumber' not in response:
+            return Attempt(order, seconds, error=response.get('error'))
+
+        trades = response.get('resultingTrades') or []
+        if 'amountUnfilled' in response:
+            filled_amount = order.amount - float(response['amountUnfilled'])
+        elif trades:
+            filled_amount = sum(float(trade['amount']) for trade in trades)
+        elif order.type == OrderType.immediate_or_cancel:
+            filled_amount = 0
+        else:
+            # Fill-or-kill orders are only given a number when filled
+            filled_amount = order.amount
+
+        if trades:
+            amount = sum(float(trade['amount']) for trade in trades)
+            total = sum(float(trade['total']) for trade in trades)
+            average_price = total / amount
+        else:
+            average_price = order.price
+
+        response['currencyPair'] = order.market
+        logger.info(f'Order [{order}] filled {filled_amount}: {response}')
+        return Attempt(
+            order,
+            seconds,
+            filled_amount=filled_amount,
+            average_price=average_price if filled_amount else None,
+            order_id=response['orderNumber'],
+        )
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+from abc import ABCMeta
+from abc import abstractmethod
+from logging import getLogger
+from typing import Any
+from typing import List
+from typing import Mapping
+from typing import Optional
+
+import numpy as np
+from pyloniex.constants import OrderType
+
+from moneybot.market import Order
+
+
+logger = getLogger(__name__)
+
+Charts = Mapping[str, Mapping[str, Any]]
+
+
+class OrderBatch:
+    '''
+    A step's orders as arrays, so fills can be worked out for all of them at
+    once.
+    '''
+
+    def __init__(self, orders: List[Order]) -> None:
+        self.orders = list(orders)
+        self.markets = [order.market for order in self.orders]
+        self.prices = np.array([o.price for o in self.orders], dtype=float)
+        self.amounts = np.array([o.amount for o in self.orders], dtype=float)
+        self.buys = np.array(
+            [o.direction == Order.Direction.BUY for o in self.orders],
+            dtype=bool,
+        )
+        # Only post-only orders are sure to rest on the book, paying the
+        # maker fee; everything else takes liquidity
+        self.makers = np.array(
+            [o.type == OrderType.post_only for o in self.orders],
+            dtype=bool,
+        )
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def chart_values(self, charts: Optional[Charts], key: str) -> np.ndarray:
+        '''
+        `key` from each order's market in `charts`, or NaN where missing.
+        '''
+        charts = charts or {}
+        return np.array(
+            [charts.get(market, {}).get(key) for market in self.markets],
+            dtype=float,
+        )
+
+
+class Fills:
+    '''
+    The price each order in a batch is filled at, and the fee charged, as a
+    fraction of what's bought.
+    '''
+
+    def __init__(self, batch: OrderBatch) -> None:
+        self.prices = batch.prices.copy()
+        self.fees = np.zeros(len(batch))
+
+
+class FillModel(metaclass=ABCMeta):
+    '''
+    One effect on how simulated orders are filled, applied to a whole batch.
+    '''
+
+    # Seconds after the step an order is filled at; models that need to see
+    # the market then should set this
+    delay = 0.0
+
+    @abstractmethod
+    def apply(
+        self,
+        batch: OrderBatch,
+        fills: Fills,
+        charts: Charts,
+        later_charts: Optional[Charts],
+    ) -> None:
+        raise NotImplementedError
+
+
+class Fees(FillModel):
+    '''
+    Charge a fee on what's bought: `maker` for post-only orders, `taker` for
+    everything else. Defaults are Poloniex's lowest tier.
+    '''
+
+    def __init__(self, maker: float = 0.0015, taker: float = 0.0025) -> None:
+        self.maker = maker
+        self.taker = taker
+
+    def apply(self, batch, fills, charts, later_charts) -> None:
+        fills.fees += np.where(batch.makers, self.maker, self.taker)
+
+
+class VolumeSlippage(FillModel):
+    '''
+    Move the price against the order by `impact` times the order's share of
+    the candle's volume (in the base currency), up to `max_slippage`. Markets
+    with no volume recorded get `max_slippage`.
+
+    When orders fill later (e.g. with `NextCandle`), the volume is taken from
+    the candle they fill in, where known.
+    '''
+
+    def __init__(
+        self,
+        impact: float = 1.0,
+        max_slippage: float = 0.05,
+        key: str = 'volume',
+    ) -> None:
+        self.impact = impact
+        self.max_slippage = max_slippage
+        self.key = key
+
+    def apply(self, batch, fills, charts, later_charts) -> None:
+        volume = batch.chart_values(charts, self.key)
+        if later_charts is not None:
+            later = batch.chart_values(later_charts, self.key)
+            volume = np.where(np.isnan(later), volume, later)
+        share = np.divide(
+            fills.prices * batch.amounts,
+            volume,
+            out=np.full(len(batch), np.inf),
+            where=volume > 0,
+        )
+        slippage = np.minimum(self.impact * share, self.max_slippage)
+        fills.prices *= np.where(batch.buys, 1 + slippage, 1 - slippage)
+
+
+class NextCandle(FillModel):
+    '''
+    Fill at the price `delay` seconds later (by default, the next 15 minute
+    candle) rather than the price the order was placed at, where known.
+    '''
+
+    def __init__(
+        self,
+        delay: float = 900,
+        key: str = 'weighted_average',
+    ) -> None:
+        self.delay = delay
+        self.key = key
+
+    def apply(self, batch, fills, charts, later_charts) -> None:
+        later = batch.chart_values(later_charts, self.key)
+        fills.prices = np.where(np.isnan(later), fills.prices, later)
+
+
+class ExecutionModel:
+    '''
+    How BacktestMarketAdapter fills orders: `models` are applied in turn to
+    every order of a step at once, so e.g. `NextCandle` should come before
+    `VolumeSlippage`. With no models, every order fills in full at its own
+    price with no fees.
+    '''
+
+    def __init__(self, *models: FillModel) -> None:
+        self.models = models
+
+    def __repr__(self) -> str:
+        names = ', '.join(type(model).__name__ for model in self.models)
+        return f'ExecutionModel({names})'
+
+    @property
+    def delay(self) -> float:
+        return max((model.delay for model in self.models), default=0.0)
+
+    def fill(
+        self,
+        batch: OrderBatch,
+        charts: Charts,
+        later_charts: Optional[Charts] = None,
+    ) -> Fills:
+        fills = Fills(batch)
+        for model in self.models:
+            model.apply(batch, fills, charts, later_charts)
+        return fills
+
+
+def realistic() -> ExecutionModel:
+    '''
+    Fill orders at the next candle's price, slipped by their share of its
+    volume, less Poloniex's fees.
+    '''
+    return ExecutionModel(NextCandle(), VolumeSlippage(), Fees())
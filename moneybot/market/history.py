@@ -1,31 +1,98 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
 from datetime import timedelta
+from io import BytesIO
 from logging import getLogger
 from typing import Dict
 from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
 
+import numpy as np
+
+from pandas import DataFrame
 from pandas import Series
 from pandas import to_datetime
+from psycopg2 import sql
 
 from moneybot.clients import Postgres
+from moneybot.market import schema
 from moneybot.market.scrape import scrape_since_last_reading
+from moneybot.market.store import ChartStore
 
 
 logger = getLogger(__name__)
 
 
+# `COPY ... (FORMAT binary)` output starts with this signature, then 32 bits
+# of flags and the length of a header extension
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+
+def copy_dtype(fields: List[Tuple[str, str]]) -> np.dtype:
+    '''
+    The NumPy dtype of one tuple of binary COPY output with the given
+    fixed-width, non-NULL (name, dtype) fields: a 16-bit field count, then a
+    32-bit length before each (big-endian) field.
+    '''
+    layout: List[Tuple[str, str]] = [('n_fields', '>i2')]
+    for name, dtype in fields:
+        layout.append((f'{name}_length', '>i4'))
+        layout.append((name, np.dtype(dtype).newbyteorder('>').str))
+    return np.dtype(layout)
+
+
+def decode_copy(
+    data: Union[bytes, memoryview],
+    fields: List[Tuple[str, str]],
+) -> np.ndarray:
+    '''
+    Decode binary COPY output straight into a structured array, without
+    building a Python object per row.
+    '''
+    view = memoryview(data)
+    if view[:len(COPY_SIGNATURE)].tobytes() != COPY_SIGNATURE:
+        raise ValueError('Not binary COPY output')
+    start = len(COPY_SIGNATURE) + 4
+    start += 4 + int.from_bytes(view[start:start + 4].tobytes(), 'big')
+    # Drop the trailer (a field count of -1)
+    rows = np.frombuffer(view[start:-2], dtype=copy_dtype(fields))
+    for name, dtype in fields:
+        if (rows[f'{name}_length'] != np.dtype(dtype).itemsize).any():
+            raise ValueError(f'{name} has NULLs or isn\'t a {dtype}')
+    return rows
+
+
+HISTORY_FIELDS = [('pair', 'i4'), ('time', 'f8'), ('value', 'f8')]
+
+
 class MarketHistory:
     '''
     TODO Docstring
     '''
 
+    # Connections are checked out of the Postgres pool per query, so a
+    # MarketHistory can be shared between threads, and copied into other
+    # processes (e.g. in a parallel backtest).
     def __init__(self) -> None:
-        self.db = Postgres.get_client()
+        self._currency_pairs: Optional[List[str]] = None
 
     def scrape_latest(self) -> None:
+        # New markets may have been listed since we last looked
+        self._currency_pairs = None
         return scrape_since_last_reading()
 
+    def currency_pairs(self) -> List[str]:
+        '''
+        Every currency pair in `scraped_chart`, looked up once and cached
+        until the next scrape.
+        '''
+        if self._currency_pairs is None:
+            with Postgres.connection() as conn, conn.cursor() as cursor:
+                self._currency_pairs = schema.currency_pairs(cursor)
+        return self._currency_pairs
+
     # String -> { 'BTC_ETH': { weighted_average, ...} ...}
     # TODO One issue here is that we are *only* getting the latest (15-minute) candlestic
     # So, if we are only trading once per day, certain values (like volume) will be misleading,
@@ -34,27 +101,27 @@ class MarketHistory:
     # and pass them through to the strategy together, sorted ny time.
     # Then, the strategy can then decide how to combine them.
     def latest(self, time: datetime) -> Dict[str, Dict[str, float]]:
-        cursor = self.db.cursor()
         prior_date = time - timedelta(days=1)
-        query = cursor.mogrify(
-            (
-                'SELECT DISTINCT ON (currency_pair) * FROM scraped_chart '
-                'WHERE time <= %s AND time > %s '
-                'ORDER BY currency_pair, time DESC'
-            ),
-            (time, prior_date),
-        )
-        logger.debug(query)
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        col_names = [column.name for column in cursor.description]
+        pairs = self.currency_pairs()
+        with Postgres.connection() as conn, conn.cursor() as cursor:
+            query = cursor.mogrify(
+                schema.LATEST,
+                {
+                    'pairs': pairs,
+                    'start': prior_date,
+                    'end': time,
+                },
+            )
+            logger.debug(query)
+            cursor.execute(query)
+            rows = cursor.fetchall()
+            col_names = [column.name for column in cursor.description]
         row_dicts = [dict(zip(col_names, row)) for row in rows]
         result = {
             row_dict['currency_pair']: row_dict
             for row_dict
             in row_dicts
         }
-        cursor.close()
         return result
 
     def asset_history(
@@ -62,23 +129,105 @@ class MarketHistory:
         time: datetime,
         base: str,
         quote: str,
-        days_back: int=30
-    ) -> List[float]:
-        cursor = self.db.cursor()
+        days_back: float = 30,
+        key: str = 'price_usd',
+    ) -> Series:
         currency_pair = f'{base}_{quote}'
+        histories = self.pair_histories(time, [currency_pair], days_back, key)
+        return histories[currency_pair]
+
+    def asset_histories(
+        self,
+        time: datetime,
+        currency_pairs: List[str],
+        days_back: float = 30,
+        key: str = 'price_usd',
+    ) -> DataFrame:
+        '''
+        Returns `key` for several currency pairs as a (time x pair) frame,
+        most recent reading first, from a single query. Missing readings are
+        NaN.
+        '''
+        histories = self.pair_histories(time, currency_pairs, days_back, key)
+        frame = DataFrame(histories, columns=list(currency_pairs))
+        return frame.sort_index(ascending=False)
+
+    def pair_histories(
+        self,
+        time: datetime,
+        currency_pairs: List[str],
+        days_back: float = 30,
+        key: str = 'price_usd',
+    ) -> Dict[str, Series]:
+        '''
+        Returns a time-indexed Series of `key` for each of `currency_pairs`,
+        most recent reading first, over the `days_back` days up to `time`.
+
+        Rows come back as binary COPY output and are decoded straight into
+        NumPy arrays, so long histories cost a few array copies rather than
+        a Python object (or three) per row.
+        '''
+        currency_pairs = list(dict.fromkeys(currency_pairs))
         prior_date = time - timedelta(days=days_back)
-        query = cursor.mogrify(
-            (
-                'SELECT time, price_usd FROM scraped_chart '
-                'WHERE currency_pair = %s AND time <= %s AND time > %s '
-                'ORDER BY time DESC'
-            ),
-            (currency_pair, time, prior_date),
-        )
-        logger.debug(query)
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        df = Series([p[1] for p in rows])
-        df.index = to_datetime([p[0] for p in rows])
-        cursor.close()
-        return df
+        query = sql.SQL(
+            'COPY ('
+            'SELECT array_position(%(pairs)s::text[], currency_pair)::int4, '
+            'extract(epoch FROM time)::float8, '
+            "coalesce({}, 'NaN')::float8 "
+            'FROM scraped_chart '
+            'WHERE currency_pair = ANY(%(pairs)s::text[]) '
+            'AND time <= %(end)s AND time > %(start)s '
+            'ORDER BY 1, 2 DESC'
+            ') TO STDOUT WITH (FORMAT binary)'
+        ).format(sql.Identifier(key))
+        buf = BytesIO()
+        with Postgres.connection() as conn, conn.cursor() as cursor:
+            query = cursor.mogrify(query, {
+                'pairs': currency_pairs,
+                'start': prior_date,
+                'end': time,
+            })
+            logger.debug(query)
+            cursor.copy_expert(query.decode(), buf)
+        rows = decode_copy(buf.getbuffer(), HISTORY_FIELDS)
+        times = rows['time'].astype(float)
+        values = rows['value'].astype(float)
+
+        # Rows are grouped by position in `currency_pairs`, counting from 1
+        bounds = np.searchsorted(rows['pair'], np.arange(1, len(currency_pairs) + 2))
+        return {
+            pair: Series(
+                values[lo:hi],
+                # Naive UTC, as every other MarketHistory returns
+                index=to_datetime(times[lo:hi], unit='s'),
+            )
+            for pair, lo, hi in zip(currency_pairs, bounds, bounds[1:])
+        }
+
+    def chart_store(
+        self,
+        start: datetime,
+        end: datetime,
+        days_back: int = 30,
+    ) -> ChartStore:
+        '''
+        Load every row of `scraped_chart` needed to backtest from `start` to
+        `end` into a ChartStore, in a single query. `days_back` days before
+        `start` are included so `asset_history` lookbacks can be answered too.
+        '''
+        prior_date = start - timedelta(days=days_back)
+        with Postgres.connection() as conn, conn.cursor() as cursor:
+            query = cursor.mogrify(
+                (
+                    'SELECT * FROM scraped_chart '
+                    'WHERE time <= %s AND time > %s '
+                    'ORDER BY time'
+                ),
+                (end, prior_date),
+            )
+            logger.debug(query)
+            cursor.execute(query)
+            col_names = [column.name for column in cursor.description]
+            frame = DataFrame(cursor.fetchall(), columns=col_names)
+        logger.info(f'Loaded {len(frame)} chart rows from {prior_date} to {end}')
+        return ChartStore.from_frame(frame)
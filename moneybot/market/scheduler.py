@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from time import perf_counter
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+from moneybot.errors import OrderValidationError
+from moneybot.market import Order
+from moneybot.utils import simulate_order
+
+if TYPE_CHECKING:
+    # MarketAdapter executes its orders with an OrderScheduler
+    from moneybot.market.adapters import MarketAdapter  # noqa: F401
+
+
+logger = getLogger(__name__)
+
+
+def order_flows(order: Order) -> Tuple[Tuple[str, float], str]:
+    '''
+    Returns the currency (and amount of it) an order spends, and the
+    currency it buys.
+    '''
+    if order.direction == Order.Direction.BUY:
+        return (order.base_currency, order.base_amount), order.quote_currency
+    return (order.quote_currency, order.quote_amount), order.base_currency
+
+
+def order_waves(orders: List[Order]) -> List[List[int]]:
+    '''
+    Group the indices of `orders` into waves that can each be submitted at
+    once. An order goes in the wave after the last earlier order buying the
+    currency it spends, so e.g. the buys spending BTC raised by a rebalance's
+    sells into BTC wait for those sells.
+    '''
+    bought_in: Dict[str, int] = {}
+    waves: List[List[int]] = []
+    for i, order in enumerate(orders):
+        (spent, _), bought = order_flows(order)
+        wave = bought_in.get(spent, -1) + 1
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append(i)
+        bought_in[bought] = max(bought_in.get(bought, -1), wave)
+    return waves
+
+
+class OrderFill:
+    '''
+    What a MarketAdapter reports about an order it submitted (see
+    `MarketAdapter.fill_order`). `order_id` is the number of the last order
+    placed, if any of the order was filled. `filled` is the order as it was
+    filled: the amount filled, at its average price. `fee` is the fraction of
+    what was bought that went in fees.
+
+    `error` is set when the exchange refused the order for a reason that
+    suggests our balances are out of date.
+    '''
+
+    def __init__(
+        self,
+        order_id: Optional[int] = None,
+        filled: Optional[Order] = None,
+        fee: float = 0.0,
+        error: Optional[str] = None,
+    ) -> None:
+        self.order_id = order_id
+        self.filled = filled
+        self.fee = fee
+        self.error = error
+
+    def __repr__(self) -> str:
+        return (
+            f'OrderFill(order_id={self.order_id}, filled={self.filled}, '
+            f'fee={self.fee}, error={self.error!r})'
+        )
+
+
+class OrderResult:
+    '''
+    What became of one order: its identifier if it was filled, otherwise an
+    error if it failed validation or raised while being submitted.
+    '''
+
+    def __init__(self, order: Order) -> None:
+        self.order = order
+        self.order_id: Optional[int] = None
+        self.error: Optional[str] = None
+        self.seconds = 0.0
+        self.fill: Optional[OrderFill] = None
+
+    def __repr__(self) -> str:
+        return (
+            f'OrderResult({self.order}, order_id={self.order_id}, '
+            f'error={self.error!r}, seconds={self.seconds:.3f})'
+        )
+
+    @property
+    def filled(self) -> bool:
+        return self.order_id is not None
+
+
+class BalanceLedger:
+    '''
+    Our balances while a list of orders is executed. They are looked up from
+    the adapter once, and every fill reported after that is applied to them
+    locally, as `simulate_order` would. They are only looked up again after
+    `invalidate`, i.e. when something happened that the reported fills don't
+    account for.
+    '''
+
+    def __init__(self, adapter: 'MarketAdapter') -> None:
+        self.adapter = adapter
+        self._balances: Optional[Dict[str, float]] = None
+        self.lookups = 0
+
+    @property
+    def balances(self) -> Dict[str, float]:
+        if self._balances is None:
+            self._balances = dict(self.adapter.get_balances())
+            self.lookups += 1
+        return self._balances
+
+    def record(self, fill: OrderFill) -> None:
+        if fill.filled is not None:
+            self._balances = simulate_order(
+                fill.filled,
+                self.balances,
+                fill.fee,
+            )
+
+    def invalidate(self) -> None:
+        self._balances = None
+
+
+class OrderScheduler:
+    '''
+    Executes a list of orders through a MarketAdapter, submitting orders that
+    don't depend on each other concurrently. This is how every order is
+    executed, including by `MarketAdapter.execute_orders`.
+
+    The whole list is validated up front against a BalanceLedger, with each
+    order checked against the balances we'd hold once every valid order
+    before it had filled as placed. Orders that fail are never submitted.
+
+    The rest run in waves (see `order_waves`). Before a wave is submitted,
+    its orders are checked again against the ledger as it stands, since
+    earlier fills may not have gone as planned. Each order's spend is
+    reserved, so orders in the same wave can't overcommit a currency between
+    them. The wave is then submitted on up to `max_workers` threads (never
+    more than the adapter's `concurrency`). The fills it reports are applied
+    to the ledger. Balances are looked up again only if an order raised, or
+    the exchange refused an order we expected it to accept.
+
+    With a concurrency of 1 every order is its own wave, in the order given.
+    '''
+
+    def __init__(
+        self,
+        adapter: 'MarketAdapter',
+        max_workers: Optional[int] = None,
+    ) -> None:
+        self.adapter = adapter
+        self.max_workers = max_workers
+
+    @property
+    def workers(self) -> int:
+        workers = self.adapter.concurrency
+        if self.max_workers is not None:
+            workers = min(workers, self.max_workers)
+        return max(workers, 1)
+
+    def run(self, orders: List[Order], attempts: int = 8) -> List[OrderResult]:
+        '''
+        Execute `orders`, returning an OrderResult for each, in the same
+        order.
+        '''
+        results = [OrderResult(order) for order in orders]
+        workers = self.workers
+        self.adapter.prepare_orders(orders)
+        ledger = BalanceLedger(self.adapter)
+        pending = [result for result, _ in self._plan(results, ledger.balances)]
+        logger.debug(
+            f'Executing {len(pending)} of {len(orders)} valid orders on '
+            f'{workers} threads'
+        )
+
+        pool = ThreadPoolExecutor(workers) if workers > 1 else None
+        try:
+            while pending:
+                if pool is None:
+                    wave = pending[:1]
+                else:
+                    first = order_waves([result.order for result in pending])[0]
+                    wave = [pending[i] for i in first]
+                in_wave = set(map(id, wave))
+                pending = [result for result in pending if id(result) not in in_wave]
+                self._run_wave(wave, ledger, attempts, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        logger.debug(f'Looked up balances {ledger.lookups} times')
+        return results
+
+    def _plan(
+        self,
+        results: List[OrderResult],
+        balances: Dict[str, float],
+    ) -> List[Tuple[OrderResult, Dict[str, float]]]:
+        '''
+        Validate each order in turn against `balances`, as they'd be once
+        every valid order before it had filled as placed. Returns each valid
+        order's result with the balances it was validated against; the rest
+        are given an error.
+        '''
+        plan = []
+        for result in results:
+            try:
+                self.adapter.validate_order(result.order, balances)
+            except OrderValidationError as e:
+                logger.warning(f'Order failed validation: {e}')
+                result.error = str(e)
+                continue
+            plan.append((result, balances))
+            balances = simulate_order(result.order, balances)
+        return plan
+
+    def _run_wave(
+        self,
+        results: List[OrderResult],
+        ledger: BalanceLedger,
+        attempts: int,
+        pool: Optional[ThreadPoolExecutor],
+    ) -> None:
+        '''
+        Validate and submit a wave of orders, then bring the ledger up to
+        date with their fills.
+        '''
+        submitted: List[Tuple[OrderResult, Optional[Future]]] = []
+        for result, held in self._plan(results, ledger.balances):
+            # Each order is checked against what we hold less what the
+            # orders before it spend, should it need to retry at a new price
+            if pool is None:
+                self._submit(result, held, attempts)
+                submitted.append((result, None))
+            else:
+                submitted.append(
+                    (result, pool.submit(self._submit, result, held, attempts)),
+                )
+
+        for _, pending in submitted:
+            if pending is not None:
+                pending.result()
+
+        # An order that raised may or may not have gone through
+        unaccounted = any(
+            result.fill is None or result.fill.error is not None
+            for result, _ in submitted
+        )
+        if unaccounted:
+            ledger.invalidate()
+            return
+        for result, _ in submitted:
+            assert result.fill is not None
+            ledger.record(result.fill)
+
+    def _submit(
+        self,
+        result: OrderResult,
+        balances: Dict[str, float],
+        attempts: int,
+    ) -> None:
+        start = perf_counter()
+        try:
+            fill = self.adapter.fill_order(result.order, balances, attempts)
+            result.fill = fill
+            result.order_id = fill.order_id
+            if fill.error is not None:
+                result.error = fill.error
+        except Exception as e:
+            logger.exception(f'Order [{result.order}] raised an error')
+            result.error = repr(e)
+        finally:
+            result.seconds = perf_counter() - start
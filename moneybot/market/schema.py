@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+'''
+The `scraped_chart` schema, and how to create or migrate it.
+
+`scraped_chart` is range-partitioned by month on `time`, with a unique
+(currency_pair, time) index (so per-pair time range scans, and `latest()`, are
+index scans) and a `time` index (for "most recent reading" lookups).
+Partitioned tables with indexes need Postgres 11 or newer.
+
+`time` keeps the type it has always had, a timestamp without time zone: the
+scraper writes naive local times, and a zoned column would read them in
+whatever zone the database session happens to be in.
+'''
+from datetime import datetime
+from logging import getLogger
+from typing import List
+from typing import Optional
+
+from pandas import Timestamp
+from pandas import period_range
+
+from moneybot.market.store import to_datetime64
+
+
+logger = getLogger(__name__)
+
+
+TABLE = 'scraped_chart'
+
+CREATE_TABLE = f'''
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    time timestamp without time zone NOT NULL,
+    currency_pair text NOT NULL,
+    open double precision,
+    high double precision,
+    low double precision,
+    close double precision,
+    price_btc double precision,
+    price_usd double precision,
+    quote_volume double precision,
+    volume double precision,
+    weighted_average double precision
+) PARTITION BY RANGE (time)
+'''
+
+CREATE_INDEXES = [
+    f'CREATE UNIQUE INDEX IF NOT EXISTS {TABLE}_pair_time '
+    f'ON {TABLE} (currency_pair, time)',
+    f'CREATE INDEX IF NOT EXISTS {TABLE}_time ON {TABLE} (time)',
+]
+
+# Postgres can't skip through an index to each distinct value on its own;
+# this recursive query does, one index probe per currency pair, rather than
+# reading every row.
+CURRENCY_PAIRS = f'''
+WITH RECURSIVE pairs AS (
+    (SELECT currency_pair FROM {TABLE} ORDER BY currency_pair LIMIT 1)
+    UNION ALL
+    SELECT (
+        SELECT currency_pair FROM {TABLE}
+        WHERE currency_pair > pairs.currency_pair
+        ORDER BY currency_pair LIMIT 1
+    )
+    FROM pairs
+    WHERE pairs.currency_pair IS NOT NULL
+)
+SELECT currency_pair FROM pairs WHERE currency_pair IS NOT NULL
+'''
+
+# The most recent reading for each pair with one in the time range, as one
+# backwards index scan per pair
+LATEST = f'''
+SELECT chart.* FROM unnest(%(pairs)s::text[]) AS pairs (currency_pair)
+CROSS JOIN LATERAL (
+    SELECT * FROM {TABLE}
+    WHERE currency_pair = pairs.currency_pair
+    AND time <= %(end)s AND time > %(start)s
+    ORDER BY time DESC
+    LIMIT 1
+) AS chart
+'''
+
+
+def month_starts(start: datetime, end: datetime) -> List[Timestamp]:
+    '''
+    The first instant of every month from the one containing `start` to the
+    one containing `end`, inclusive.
+    '''
+    months = period_range(
+        Timestamp(to_datetime64(start)).to_period('M'),
+        Timestamp(to_datetime64(end)).to_period('M'),
+        freq='M',
+    )
+    return [month.to_timestamp() for month in months]
+
+
+def partition_name(month: datetime) -> str:
+    return f'{TABLE}_{month:%Y_%m}'
+
+
+def _relkind(cursor) -> Optional[str]:
+    cursor.execute(
+        'SELECT relkind FROM pg_class WHERE relname = %s',
+        (TABLE,),
+    )
+    row = cursor.fetchone()
+    return None if row is None else row[0]
+
+
+def is_partitioned(cursor) -> bool:
+    return _relkind(cursor) == 'p'
+
+
+def create_partitions(cursor, start: datetime, end: datetime) -> List[str]:
+    '''
+    Make sure there's a partition for every month from `start` to `end`.
+    Returns the names of those partitions.
+    '''
+    names = []
+    for month in month_starts(start, end):
+        name = partition_name(month)
+        next_month = (month.to_period('M') + 1).to_timestamp()
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF {TABLE} '
+            'FOR VALUES FROM (%s) TO (%s)',
+            (str(month), str(next_month)),
+        )
+        names.append(name)
+    return names
+
+
+def bootstrap(cursor, start: datetime, end: datetime) -> None:
+    '''
+    Create `scraped_chart`, its indexes, and partitions for every month from
+    `start` to `end`. Does nothing to parts that already exist.
+    '''
+    cursor.execute(CREATE_TABLE)
+    for statement in CREATE_INDEXES:
+        cursor.execute(statement)
+    names = create_partitions(cursor, start, end)
+    logger.info(f'{TABLE} has partitions {names[0]} to {names[-1]}')
+
+
+def migrate(cursor, drop: bool = False) -> None:
+    '''
+    Move the rows of an unpartitioned `scraped_chart` (e.g. restored from an
+    old dump) into a partitioned one. Duplicate (currency_pair, time) readings
+    are collapsed, since the new table can't hold them.
+
+    The old table is kept as `scraped_chart_unpartitioned` unless `drop`.
+    '''
+    relkind = _relkind(cursor)
+    if relkind is None:
+        now = datetime.now()
+        bootstrap(cursor, now, now)
+        return
+    if relkind == 'p':
+        logger.info(f'{TABLE} is already partitioned')
+        return
+    old = f'{TABLE}_unpartitioned'
+    cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {old}')
+    cursor.execute(f'SELECT min(time), max(time) FROM {old}')
+    start, end = cursor.fetchone()
+    if start is None:
+        start = end = datetime.now()
+    bootstrap(cursor, start, end)
+
+    cursor.execute('''
+    SELECT column_name FROM information_schema.columns
+    WHERE table_name = %s AND column_name IN (
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s
+    )
+    ORDER BY ordinal_position
+    ''', (old, TABLE))
+    columns = ', '.join(row[0] for row in cursor.fetchall())
+    cursor.execute(
+        f'INSERT INTO {TABLE} ({columns}) '
+        f'SELECT DISTINCT ON (currency_pair, time) {columns} FROM {old} '
+        'ORDER BY currency_pair, time'
+    )
+    logger.info(f'Moved {cursor.rowcount} rows from {old} to {TABLE}')
+    if drop:
+        cursor.execute(f'DROP TABLE {old}')
+    cursor.execute(f'ANALYZE {TABLE}')
+
+
+def currency_pairs(cursor) -> List[str]:
+    cursor.execute(CURRENCY_PAIRS)
+    return [row[0] for row in cursor.fetchall()]
@@ -1,21 +1,35 @@
 # -*- coding: utf-8 -*-
 import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 from datetime import datetime
+from io import StringIO
 from logging import getLogger
+from threading import local
 from typing import Optional
 from typing import Dict
 from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Tuple
 
+from dateutil.tz import gettz
 from funcy import compose
-from funcy import partial
 from pandas import DataFrame
+from pandas import merge_asof
 from pandas import to_datetime
 from pandas import Series
+from psycopg2 import sql
 from pyloniex import PoloniexPublicAPI
+from pyloniex.api import REQUESTS_PER_SECOND
 
+from moneybot import config
 from moneybot.clients import Postgres
 from moneybot.clients import Poloniex
+from moneybot.clients import RateLimiter
+from moneybot.market.schema import create_partitions
+from moneybot.market.schema import is_partitioned
 
 
 YEAR_IN_SECS = 60 * 60 * 24 * 365
@@ -45,40 +59,76 @@ def market_cap(hist_ticker: Dict) -> Series:
 coin_history = compose(market_cap, historical)
 
 
-def marshall(hist_df):
+def marshall(hist_df: DataFrame) -> DataFrame:
     btc_to_usd = hist_df['price_usd'] / hist_df['price_btc']
-    # volume in BTC
-    # TODO is this correct? or is `'volume'` the quote volume?
-    hist_df['volume'] = hist_df['volume_usd'] / btc_to_usd
-    hist_df = hist_df.drop([
+    return hist_df.drop([
         'market_cap_by_available_supply',
         'volume_usd'
-    ], axis=1)
-    hist_df['weighted_average'] = hist_df['price_usd']
-    hist_df['time'] = hist_df.index
-    hist_df['currency_pair'] = hist_df.apply(lambda x: 'USD_BTC', axis=1)
+    ], axis=1).assign(
+        # volume in BTC
+        # TODO is this correct? or is `'volume'` the quote volume?
+        volume=hist_df['volume_usd'] / btc_to_usd,
+        weighted_average=hist_df['price_usd'],
+        time=hist_df.index,
+        currency_pair='USD_BTC',
+        open=None,
+        high=None,
+        low=None,
+        close=None,
+        quote_volume=None,
+    )
+
 
-    def nothing_burger():
-        return hist_df.apply(lambda x: None, axis=1)
+def marshall_chart_data(
+    ex_trades: List[Dict],
+    btc_price_history: DataFrame,
+    pair: str,
+) -> DataFrame:
+    '''
+    Turn `returnChartData` results for `pair` into rows for `scraped_chart`,
+    pricing each candle in USD with the BTC price as of its time.
+    '''
+    ts_df = DataFrame(ex_trades, dtype=float)
+    if not len(ts_df):
+        return ts_df
+    # for some reason, when there's no chart data to report,
+    # the API will give us some reading with all 0s.
+    # we will just ignore these
+    ts_df = ts_df[(ts_df['volume'] != 0) | (ts_df['weightedAverage'] != 0)]
+    ts_df = ts_df.rename(columns={
+        'quoteVolume': 'quote_volume',
+        'weightedAverage': 'weighted_average',
+    })
+    # Local time, as datetime.fromtimestamp would give us. The local zone is
+    # read from its tzfile, which pandas converts in one pass using the
+    # file's transition times (tzlocal() would be asked about every row).
+    times = to_datetime(ts_df['date'].values, unit='s', utc=True)
+    ts_df = ts_df.assign(
+        time=times.tz_convert(gettz()).tz_localize(None),
+    ).sort_values('time', kind='mergesort')
 
-    hist_df['open'] = nothing_burger()
-    hist_df['high'] = nothing_burger()
-    hist_df['low'] = nothing_burger()
-    hist_df['close'] = nothing_burger()
-    hist_df['quote_volume'] = nothing_burger()
-    return hist_df
+    btc_prices = btc_price_history['price_usd'].dropna().sort_index()
+    contemporary = merge_asof(
+        ts_df[['time']],
+        DataFrame({'time': btc_prices.index, 'btc_usd': btc_prices.values}),
+        on='time',
+    )
+    return ts_df.assign(
+        price_usd=ts_df['weighted_average'].values * contemporary['btc_usd'].values,
+        currency_pair=pair,
+    ).reset_index(drop=True)
 
 
 def historical_prices_of(
     polo: PoloniexPublicAPI,
-    btc_price_history: Series,
+    btc_price_history: DataFrame,
     pair: str,
     period: int = 900,
     start: Optional[float] = None,
     end: Optional[float] = None,
-) -> Iterable[Series]:
+) -> DataFrame:
     '''
-    Returns a series of time-indexed prices.
+    Returns a frame of prices, one row per candle.
     `pair` is of the form e.g. 'BTC_ETH',
     `period` is an integer number of seconds,
     either 300, 900, 1800, 7200, 14400, or 86400.
@@ -86,9 +136,6 @@ def historical_prices_of(
     We do some data marshalling in this method as well,
     to turn API results into stuff amenable for our Postgres DB.
     '''
-    def contemporary_usd_price(row: Series) -> float:
-        contemporary_btc_price = btc_price_history['price_usd'].asof(row.name)
-        return row['weightedAverage'] * contemporary_btc_price
     # Scraping
     now = time.time()
     start = start or now - YEAR_IN_SECS
@@ -100,74 +147,180 @@ def historical_prices_of(
         end=end,
     )
     # Data marshalling
-    ts_df = DataFrame(ex_trades, dtype=float)
-    ts_df['time'] = [datetime.fromtimestamp(t) for t in ts_df['date']]
-    ts_df.index = ts_df['time']
-    ts_df['price_usd'] = ts_df.apply(contemporary_usd_price, axis=1)
-    ts_df['currency_pair'] = ts_df.apply(lambda x: pair, axis=1)
-    ts_df = ts_df.rename(index=str, columns={
-        'quoteVolume': 'quote_volume',
-        'weightedAverage': 'weighted_average',
-    })
-    for _, row in ts_df.iterrows():
-        # chart = scraped_chart(pair, row)
-        # for some reason, when there's no chart data to report,
-        # the API will give us some reading with all 0s.
-        if row['volume'] == 0 and row['weighted_average'] == 0:
-            # we will just ignore these
-            pass
-        else:
-            yield row
+    return marshall_chart_data(ex_trades, btc_price_history, pair)
 
 
-def insert(cursor, row):
-    return cursor.execute("""
-    INSERT INTO scraped_chart (time, currency_pair, high, low, price_usd, quote_volume, volume, weighted_average)
-    VALUES (%(time)s, %(currency_pair)s, %(high)s, %(low)s, %(price_usd)s, %(quote_volume)s, %(volume)s, %(weighted_average)s);""",
-                          row.to_dict())
+def fetch_markets(
+    polo: PoloniexPublicAPI,
+    btc_price_history: DataFrame,
+    markets: Iterable[str],
+    start: float,
+    end: float,
+    concurrency: int = 4,
+    limiter: Optional[RateLimiter] = None,
+) -> Iterator[Tuple[str, DataFrame]]:
+    '''
+    Fetch chart data for each of `markets` on up to `concurrency` threads,
+    yielding (market, rows) in the order the fetches finish.
 
+    Each thread gets its own client of the same type as `polo`; `limiter` is
+    shared between them to stay under the exchange's request limit.
+    '''
+    if limiter is None:
+        limiter = RateLimiter(REQUESTS_PER_SECOND)
+    clients = local()
 
-def scrape_since_last_reading():
-    # postgres client
-    client = Postgres.get_client()
-    cursor = client.cursor()
-    inserter = partial(insert, cursor)
-    # get the last time we fetched some data,
-    # looking at the most recent result in the db
-    query = ' '.join([
-        'select time from scraped_chart',
-        'order by time desc',
-        'limit 1',
-    ])
-    cursor.execute(query)
-    latest_fetch_time = cursor.fetchone()[0]
-    latest_fetch_unix = time.mktime(latest_fetch_time.timetuple())
-
-    # now get USD_BTC history
-    btc_price_hist = coin_history('bitcoin')
-    # and write that history to DB,
-    btc_rows = marshall(btc_price_hist)
-    # NOTE since latest fetch time?
-    # recent_btc = btc_rows[btc_rows['time'] > latest_fetch_time]
-    # [inserter(row) for _, row in recent_btc.iterrows()]
-    [inserter(row) for _, row in btc_rows.iterrows()]
-    client.commit()
-    logger.debug('Scraped USD_BTC')
-
-    # now, a poloniex client
-    polo = Poloniex.get_public()
-    # and a method for grabbing historical prices
-    grab_historical_prices = partial(historical_prices_of, polo, btc_price_hist)
-    # for each market,
-    for market in polo.return_ticker():
-        # fetch all the chart data since last fetch
-        generator = grab_historical_prices(
+    def fetch(market: str) -> DataFrame:
+        if not hasattr(clients, 'polo'):
+            clients.polo = type(polo)()
+        limiter.wait()
+        return historical_prices_of(
+            clients.polo,
+            btc_price_history,
             market,
+            start=start,
+            end=end,
+        )
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        futures = {pool.submit(fetch, market): market for market in markets}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # Don't start any more fetches if we failed (or were abandoned)
+            for future in futures:
+                future.cancel()
+
+
+# Columns written by the scraper, in COPY order
+COLUMNS = [
+    'time',
+    'currency_pair',
+    'high',
+    'low',
+    'price_usd',
+    'quote_volume',
+    'volume',
+    'weighted_average',
+]
+
+
+def copy_buffer(rows: DataFrame) -> StringIO:
+    '''
+    Serialize `rows` as CSV for `COPY ... FROM STDIN`, keeping only the last
+    reading for each (time, currency_pair). Missing values become NULL.
+    '''
+    rows = rows.drop_duplicates(['time', 'currency_pair'], keep='last')
+    buf = StringIO()
+    rows[COLUMNS].to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    return buf
+
+
+def create_partitions_for(cursor, rows: DataFrame) -> None:
+    '''
+    Make sure `scraped_chart` has partitions to hold `rows`.
+    '''
+    if not len(rows):
+        return
+    # Partitions are bounded by naive times, like the rows they hold
+    create_partitions(cursor, rows['time'].min(), rows['time'].max())
+
+
+def write_rows(cursor, rows: DataFrame, table: str = 'scraped_chart') -> int:
+    '''
+    Upsert `rows` into `table` in bulk: the rows are streamed into a
+    temporary staging table with COPY, then existing (time, currency_pair)
+    readings are updated and new ones inserted, in two statements.
+
+    Returns the number of new rows. The caller commits.
+    '''
+    if not len(rows):
+        return 0
+    names = sql.SQL(', ').join(map(sql.Identifier, COLUMNS))
+    updates = sql.SQL(', ').join(
+        sql.SQL('{0} = s.{0}').format(sql.Identifier(column))
+        for column in COLUMNS[2:]
+    )
+    target = sql.Identifier(table)
+    staging = sql.Identifier(f'{table}_staging')
+
+    cursor.execute(sql.SQL(
+        'CREATE TEMP TABLE IF NOT EXISTS {} (LIKE {}) ON COMMIT DROP'
+    ).format(staging, target))
+    cursor.execute(sql.SQL('TRUNCATE {}').format(staging))
+    cursor.copy_expert(
+        sql.SQL('COPY {} ({}) FROM STDIN WITH (FORMAT csv)').format(
+            staging,
+            names,
+        ).as_string(cursor),
+        copy_buffer(rows),
+    )
+    cursor.execute(sql.SQL(
+        'UPDATE {} AS c SET {} FROM {} AS s '
+        'WHERE c.time = s.time AND c.currency_pair = s.currency_pair'
+    ).format(target, updates, staging))
+    cursor.execute(sql.SQL(
+        'INSERT INTO {0} ({1}) SELECT {1} FROM {2} AS s '
+        'WHERE NOT EXISTS ('
+        'SELECT 1 FROM {0} AS c '
+        'WHERE c.time = s.time AND c.currency_pair = s.currency_pair'
+        ')'
+    ).format(target, names, staging))
+    return cursor.rowcount
+
+
+def scrape_since_last_reading():
+    # postgres client, held for the whole scrape
+    with Postgres.connection() as client:
+        cursor = client.cursor()
+        # get the last time we fetched some data,
+        # looking at the most recent result in the db
+        query = ' '.join([
+            'select time from scraped_chart',
+            'order by time desc',
+            'limit 1',
+        ])
+        cursor.execute(query)
+        latest_fetch_time = cursor.fetchone()[0]
+        latest_fetch_unix = time.mktime(latest_fetch_time.timetuple())
+
+        # now get USD_BTC history
+        btc_price_hist = coin_history('bitcoin')
+        # and write that history to DB,
+        btc_rows = marshall(btc_price_hist)
+        # NOTE since latest fetch time?
+        # recent_btc = btc_rows[btc_rows['time'] > latest_fetch_time]
+        partitioned = is_partitioned(cursor)
+        if partitioned:
+            create_partitions_for(cursor, btc_rows)
+        inserted = write_rows(cursor, btc_rows)
+        client.commit()
+        logger.debug(f'Scraped USD_BTC ({inserted} new rows)')
+
+        # now, a poloniex client
+        polo = Poloniex.get_public()
+        limiter = RateLimiter(config.read_float(
+            'scrape.requests_per_second',
+            default=REQUESTS_PER_SECOND,
+        ))
+        # fetch all the chart data since last fetch for every market at once,
+        fetched = fetch_markets(
+            polo,
+            btc_price_hist,
+            polo.return_ticker(),
             start=latest_fetch_unix,
             end=time.time(),
+            concurrency=config.read_int('scrape.concurrency', default=4),
+            limiter=limiter,
         )
-        list(map(inserter, generator))
-        client.commit()
-        logger.debug(f'Scraped {market}')
+        # writing each market as it arrives
+        for market, rows in fetched:
+            if partitioned:
+                create_partitions_for(cursor, rows)
+            inserted = write_rows(cursor, rows)
+            client.commit()
+            logger.debug(f'Scraped {market} ({inserted} new rows)')
 
-    cursor.close()
+        cursor.close()
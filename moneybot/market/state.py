@@ -1,17 +1,241 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
+from functools import lru_cache
 from logging import getLogger
+from types import MappingProxyType
+from typing import Any
 from typing import Dict
 from typing import FrozenSet
+from typing import Iterator
+from typing import Mapping
+from typing import List
 from typing import Optional
+from typing import Tuple
+
+import numpy as np
 
-from moneybot.market import format_currency_pair
 from moneybot.market import split_currency_pair
 
 
 logger = getLogger(__name__)
 
 
+class FrozenChartData(Mapping):
+    '''
+    A read-only view over chart data ({market: {key: value}}). Rows are
+    wrapped as they're looked up, so building a view costs nothing no matter
+    how many markets there are.
+    '''
+
+    def __init__(self, chart_data: Mapping[str, Mapping[str, Any]]) -> None:
+        self._chart_data = chart_data
+
+    def __getitem__(self, market: str) -> Mapping[str, Any]:
+        return MappingProxyType(self._chart_data[market])
+
+    def __contains__(self, market: object) -> bool:
+        return market in self._chart_data
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._chart_data)
+
+    def __len__(self) -> int:
+        return len(self._chart_data)
+
+
+@lru_cache(maxsize=16)
+def _index_markets(
+    markets: Tuple[str, ...],
+) -> Tuple[Dict[str, int], np.ndarray, np.ndarray]:
+    '''
+    Number every coin in `markets`, returning that numbering along with the
+    numbers of each market's base and quote coins. The set of markets rarely
+    changes from one step to the next, so this is cached.
+    '''
+    halves = [split_currency_pair(market) for market in markets]
+    coins, positions = np.unique(
+        [base for base, _ in halves] + [quote for _, quote in halves],
+        return_inverse=True,
+    )
+    index = {coin: i for i, coin in enumerate(coins.tolist())}
+    return index, positions[:len(markets)], positions[len(markets):]
+
+
+class ConversionRates:
+    '''
+    Conversion rates between every pair of coins connected by one or more
+    markets, computed from a MarketState's chart data the first time they're
+    needed and kept for the life of the MarketState.
+
+    Coins are numbered once (see `index`). For each reference coin we walk
+    the graph of markets outwards, one hop at a time, so every coin is valued
+    along a path with the fewest possible hops (e.g. ETH in BCH via BTC when
+    there's no ETH/BCH market). The resulting vector of rates, aligned with
+    the numbering, makes valuing one coin a lookup and valuing a whole set of
+    balances a handful of array operations.
+    '''
+
+    CHART_KEY = 'weighted_average'
+    MAX_HOPS = 3
+
+    def __init__(self, chart_data: Mapping[str, Mapping[str, Any]]) -> None:
+        self._chart_data = chart_data
+        self._index: Optional[Dict[str, int]] = None
+        self._markets: Tuple[np.ndarray, np.ndarray, np.ndarray]
+        self._tables: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        # For each reference coin, the next coin along each coin's path there
+        self._next_hops: Dict[str, np.ndarray] = {}
+        # The same tables as plain lists, for valuing one coin at a time
+        self._lists: Dict[str, Tuple[List[float], List[bool]]] = {}
+        # Positions in `index` of each set of coins we've been asked to value
+        self._positions: Dict[Tuple[str, ...], np.ndarray] = {}
+
+    def _build_index(self) -> None:
+        index, bases, quotes = _index_markets(tuple(self._chart_data))
+        prices = np.array(
+            [row[type(self).CHART_KEY] for row in self._chart_data.values()],
+            dtype=float,
+        )
+        # Markets without a price can't take us anywhere
+        priced = ~np.isnan(prices)
+        self._index = index
+        self._markets = (bases[priced], quotes[priced], prices[priced])
+
+    @property
+    def index(self) -> Dict[str, int]:
+        if self._index is None:
+            self._build_index()
+        return self._index  # type: ignore
+
+    def _build_table(self, reference_coin: str) -> None:
+        index = self.index
+        bases, quotes, prices = self._markets
+        rates = np.full(len(index) + 1, np.nan)
+        inverted = np.zeros(len(index) + 1, dtype=bool)
+        next_hops = np.full(len(index) + 1, -1, dtype=np.intp)
+        if reference_coin in index:
+            ref = index[reference_coin]
+            # One hop. Markets quoted in the reference coin have to be
+            # flipped around, e.g. ETH_BTC when valuing ETH in BTC...
+            flipped = quotes == ref
+            rates[bases[flipped]] = prices[flipped]
+            inverted[bases[flipped]] = True
+            next_hops[bases[flipped]] = ref
+            # ...but markets based in it (BTC_ETH) take precedence
+            direct = bases == ref
+            rates[quotes[direct]] = prices[direct]
+            inverted[quotes[direct]] = False
+            next_hops[quotes[direct]] = ref
+            rates[ref] = 1.0
+            inverted[ref] = False
+
+            # Further hops, where one of a market's coins has been valued
+            # already and the other hasn't
+            with np.errstate(divide='ignore'):
+                worth = np.where(inverted, 1 / rates, rates)
+            for _ in range(type(self).MAX_HOPS - 1):
+                valued = ~np.isnan(worth)
+                forward = valued[bases] & ~valued[quotes]
+                backward = valued[quotes] & ~valued[bases]
+                coins = np.concatenate([quotes[forward], bases[backward]])
+                if not len(coins):
+                    break
+                via = np.concatenate([bases[forward], quotes[backward]])
+                coin_worth = np.concatenate([
+                    worth[bases[forward]] * prices[forward],
+                    worth[quotes[backward]] / prices[backward],
+                ])
+                # Where there's more than one way to get somewhere in the
+                # same number of hops, take the first
+                coins, first = np.unique(coins, return_index=True)
+                worth[coins] = rates[coins] = coin_worth[first]
+                next_hops[coins] = via[first]
+        self._tables[reference_coin] = (rates, inverted)
+        self._next_hops[reference_coin] = next_hops
+
+    def table(self, reference_coin: str) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Returns `(rates, inverted)`, aligned with `index` plus one trailing
+        slot for coins we've never heard of. One of coin `i` is worth
+        `rates[i]` of `reference_coin`, or `1 / rates[i]` where `inverted[i]`
+        (kept as a division so one-hop results match dividing by the market
+        price exactly). Coins with no path to `reference_coin` have a NaN
+        rate.
+        '''
+        if reference_coin not in self._tables:
+            self._build_table(reference_coin)
+        return self._tables[reference_coin]
+
+    def path(self, coin: str, reference_coin: str) -> Optional[List[str]]:
+        '''
+        Returns the coins passed through when converting `coin` to
+        `reference_coin` (both ends included), or None if there's no way to.
+        '''
+        if coin == reference_coin:
+            return [coin]
+        rates, _ = self.table(reference_coin)
+        i = self.index.get(coin, -1)
+        if np.isnan(rates[i]):
+            return None
+        coins = list(self.index)
+        next_hops = self._next_hops[reference_coin]
+        path = [coin]
+        while path[-1] != reference_coin:
+            i = next_hops[i]
+            path.append(coins[i])
+        return path
+
+    def estimate(
+        self,
+        coin: str,
+        amount: float,
+        reference_coin: str,
+    ) -> Optional[float]:
+        if coin == reference_coin:
+            return amount
+        if reference_coin not in self._lists:
+            rates, inverted = self.table(reference_coin)
+            self._lists[reference_coin] = (rates.tolist(), inverted.tolist())
+        rate_list, inverted_list = self._lists[reference_coin]
+        i = self.index.get(coin, -1)
+        rate = rate_list[i]
+        if rate != rate:  # NaN
+            return None
+        return amount / rate if inverted_list[i] else amount * rate
+
+    def estimate_many(
+        self,
+        balances: Mapping[str, float],
+        reference_coin: str,
+    ) -> Tuple[Tuple[str, ...], np.ndarray, np.ndarray]:
+        '''
+        Returns the coins in `balances`, their values in terms of
+        `reference_coin`, and a mask of which of those values are known.
+        '''
+        rates, inverted = self.table(reference_coin)
+        index = self.index
+        coins = tuple(balances)
+        idx = self._positions.get(coins)
+        if idx is None:
+            idx = np.array([index.get(coin, -1) for coin in coins], dtype=np.intp)
+            self._positions[coins] = idx
+        amounts = np.array(list(balances.values()), dtype=float)
+        coin_rates = rates[idx]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.where(
+                inverted[idx],
+                amounts / coin_rates,
+                amounts * coin_rates,
+            )
+        known = ~np.isnan(coin_rates)
+        if reference_coin not in index and reference_coin in balances:
+            # A coin is always worth itself, even without any markets
+            i = coins.index(reference_coin)
+            values[i] = amounts[i]
+            known[i] = True
+        return coins, values, known
+
+
 class MarketState:
     '''
     TODO Docstring
@@ -19,8 +243,8 @@ class MarketState:
 
     def __init__(
         self,
-        chart_data: Dict[str, Dict[str, float]],
-        balances: Dict[str, float],
+        chart_data: Mapping[str, Mapping[str, Any]],
+        balances: Mapping[str, float],
         time: datetime,
         fiat: str,
     ) -> None:
@@ -28,11 +252,19 @@ class MarketState:
         self.balances = balances
         self.time = time
         self.fiat = fiat
+        self._rates: Optional[ConversionRates] = None
+        self._markets: Optional[FrozenSet[str]] = None
 
     '''
     Private methods
     '''
 
+    @property
+    def _conversion_rates(self) -> ConversionRates:
+        if self._rates is None:
+            self._rates = ConversionRates(self.chart_data)
+        return self._rates
+
     def _held_coins(self) -> FrozenSet[str]:
         return frozenset(
             coin for (coin, balance)
@@ -44,6 +276,26 @@ class MarketState:
     Public methods
     '''
 
+    def snapshot(self) -> 'MarketState':
+        '''
+        Returns a read-only MarketState as of now. Chart data is shared with
+        this MarketState rather than copied; attempts to mutate either it or
+        the balances raise a TypeError.
+        '''
+        chart_data = self.chart_data
+        if not isinstance(chart_data, FrozenChartData):
+            chart_data = FrozenChartData(chart_data)
+        snapshot = type(self)(
+            chart_data,
+            MappingProxyType(dict(self.balances)),
+            self.time,
+            self.fiat,
+        )
+        # These only depend on chart data, so they can be shared too
+        snapshot._rates = self._conversion_rates
+        snapshot._markets = self.available_markets()
+        return snapshot
+
     def balance(self, coin: str) -> float:
         '''
         Returns the quantity of a coin held.
@@ -65,12 +317,14 @@ class MarketState:
     def available_markets(self) -> FrozenSet[str]:
         """Return a frozenset containing all available markets, e.g. 'BTC_ETH'.
         """
-        return frozenset(
-            filter(
-                lambda market: market.startswith(self.fiat),
-                self.chart_data.keys(),
+        if self._markets is None:
+            self._markets = frozenset(
+                filter(
+                    lambda market: market.startswith(self.fiat),
+                    self.chart_data.keys(),
+                )
             )
-        )
+        return self._markets
 
     def available_coins(self) -> FrozenSet[str]:
         markets = self.available_markets()  # All of these start with fiat
@@ -91,62 +345,68 @@ class MarketState:
         """Given `amount` of `coin`, estimate its value in terms of
         `reference_coin`.
 
-        TODO: It would be super awesome if we could calculate this value across
-        multiple hops, e.g. be able to tell the value of x ETH in BCH if we
-        only have access to the markets BTC_ETH and BTC_BCH.
+        If there's no market between the two, we go across multiple hops, e.g.
+        the value of x ETH in BCH given only the markets BTC_ETH and BTC_BCH.
         """
-        if coin == reference_coin:
-            return amount
-
-        chart_key = 'weighted_average'
-
-        market = format_currency_pair(reference_coin, coin)
-        if market in self.chart_data:
-            reference_per_coin = self.chart_data[market][chart_key]
-            return amount * reference_per_coin
-
-        # We may have to flip the coins around to find the market
-        market = format_currency_pair(coin, reference_coin)
-        if market in self.chart_data:
-            coin_per_reference = self.chart_data[market][chart_key]
-            return amount / coin_per_reference
+        value = self._conversion_rates.estimate(coin, amount, reference_coin)
+        if value is None:
+            logger.debug(
+                f"Couldn't find a market for {reference_coin}:{coin}; has it been delisted?",
+            )
+        return value
 
-        logger.debug(
-            f"Couldn't find a market for {reference_coin}:{coin}; has it been delisted?",
-        )
-        return None
+    def conversion_path(
+        self,
+        coin: str,
+        reference_coin: str,
+    ) -> Optional[List[str]]:
+        """Return the coins passed through (ends included) when converting
+        `coin` to `reference_coin` via the fewest markets, or None if they
+        aren't connected.
+        """
+        return self._conversion_rates.path(coin, reference_coin)
 
     def estimate_values(
         self,
-        balances: Dict[str, float],
+        balances: Mapping[str, float],
         reference_coin: str,
     ) -> Dict[str, float]:
         """Return a dict mapping coin names to value in terms of the reference
         coin.
 
-        NOTE: If no market exists between a coin and the reference coin, we
+        NOTE: If no markets connect a coin and the reference coin, we
         can't estimate a value for said coin (see docstring for
         `MarketState::estimate_value`). If this happens, the un-valuable coin
         will be omitted from the returned dict.
         """
-        estimated_values = {}
-        for coin, amount in balances.items():
-            value = self.estimate_value(coin, amount, reference_coin)
-            if value is not None:
-                estimated_values[coin] = value
-        return estimated_values
+        coins, values, known = self._conversion_rates.estimate_many(
+            balances,
+            reference_coin,
+        )
+        return {
+            coin: value
+            for coin, value, is_known
+            in zip(coins, values.tolist(), known.tolist())
+            if is_known
+        }
 
     def estimate_total_value(
         self,
-        balances: Dict[str, float],
+        balances: Mapping[str, float],
         reference_coin: str,
     ) -> float:
         """Calculate the total value of all holdings in terms of the reference
         coin.
         """
-        return sum(self.estimate_values(balances, reference_coin).values())
+        _, values, known = self._conversion_rates.estimate_many(
+            balances,
+            reference_coin,
+        )
+        # Add up one by one, in balances order: `values.sum()` sums pairwise,
+        # which can differ in the last bits
+        return sum(values[known].tolist())
 
-    def estimate_total_value_usd(self, balances: Dict[str, float]) -> float:
+    def estimate_total_value_usd(self, balances: Mapping[str, float]) -> float:
         '''
         Returns the sum of all holding values, in USD.
         '''
@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+import json
+import errno
+import os
+import shutil
+import struct
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from datetime import timedelta
+from logging import getLogger
+from math import isnan
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+import numpy as np
+from pandas import DataFrame
+from pandas import Series
+from pandas import Timestamp
+from pandas import to_datetime
+
+
+logger = getLogger(__name__)
+
+# A snapshot file (see `ChartStore.save`) is SNAPSHOT_MAGIC, the length of a
+# JSON header as a little-endian uint64, the header, then the raw arrays the
+# header describes, each starting on a SNAPSHOT_ALIGN byte boundary.
+SNAPSHOT_MAGIC = b'MBCHART1'
+SNAPSHOT_ALIGN = 64
+
+# Where `ChartStore.shared` puts its snapshot: a RAM-backed filesystem where
+# there is one, so nothing is written to disk. It's often small (64 MiB in a
+# Docker container, by default), so snapshots that don't fit go in the
+# temporary directory instead.
+SHARED_DIRECTORY = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def to_datetime64(time: datetime) -> np.datetime64:
+    '''
+    Convert a datetime (or anything pandas can parse) into a naive
+    datetime64[ns], the representation used by ChartStore's time axis.
+    '''
+    ts = Timestamp(time)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert(None)
+    return ts.to_datetime64()
+
+
+class ChartStore:
+    '''
+    A columnar, in-memory copy of a range of the `scraped_chart` table.
+
+    Every numeric column (weighted_average, price_usd, volume, ...) is held as
+    a (time x currency pair) matrix of floats. `present` records which cells
+    actually correspond to a scraped row, so missing readings and NULLs can
+    be told apart.
+
+    A ChartStore is never mutated once built, so it can be shared freely
+    between MarketHistory instances, Funds, and backtests.
+
+    A store memory-mapped from a snapshot (see `load` and `shared`) pickles
+    as its path, so sending it to another process maps the same file there
+    rather than copying the arrays: every process shares one copy of the
+    data through the page cache.
+    '''
+
+    def __init__(
+        self,
+        times: np.ndarray,
+        pairs: List[str],
+        columns: Dict[str, np.ndarray],
+        present: np.ndarray,
+    ) -> None:
+        self._times = times
+        self._pairs = list(pairs)
+        self._pair_index = {pair: j for j, pair in enumerate(self._pairs)}
+        self._columns = columns
+        self._present = present
+        # The snapshot our arrays are mapped from, if they are
+        self._path: Optional[str] = None
+
+    @classmethod
+    def from_frame(cls, frame: DataFrame) -> 'ChartStore':
+        '''
+        Build a store from a "long" DataFrame with one row per
+        (time, currency_pair), as selected from `scraped_chart`.
+        '''
+        frame = frame.drop_duplicates(['time', 'currency_pair'], keep='last')
+        row_times = to_datetime(frame['time'], utc=True).dt.tz_convert(None)
+        row_times = row_times.to_numpy(dtype='datetime64[ns]')
+        row_pairs = frame['currency_pair'].to_numpy(dtype=object)
+
+        times = np.unique(row_times)
+        pairs = sorted(set(row_pairs))
+        ti = np.searchsorted(times, row_times)
+        pj = np.searchsorted(np.array(pairs, dtype=object), row_pairs)
+
+        shape = (len(times), len(pairs))
+        present = np.zeros(shape, dtype=bool)
+        present[ti, pj] = True
+
+        columns = {}
+        for name in frame.columns:
+            if name in ('time', 'currency_pair'):
+                continue
+            values = np.full(shape, np.nan)
+            values[ti, pj] = frame[name].to_numpy(dtype=float, na_value=np.nan)
+            columns[name] = values
+
+        return cls(times, pairs, columns, present)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]]) -> 'ChartStore':
+        return cls.from_frame(DataFrame.from_records(list(records)))
+
+    @classmethod
+    def from_charts(
+        cls,
+        charts: Dict[str, Dict[str, Dict[str, Any]]],
+    ) -> 'ChartStore':
+        '''
+        Build a store from the output of repeated `MarketHistory.latest()`
+        calls, keyed by time then currency pair (e.g. tests/mock-data).
+        '''
+        return cls.from_records(
+            dict(row, currency_pair=pair)
+            for rows in charts.values()
+            for pair, row in rows.items()
+        )
+
+    def save(self, path: str) -> None:
+        '''
+        Write the store to a single snapshot file, which `load` can
+        memory-map without a database.
+        '''
+        arrays = [self._times, self._present] + list(self._columns.values())
+        # Work out where each array goes before writing anything
+        specs = []
+        offset = 0
+        for array in arrays:
+            offset += -offset % SNAPSHOT_ALIGN
+            specs.append({
+                'dtype': array.dtype.str,
+                'shape': list(array.shape),
+                'offset': offset,
+            })
+            offset += array.nbytes
+        header = json.dumps({
+            'pairs': self._pairs,
+            'times': specs[0],
+            'present': specs[1],
+            'columns': dict(zip(self._columns, specs[2:])),
+        }).encode()
+        start = len(SNAPSHOT_MAGIC) + 8 + len(header)
+        header += b' ' * (-start % SNAPSHOT_ALIGN)
+        start += -start % SNAPSHOT_ALIGN
+
+        with open(path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for array, spec in zip(arrays, specs):
+                f.seek(start + spec['offset'])
+                np.ascontiguousarray(array).tofile(f)
+        logger.info(
+            f'Saved {len(self._times)} x {len(self._pairs)} charts to {path}'
+        )
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'ChartStore':
+        '''
+        Open a snapshot written by `save`. With `mmap`, arrays are mapped
+        read-only rather than read, so opening is near-instant and pages are
+        only read from disk (and shared between processes) as they're used.
+        '''
+        with open(path, 'rb') as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError(f'{path} is not a chart snapshot')
+            length, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(length).decode())
+        start = len(SNAPSHOT_MAGIC) + 8 + length
+
+        def read(spec: Dict[str, Any]) -> np.ndarray:
+            dtype = np.dtype(spec['dtype'])
+            shape = tuple(spec['shape'])
+            offset = start + spec['offset']
+            count = int(np.prod(shape))
+            # Empty arrays can't be mapped
+            if not mmap or not count:
+                return np.fromfile(path, dtype, count, offset=offset) \
+                    .reshape(shape)
+            mapped = np.memmap(path, dtype, 'r', offset, shape)
+            # A plain ndarray view, so slices aren't memmaps themselves
+            return mapped.view(np.ndarray)
+
+        store = cls(
+            read(header['times']),
+            header['pairs'],
+            {name: read(spec) for name, spec in header['columns'].items()},
+            read(header['present']),
+        )
+        if mmap:
+            store._path = os.path.abspath(path)
+        return store
+
+    @contextmanager
+    def shared(
+        self,
+        directory: Optional[str] = SHARED_DIRECTORY,
+    ) -> Iterator['ChartStore']:
+        '''
+        A copy of the store memory-mapped from a temporary snapshot in
+        `directory` (by default /dev/shm, so it lives in shared memory), for
+        the duration of the `with` block. Pass it to worker processes instead
+        of this store and they'll attach to the one copy instead of each
+        unpickling their own.
+
+        If the snapshot doesn't fit in `directory`, it goes in the temporary
+        directory (`tempfile.gettempdir()`) instead; the page cache still
+        shares one copy between processes, though it may be written to disk.
+
+        The snapshot is deleted on leaving the block. Processes already
+        attached keep their mapping, but can no longer send the store on.
+        A store that's already mapped from a snapshot is used as it is.
+        '''
+        if self._path is not None:
+            yield self
+            return
+        path = None
+        if directory is not None:
+            try:
+                free = shutil.disk_usage(directory).free
+                if free < self.nbytes:
+                    raise OSError(errno.ENOSPC, 'Not enough space', directory)
+                path = self._save_temporary(directory)
+            except OSError as e:
+                logger.warning(
+                    f'Could not share charts through {directory} ({e}); '
+                    f'using {tempfile.gettempdir()} instead'
+                )
+        if path is None:
+            path = self._save_temporary(None)
+        try:
+            yield type(self).load(path)
+        finally:
+            os.remove(path)
+
+    def _save_temporary(self, directory: Optional[str]) -> str:
+        '''
+        Save a snapshot to a new temporary file in `directory`, returning
+        its path. Nothing is left behind if that fails.
+        '''
+        fd, path = tempfile.mkstemp(
+            prefix='moneybot-charts-',
+            suffix='.snapshot',
+            dir=directory,
+        )
+        os.close(fd)
+        try:
+            self.save(path)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path
+
+    @property
+    def nbytes(self) -> int:
+        '''
+        Roughly how big a snapshot of the store is: the size of its arrays.
+        '''
+        arrays = [self._times, self._present] + list(self._columns.values())
+        return sum(array.nbytes for array in arrays)
+
+    @property
+    def path(self) -> Optional[str]:
+        return self._path
+
+    def __reduce__(self) -> Any:
+        if self._path is not None:
+            return (type(self).load, (self._path,))
+        return (
+            type(self),
+            (self._times, self._pairs, self._columns, self._present),
+        )
+
+    def __deepcopy__(self, memo: Dict) -> 'ChartStore':
+        # Immutable; copying would only waste memory
+        return self
+
+    @property
+    def times(self) -> np.ndarray:
+        return self._times
+
+    @property
+    def pairs(self) -> List[str]:
+        return self._pairs
+
+    @property
+    def column_names(self) -> List[str]:
+        return list(self._columns)
+
+    def column(self, key: str) -> np.ndarray:
+        '''
+        Returns the (time x currency pair) matrix for a column.
+        '''
+        return self._columns[key]
+
+    @property
+    def present(self) -> np.ndarray:
+        return self._present
+
+    def _row_range(self, time: datetime, days_back: float) -> slice:
+        '''
+        Row indices with `time - days_back < row time <= time`.
+        '''
+        end = to_datetime64(time)
+        start = to_datetime64(time - timedelta(days=days_back))
+        lo = np.searchsorted(self._times, start, side='right')
+        hi = np.searchsorted(self._times, end, side='right')
+        return slice(lo, hi)
+
+    def latest(
+        self,
+        time: datetime,
+        days_back: float = 1,
+    ) -> Dict[str, Dict[str, Any]]:
+        '''
+        Returns the most recent row for each currency pair with a reading in
+        the `days_back` days up to and including `time`.
+        '''
+        rows = self._row_range(time, days_back)
+        block = self._present[rows][::-1]
+        if not len(block):
+            return {}
+        has_row = block.any(axis=0)
+        # argmax finds the first True, i.e. the most recent reading
+        last = rows.stop - 1 - block.argmax(axis=0)
+
+        pair_idxs = np.flatnonzero(has_row)
+        row_idxs = last[pair_idxs]
+        values = {
+            name: column[row_idxs, pair_idxs].tolist()
+            for name, column in self._columns.items()
+        }
+        times = self._times[row_idxs]
+
+        result = {}
+        for k, j in enumerate(pair_idxs):
+            pair = self._pairs[j]
+            row: Dict[str, Any] = {
+                name: (None if isnan(column[k]) else column[k])
+                for name, column in values.items()
+            }
+            row['time'] = Timestamp(times[k])
+            row['currency_pair'] = pair
+            result[pair] = row
+        return result
+
+    def as_of(
+        self,
+        times: Iterable[datetime],
+        key: str = 'weighted_average',
+        days_back: float = 1,
+    ) -> np.ndarray:
+        '''
+        Returns a (time x currency pair) matrix of `key` at each of `times`,
+        taken from the most recent reading in the `days_back` days up to and
+        including that time (as `latest` would), or NaN if there is none.
+        '''
+        times = list(times)
+        ends = np.array([to_datetime64(t) for t in times], dtype='datetime64[ns]')
+        starts = np.array(
+            [to_datetime64(t - timedelta(days=days_back)) for t in times],
+            dtype='datetime64[ns]',
+        )
+        n_times, n_pairs = self._present.shape
+        # For every row and pair, the last row at or before it with a reading
+        rows = np.where(self._present, np.arange(n_times)[:, None], -1)
+        last = np.maximum.accumulate(rows, axis=0)
+
+        at = np.searchsorted(self._times, ends, side='right') - 1
+        picked = np.where((at >= 0)[:, None], last[at.clip(0)], -1)
+        valid = picked >= 0
+        valid &= self._times[picked.clip(0)] > starts[:, None]
+        values = self._columns[key][picked.clip(0), np.arange(n_pairs)]
+        return np.where(valid, values, np.nan)
+
+    def history(
+        self,
+        time: datetime,
+        currency_pair: str,
+        days_back: float = 30,
+        key: str = 'price_usd',
+    ) -> Series:
+        '''
+        Returns a time-indexed Series of `key` for one currency pair, most
+        recent reading first.
+        '''
+        j = self._pair_index.get(currency_pair)
+        if j is None:
+            return Series([], index=to_datetime([]), dtype=float)
+        rows = self._row_range(time, days_back)
+        mask = self._present[rows, j]
+        values = self._columns[key][rows, j][mask][::-1]
+        index = self._times[rows][mask][::-1]
+        return Series(values, index=to_datetime(index))
+
+    def histories(
+        self,
+        time: datetime,
+        currency_pairs: List[str],
+        days_back: float = 30,
+        key: str = 'price_usd',
+    ) -> DataFrame:
+        '''
+        Returns `key` for several currency pairs as a (time x pair) frame,
+        most recent reading first. Times at which none of the pairs have a
+        reading are left out; otherwise missing readings are NaN.
+        '''
+        rows = self._row_range(time, days_back)
+        js = [self._pair_index.get(pair) for pair in currency_pairs]
+        known = np.array([j is not None for j in js], dtype=bool)
+        idxs = np.array([0 if j is None else j for j in js], dtype=int)
+
+        present = self._present[rows][:, idxs] & known
+        values = np.where(present, self._columns[key][rows][:, idxs], np.nan)
+        keep = present.any(axis=1)
+        return DataFrame(
+            values[keep][::-1],
+            index=to_datetime(self._times[rows][keep][::-1]),
+            columns=list(currency_pairs),
+        )
+
+
+class ColumnarMarketHistory:
+    '''
+    A MarketHistory for backtests, answering every query from a ChartStore
+    loaded up front (see `MarketHistory.chart_store`) instead of going back to
+    Postgres on every step.
+    '''
+
+    def __init__(self, store: ChartStore) -> None:
+        self.store = store
+
+    def scrape_latest(self) -> None:
+        '''
+        Does nothing: the store is a fixed snapshot, so there is nothing new
+        to ingest. Scrape with a MarketHistory and build a new store instead.
+        '''
+
+    def latest(self, time: datetime) -> Dict[str, Dict[str, Any]]:
+        return self.store.latest(time)
+
+    def asset_history(
+        self,
+        time: datetime,
+        base: str,
+        quote: str,
+        days_back: int = 30,
+        key: str = 'price_usd',
+    ) -> Series:
+        return self.store.history(time, f'{base}_{quote}', days_back, key)
+
+    def asset_histories(
+        self,
+        time: datetime,
+        currency_pairs: List[str],
+        days_back: float = 30,
+        key: str = 'price_usd',
+    ) -> DataFrame:
+        return self.store.histories(time, currency_pairs, days_back, key)
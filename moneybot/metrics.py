@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+from math import nan
+from math import sqrt
+from typing import Dict
+from typing import Iterable
+
+import numpy as np
+from pandas import DataFrame
+
+from moneybot.analytics import window_metrics
+
+
+def _ratio(numerator: float, denominator: float) -> float:
+    '''
+    `numerator / denominator`, or NaN where that's undefined.
+    '''
+    if not denominator or denominator != denominator:
+        return nan
+    return numerator / denominator
+
+
+class RunningMetrics:
+    '''
+    Performance metrics of a series of fund values, kept up to date one value
+    at a time in constant memory, so a backtest's values never have to be
+    held all at once:
+
+        metrics = RunningMetrics.of(fund.run_backtest(start, end))
+
+    Returns are the change in value from each step to the next. Ratios are
+    per step (not annualized), with the risk-free rate given per step too.
+    Anything undefined (e.g. the volatility of fewer than two returns) is
+    NaN.
+    '''
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.first = nan
+        self.last = nan
+        self.peak = nan
+        self.max_drawdown = 0.0
+        # Welford's running mean and sum of squared deviations of returns
+        self._returns = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        # Sum of squared negative returns, for the downside deviation
+        self._downside = 0.0
+
+    @classmethod
+    def of(cls, values: Iterable[float]) -> 'RunningMetrics':
+        metrics = cls()
+        for value in values:
+            metrics.update(value)
+        return metrics
+
+    def update(self, value: float) -> None:
+        # Called for every step of a backtest, so kept lean
+        if self.count:
+            last = self.last
+            r = value / last - 1 if last else nan
+            n = self._returns = self._returns + 1
+            delta = r - self._mean
+            self._mean += delta / n
+            self._m2 += delta * (r - self._mean)
+            if r < 0:
+                self._downside += r * r
+        else:
+            self.first = value
+            self.peak = value
+
+        self.count += 1
+        self.last = value
+        peak = self.peak
+        if value > peak:
+            self.peak = value
+        elif peak:
+            # The worst fall from any peak to a later value
+            drawdown = (peak - value) / peak
+            if drawdown > self.max_drawdown:
+                self.max_drawdown = drawdown
+
+    @property
+    def roi(self) -> float:
+        return _ratio(self.last - self.first, self.first)
+
+    @property
+    def mean_return(self) -> float:
+        return self._mean if self._returns else nan
+
+    @property
+    def volatility(self) -> float:
+        '''
+        The sample standard deviation of returns.
+        '''
+        if self._returns < 2:
+            return nan
+        return sqrt(self._m2 / (self._returns - 1))
+
+    @property
+    def downside_deviation(self) -> float:
+        '''
+        The root mean square of negative returns (counting the rest as 0).
+        '''
+        if not self._returns:
+            return nan
+        return sqrt(self._downside / self._returns)
+
+    def sharpe_ratio(self, risk_free_rate: float = 0.0) -> float:
+        return _ratio(self.mean_return - risk_free_rate, self.volatility)
+
+    def sortino_ratio(self, risk_free_rate: float = 0.0) -> float:
+        return _ratio(self.mean_return - risk_free_rate, self.downside_deviation)
+
+    def sterling_ratio(self, risk_free_rate: float = 0.0) -> float:
+        '''
+        ROI over the whole series, less `risk_free_rate` (for the whole
+        series, unlike the other ratios), over the max drawdown.
+        '''
+        return _ratio(self.roi - risk_free_rate, self.max_drawdown)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            'roi': self.roi,
+            'max_drawdown': self.max_drawdown,
+            'volatility': self.volatility,
+            'sharpe_ratio': self.sharpe_ratio(),
+            'sortino_ratio': self.sortino_ratio(),
+            'sterling_ratio': self.sterling_ratio(),
+        }
+
+
+def batch_metrics(values: np.ndarray) -> DataFrame:
+    '''
+    The metrics of `RunningMetrics.as_dict` for many series of values at
+    once, given as a (series x step) array, e.g. one row per backtest window.
+    Returns a DataFrame with a row for each series.
+
+    See `moneybot.analytics.window_metrics` for annualized metrics, and more
+    of them.
+    '''
+    # Per step, as RunningMetrics
+    metrics = window_metrics(values, periods_per_year=1)
+    metrics['sterling_ratio'] = metrics['roi'] / metrics['max_drawdown']
+    metrics.loc[metrics['max_drawdown'] == 0, 'sterling_ratio'] = nan
+    return metrics[[
+        'roi',
+        'max_drawdown',
+        'volatility',
+        'sharpe_ratio',
+        'sortino_ratio',
+        'sterling_ratio',
+    ]]
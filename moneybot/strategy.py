@@ -4,6 +4,9 @@ from abc import abstractmethod
 from logging import getLogger
 from typing import FrozenSet
 from typing import List
+from typing import Tuple
+
+import numpy as np
 
 from moneybot.market.history import MarketHistory
 from moneybot.market.state import MarketState
@@ -45,6 +48,23 @@ class Strategy(metaclass=ABCMeta):
     ) -> List[AbstractTrade]:
         raise NotImplementedError
 
+    def target_weights(
+        self,
+        prices: np.ndarray,
+        holdings: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Strategies that only ever rebalance to target weights can implement
+        this, to be backtested by `moneybot.vectorized` without stepping
+        through time.
+
+        Given a (time x coin) matrix of prices in fiat (fiat first, NaN where
+        a coin isn't available) and the starting holdings of each coin,
+        returns the weights (by value) to rebalance to at each time, and
+        whether to rebalance at each time.
+        '''
+        raise NotImplementedError
+
     '''
     Trade proposal utilities
     '''
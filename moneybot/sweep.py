@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import os
+from copy import copy
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from logging import getLogger
+from time import perf_counter
+from typing import Any
+from typing import Dict
+from typing import IO
+from typing import Iterator
+from typing import List
+from typing import Mapping
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import Type
+
+from moneybot.evaluate import evaluate
+from moneybot.fund import Fund
+from moneybot.market.adapters.backtest import BacktestMarketAdapter
+from moneybot.market.store import ChartStore
+from moneybot.market.store import ColumnarMarketHistory
+from moneybot.strategy import Strategy
+
+
+logger = getLogger(__name__)
+
+# The parameter giving a strategy's trade interval, in seconds; every other
+# parameter is set as an attribute of the strategy
+INTERVAL = 'trade_interval'
+
+# The sweep being run in this process, set up once per worker
+_sweep: Optional['Sweep'] = None
+
+
+def parameter_grid(grid: Mapping[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+    '''
+    Every combination of the values in `grid`, e.g. `{'magic_number': [1.5,
+    2], 'trade_interval': [86400]}` gives two configurations, one with each
+    magic number.
+    '''
+    names = sorted(grid)
+    return [
+        dict(zip(names, values))
+        for values in product(*(grid[name] for name in names))
+    ]
+
+
+def config_key(params: Mapping[str, Any]) -> str:
+    '''
+    A string identifying a configuration, stable across runs.
+    '''
+    return json.dumps(params, sort_keys=True)
+
+
+def make_strategy(
+    strategy_cls: Type[Strategy],
+    fiat: str,
+    params: Mapping[str, Any],
+) -> Strategy:
+    params = dict(params)
+    strategy = strategy_cls(fiat, params.pop(INTERVAL))
+    for name, value in params.items():
+        # Catch typos, rather than sweeping over a setting nothing reads
+        if not hasattr(strategy, name):
+            raise ValueError(
+                f'{strategy_cls.__name__} has no parameter {name!r}'
+            )
+        setattr(strategy, name, value)
+    return strategy
+
+
+class Sweep:
+    '''
+    Evaluates a Strategy (as `evaluate` does) with every configuration of
+    parameters in a grid, over one ChartStore.
+
+    Configurations are spread over a pool of `workers` processes. The store
+    is handed to each worker once, when it starts, rather than with every
+    configuration, and then through `ChartStore.shared`, so every worker maps
+    the same copy of the market data instead of holding its own.
+
+    Each configuration's `summary()` is appended to a CSV file as it
+    finishes. Configurations already in the file are skipped, so an
+    interrupted sweep picks up where it left off when run again.
+    '''
+
+    def __init__(
+        self,
+        strategy_cls: Type[Strategy],
+        store: ChartStore,
+        start_date: str,
+        end_date: str,
+        fiat: str = 'BTC',
+        initial_balances: Optional[Dict[str, float]] = None,
+        duration_days: int = 90,
+        window_distance_days: int = 30,
+    ) -> None:
+        self.strategy_cls = strategy_cls
+        self.store = store
+        self.start_date = start_date
+        self.end_date = end_date
+        self.fiat = fiat
+        self.initial_balances = initial_balances or {fiat: 1.0}
+        self.duration_days = duration_days
+        self.window_distance_days = window_distance_days
+
+    def make_fund(self, params: Mapping[str, Any]) -> Fund:
+        strategy = make_strategy(self.strategy_cls, self.fiat, params)
+        # Stands in for a MarketHistory, over the shared store
+        history: Any = ColumnarMarketHistory(self.store)
+        adapter = BacktestMarketAdapter(
+            self.fiat,
+            history,
+            dict(self.initial_balances),
+        )
+        return Fund(strategy, adapter)
+
+    def evaluate(self, params: Mapping[str, Any]) -> Dict[str, Any]:
+        '''
+        Evaluate one configuration, returning its row of results.
+        '''
+        start = perf_counter()
+        summary = evaluate(
+            self.make_fund(params),
+            self.start_date,
+            self.end_date,
+            duration_days=self.duration_days,
+            window_distance_days=self.window_distance_days,
+        )
+        row: Dict[str, Any] = {'config': config_key(params)}
+        row.update(params)
+        row.update(summary.to_dict())
+        row['seconds'] = perf_counter() - start
+        return row
+
+    def run(
+        self,
+        grid: Mapping[str, Sequence[Any]],
+        path: str,
+        workers: int = 1,
+    ) -> Iterator[Dict[str, Any]]:
+        '''
+        Evaluate every configuration in `grid` not already in the CSV file at
+        `path`, appending each one's results to it. Yields those results, in
+        the order they finish.
+        '''
+        configs = parameter_grid(grid)
+        done = read_completed(path)
+        todo = [params for params in configs if config_key(params) not in done]
+        logger.info(
+            f'Sweeping {len(todo)} of {len(configs)} configurations '
+            f'({len(configs) - len(todo)} already done) on {workers} workers'
+        )
+        if not todo:
+            return
+
+        with ResultWriter(path, ['config'] + sorted(grid)) as writer:
+            if workers > 1:
+                with self.store.shared() as store:
+                    shared = copy(self)
+                    shared.store = store
+                    with ProcessPoolExecutor(
+                        max_workers=workers,
+                        initializer=_init_worker,
+                        initargs=(shared,),
+                    ) as executor:
+                        futures = {
+                            executor.submit(_evaluate, params): params
+                            for params in todo
+                        }
+                        for future in as_completed(futures):
+                            try:
+                                row = future.result()
+                            except Exception:
+                                logger.exception(
+                                    f'Configuration {futures[future]} failed'
+                                )
+                                continue
+                            writer.write(row)
+                            yield row
+            else:
+                for params in todo:
+                    try:
+                        row = self.evaluate(params)
+                    except Exception:
+                        logger.exception(f'Configuration {params} failed')
+                        continue
+                    writer.write(row)
+                    yield row
+
+
+def _init_worker(sweep: Sweep) -> None:
+    global _sweep
+    _sweep = sweep
+
+
+def _evaluate(params: Mapping[str, Any]) -> Dict[str, Any]:
+    assert _sweep is not None
+    return _sweep.evaluate(params)
+
+
+def _read_rows(path: str) -> List[Dict[str, str]]:
+    '''
+    The complete rows of the results file at `path`; a row cut short by an
+    interruption is left out.
+    '''
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', newline='') as f:
+        reader = csv.DictReader(f)
+        return [
+            row for row in reader
+            if None not in row and None not in row.values()
+        ]
+
+
+def read_completed(path: str) -> Set[str]:
+    '''
+    The keys (see `config_key`) of configurations in the results file at
+    `path`.
+    '''
+    return {row['config'] for row in _read_rows(path)}
+
+
+class ResultWriter:
+    '''
+    Appends rows of results to a CSV file, flushing after each so as little
+    as possible is lost to an interruption.
+
+    Opening it rewrites the file with only its complete rows, so anything
+    appended doesn't run on from a half-written line. The header is taken
+    from the first row written to a new file.
+
+    Every row is expected to start with `columns` (e.g. a sweep's config
+    key and parameters); opening a file whose header doesn't, such as the
+    results of a sweep over another grid, raises a ValueError.
+    '''
+
+    def __init__(self, path: str, columns: Sequence[str] = ()) -> None:
+        self.path = path
+        self.columns = list(columns)
+        self._file: Optional[IO[str]] = None
+        self._writer: Optional[csv.DictWriter] = None
+
+    def __enter__(self) -> 'ResultWriter':
+        rows = _read_rows(self.path)
+        if rows:
+            fieldnames = list(rows[0].keys())
+            if fieldnames[:len(self.columns)] != self.columns:
+                raise ValueError(
+                    f'{self.path} has columns {fieldnames}, which don\'t '
+                    f'start with {self.columns}; write these results to '
+                    'another file'
+                )
+            temp_path = f'{self.path}.tmp'
+            with open(temp_path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames)
+                writer.writeheader()
+                writer.writerows(rows)
+            os.replace(temp_path, self.path)
+            self._open(fieldnames, header=False)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._file is not None:
+            self._file.close()
+
+    def _open(self, fieldnames: List[str], header: bool) -> None:
+        self._file = open(self.path, 'w' if header else 'a', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames)
+        if header:
+            self._writer.writeheader()
+
+    def write(self, row: Dict[str, Any]) -> None:
+        if self._writer is None:
+            self._open(list(row.keys()), header=True)
+        assert self._file is not None and self._writer is not None
+        self._writer.writerow(row)
+        self._file.flush()
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from typing import Dict
 from typing import List
+from typing import Mapping
 
 from moneybot.market import Order
 from moneybot.market.state import MarketState
@@ -9,22 +10,27 @@ from moneybot.trade import AbstractTrade
 
 def simulate_order(
     order: Order,
-    balances: Dict[str, float],
+    balances: Mapping[str, float],
+    fee: float = 0,
 ) -> Dict[str, float]:
-    """TODO: Docstring, state assumptions going into this simulation
+    """Returns `balances` after `order` is filled in full at its price, less
+    a `fee` (a fraction) of whatever it buys.
 
-    We can get fancier with this later, observe trends in actual trades we
-    propose vs execute, and use that to make more realistic simulations!
-    After all, our proposed price will not always be achievable.
+    For anything more realistic, e.g. slippage or fills at a later price,
+    see the execution models in `moneybot.market.fills`.
     """
     if order.direction == Order.Direction.BUY:
         base_delta = -order.base_amount
         quote_delta = order.quote_amount
+        if fee:
+            quote_delta *= 1 - fee
     else:
         base_delta = order.base_amount
         quote_delta = -order.quote_amount
+        if fee:
+            base_delta *= 1 - fee
 
-    new = balances.copy()
+    new = dict(balances)
     new[order.base_currency] = new.get(order.base_currency, 0) + base_delta
     new[order.quote_currency] = new.get(order.quote_currency, 0) + quote_delta
     return new
@@ -36,7 +42,7 @@ def simulate_trades(
 ) -> Dict[str, float]:
     """
     """
-    new = market_state.balances.copy()
+    new = dict(market_state.balances)
 
     for trade in trades:
         sell_amount = market_state.estimate_value(
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from logging import getLogger
+from typing import Dict
+from typing import List
+
+import numpy as np
+from pandas import DataFrame
+from pandas import date_range
+from pandas import Timestamp
+
+from moneybot.market import format_currency_pair
+from moneybot.market import split_currency_pair
+from moneybot.market.store import ChartStore
+from moneybot.strategy import Strategy
+
+
+logger = getLogger(__name__)
+
+
+class PriceMatrix:
+    '''
+    The price, in `fiat`, of every coin with a market against it, at each
+    of `times`: a (time x coin) matrix, with `fiat` itself first (at a price
+    of 1), and NaN wherever a coin has no chart (so isn't available, as far
+    as MarketState is concerned).
+
+    `usd` holds the USD price of `fiat` at each time.
+    '''
+
+    def __init__(
+        self,
+        store: ChartStore,
+        fiat: str,
+        times: List[Timestamp],
+        key: str = 'weighted_average',
+    ) -> None:
+        self.fiat = fiat
+        self.times = list(times)
+
+        pairs = store.pairs
+        values = store.as_of(self.times, key)
+        markets = [
+            j for j, pair in enumerate(pairs)
+            if split_currency_pair(pair)[0] == fiat
+        ]
+        self.coins = [fiat] + [split_currency_pair(pairs[j])[1] for j in markets]
+        self.prices = np.hstack([np.ones((len(self.times), 1)), values[:, markets]])
+
+        usd_pair = format_currency_pair('USD', fiat)
+        if usd_pair in pairs:
+            self.usd = values[:, pairs.index(usd_pair)]
+        else:
+            self.usd = np.full(len(self.times), np.nan)
+
+    def holdings(self, balances: Dict[str, float]) -> np.ndarray:
+        '''
+        `balances` as a vector over `coins`. Coins without a market against
+        `fiat` can't be valued, so are left out.
+        '''
+        index = {coin: i for i, coin in enumerate(self.coins)}
+        holdings = np.zeros(len(self.coins))
+        for coin, amount in balances.items():
+            if coin in index:
+                holdings[index[coin]] = amount
+            elif amount:
+                logger.warning(f'Ignoring {amount} {coin}; it has no {self.fiat} market')
+        return holdings
+
+
+def equal_weights(prices: np.ndarray) -> np.ndarray:
+    '''
+    Weights splitting value equally between every available coin, at every
+    time.
+    '''
+    available = ~np.isnan(prices)
+    counts = available.sum(axis=1, keepdims=True)
+    return np.divide(
+        available,
+        counts,
+        out=np.zeros(prices.shape),
+        where=counts > 0,
+    )
+
+
+def portfolio_values(
+    prices: np.ndarray,
+    weights: np.ndarray,
+    rebalance: np.ndarray,
+    holdings: np.ndarray,
+) -> np.ndarray:
+    '''
+    The value (in the prices' currency) over time of a portfolio starting
+    with `holdings`, which is rebalanced to the target `weights` (by value)
+    at every time where `rebalance` is true, and otherwise left alone.
+
+    Rebalancing is ideal: at the prices given, with no fees. A coin missing
+    a price (a gap in its chart) is valued at its last one, so a gap at a
+    rebalance doesn't lose the holding; before its first price, it counts for
+    nothing.
+
+    Between rebalances, every coin's value grows with its price, so the
+    portfolio grows by the weighted sum of price ratios since the last
+    rebalance; chaining those growths (with a cumulative product) gives the
+    value at each rebalance, all without stepping through time.
+    '''
+    n_times = len(prices)
+    prices = DataFrame(prices).ffill().to_numpy()
+    known = np.nan_to_num(prices)
+    # What the starting holdings are worth, up until the first rebalance
+    held = known @ holdings
+
+    points = np.flatnonzero(rebalance)
+    if not len(points):
+        return held
+
+    # The last rebalance at or before each time
+    segment = np.searchsorted(points, np.arange(n_times), side='right') - 1
+    last = points[segment.clip(0)]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Growth of each rebalanced portfolio since it was rebalanced...
+        ratios = np.nan_to_num(prices / prices[last])
+        growth = (weights[last] * ratios).sum(axis=1)
+        # ...and of each, through to the next rebalance
+        through = np.nan_to_num(prices[points[1:]] / prices[points[:-1]])
+    segment_growth = (weights[points[:-1]] * through).sum(axis=1)
+
+    at_points = held[points[0]] * np.concatenate(
+        [[1.0], np.cumprod(segment_growth)],
+    )
+    return np.where(segment < 0, held, at_points[segment.clip(0)] * growth)
+
+
+def run_backtest(
+    strategy: Strategy,
+    store: ChartStore,
+    initial_balances: Dict[str, float],
+    start_time: str,
+    end_time: str,
+) -> np.ndarray:
+    '''
+    Like `Fund.run_backtest` on a BacktestMarketAdapter over `store`, but
+    for strategies that implement `Strategy.target_weights`: returns the
+    fund's USD value at every trade interval from `start_time` to `end_time`.
+    '''
+    times = date_range(
+        Timestamp(start_time),
+        Timestamp(end_time),
+        freq=f'{strategy.trade_interval}S',
+    )
+    matrix = PriceMatrix(store, strategy.fiat, times)
+    holdings = matrix.holdings(initial_balances)
+    weights, rebalance = strategy.target_weights(matrix.prices, holdings)
+    values = portfolio_values(matrix.prices, weights, rebalance, holdings)
+    return values * matrix.usd
@@ -18,6 +18,7 @@ setup(
         'pyloniex>=0.0.7',
         'PyStaticConfiguration[yaml]',
         'requests',
+        'tenacity',
     ],
 
     author='Nick Merrill',
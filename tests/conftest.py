@@ -3,7 +3,8 @@ import logging
 from unittest.mock import patch
 
 from pytest import fixture
-from pyloniex import PoloniexPrivateAPI
+
+from moneybot.clients import SerializedPrivateAPI
 
 
 logging.basicConfig(level=logging.INFO)
@@ -11,6 +12,6 @@ logging.basicConfig(level=logging.INFO)
 
 @fixture(scope='session', autouse=True)
 def poloniex_private():
-    dummy = PoloniexPrivateAPI(key='polo key', secret='polo secret')
+    dummy = SerializedPrivateAPI(key='polo key', secret='polo secret')
     with patch('moneybot.clients.Poloniex.get_private', return_value=dummy):
         yield dummy
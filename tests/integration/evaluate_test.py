@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from moneybot.evaluate import evaluate
+from moneybot.examples.strategies import BuffedCoinStrategy
+from moneybot.fund import Fund
+from moneybot.instrumentation import HistogramCollector
+from moneybot.market.adapters.backtest import BacktestMarketAdapter
+from moneybot.testing import MarketHistoryMock
+
+
+def make_fund():
+    fiat = 'BTC'
+    strategy = BuffedCoinStrategy(fiat, 86400)
+    adapter = BacktestMarketAdapter(
+        fiat,
+        MarketHistoryMock(),
+        {fiat: 1.0},
+    )
+    return Fund(strategy, adapter)
+
+
+def test_evaluate_parallel_matches_serial():
+    """Running windows in a process pool gives the same summary as running
+    them one after another.
+    """
+    kwargs = dict(duration_days=7, window_distance_days=7)
+    serial = evaluate(make_fund(), '2017-05-01', '2017-06-01', **kwargs)
+    parallel = evaluate(
+        make_fund(), '2017-05-01', '2017-06-01', workers=2, **kwargs,
+    )
+    assert serial.equals(parallel)
+
+
+def test_evaluate_windows_are_independent():
+    """Evaluating doesn't change the Fund it was given.
+    """
+    fund = make_fund()
+    evaluate(fund, '2017-05-01', '2017-05-15', 7, 7)
+    assert fund.market_adapter.market_state.balances == {'BTC': 1.0}
+
+
+class PickleCounter:
+    pickled = 0
+
+    def __getstate__(self):
+        type(self).pickled += 1
+        return {}
+
+
+def test_evaluate_sends_the_fund_once_per_worker():
+    """The Fund goes to each worker when it starts, not with every window.
+    """
+    fund = make_fund()
+    fund.counter = PickleCounter()
+    PickleCounter.pickled = 0
+    # Four windows on two workers
+    evaluate(fund, '2017-05-01', '2017-05-29', 7, 7, workers=2)
+    assert PickleCounter.pickled <= 2
+
+
+def step_count(collector):
+    return next(
+        sample['count'] for sample in collector.snapshot()['histograms']
+        if sample['name'] == 'moneybot_step_seconds'
+    )
+
+
+def test_evaluate_reports_to_the_funds_collectors():
+    """Every window's steps reach the collectors on the Fund evaluated, from
+    the copies in this process or in workers alike.
+    """
+    counts = []
+    for workers in [1, 2]:
+        fund = make_fund()
+        collector = HistogramCollector()
+        fund.add_observer(collector)
+        evaluate(fund, '2017-05-01', '2017-05-29', 7, 7, workers=workers)
+        counts.append(step_count(collector))
+    # Four windows of eight daily steps
+    assert counts == [32, 32]
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+
+import pytest
+
+from moneybot.evaluate import evaluate
+from moneybot.examples.strategies import BuffedCoinStrategy
+from moneybot.examples.strategies import PeakRiderStrategy
+from moneybot.market.store import ChartStore
+from moneybot.sweep import config_key
+from moneybot.sweep import make_strategy
+from moneybot.sweep import parameter_grid
+from moneybot.sweep import read_completed
+from moneybot.sweep import Sweep
+
+
+GRID = {
+    'magic_number': [1.25, 1.5],
+    'trade_interval': [86400],
+}
+
+
+@pytest.fixture(scope='module')
+def store():
+    with open('tests/mock-data/charts.json', 'r') as f:
+        return ChartStore.from_charts(json.load(f))
+
+
+def make_sweep(store):
+    return Sweep(
+        BuffedCoinStrategy,
+        store,
+        '2017-05-01',
+        '2017-06-01',
+        duration_days=7,
+        window_distance_days=7,
+    )
+
+
+def test_parameter_grid():
+    configs = parameter_grid({'b': [1, 2], 'a': ['x']})
+    assert configs == [{'a': 'x', 'b': 1}, {'a': 'x', 'b': 2}]
+
+
+def test_make_strategy():
+    strategy = make_strategy(
+        PeakRiderStrategy,
+        'BTC',
+        {'shortw': 48, 'longw': 1200, 'trade_interval': 3600},
+    )
+    assert (strategy.shortw, strategy.longw) == (48, 1200)
+    assert strategy.trade_interval == 3600
+    # Only the instance is changed
+    assert PeakRiderStrategy.shortw == 96
+
+    with pytest.raises(ValueError):
+        make_strategy(BuffedCoinStrategy, 'BTC', {
+            'magic_nubmer': 2,
+            'trade_interval': 3600,
+        })
+
+
+def test_sweep_matches_evaluate(store, tmpdir):
+    sweep = make_sweep(store)
+    path = str(tmpdir.join('sweep.csv'))
+    rows = {row['config']: row for row in sweep.run(GRID, path, workers=2)}
+    assert set(rows) == {config_key(params) for params in parameter_grid(GRID)}
+
+    for params in parameter_grid(GRID):
+        expected = evaluate(
+            sweep.make_fund(params),
+            '2017-05-01',
+            '2017-06-01',
+            duration_days=7,
+            window_distance_days=7,
+        )
+        row = rows[config_key(params)]
+        assert row['magic_number'] == params['magic_number']
+        assert row['mean'] == expected['mean']
+        assert row['sterling_ratio'] == expected['sterling_ratio']
+
+
+def test_sweep_resumes(store, tmpdir):
+    sweep = make_sweep(store)
+    path = str(tmpdir.join('sweep.csv'))
+    first = parameter_grid(GRID)[0]
+    list(sweep.run({k: [v] for k, v in first.items()}, path))
+    # An interruption part way through writing the next row
+    with open(path, 'a') as f:
+        f.write('"{""magic_number"": 1.5')
+
+    rows = list(sweep.run(GRID, path))
+    assert [row['magic_number'] for row in rows] == [1.5]
+    assert len(read_completed(path)) == 2
+    with open(path, 'r', newline='') as f:
+        assert len(list(csv.DictReader(f))) == 2
+
+    # Nothing left to do
+    assert list(sweep.run(GRID, path)) == []
+
+
+def test_sweep_wont_resume_another_grid(store, tmpdir):
+    sweep = make_sweep(store)
+    path = str(tmpdir.join('sweep.csv'))
+    list(sweep.run(GRID, path))
+    with open(path, 'r') as f:
+        before = f.read()
+
+    other = {'trade_interval': [43200]}
+    with pytest.raises(ValueError, match="don't start with"):
+        list(sweep.run(other, path))
+    with open(path, 'r') as f:
+        assert f.read() == before
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from moneybot.analytics import bootstrap
+from moneybot.analytics import drawdowns
+from moneybot.analytics import report
+from moneybot.analytics import time_under_water
+from moneybot.analytics import window_metrics
+from moneybot.metrics import RunningMetrics
+
+
+VALUES = np.array([
+    [100.0, 50, 120, 110, 100, 130],
+    [100.0, 110, 121, 133.1, 146.41, 161.051],
+])
+
+
+def test_drawdowns_and_time_under_water():
+    dd = drawdowns(VALUES)
+    assert dd[0].tolist() == pytest.approx([0, 0.5, 0, 1 / 12, 1 / 6, 0])
+    assert dd[1].tolist() == [0] * 6
+    assert time_under_water(dd).tolist() == [2, 0]
+
+
+def test_window_metrics():
+    metrics = window_metrics(VALUES, periods_per_year=5)
+    # Five steps at 5 a year is exactly a year
+    assert metrics['annual_return'].tolist() == pytest.approx([0.3, 0.61051])
+    assert metrics['max_drawdown'].tolist() == [0.5, 0]
+    assert metrics['calmar_ratio'][0] == pytest.approx(0.6)
+    assert np.isnan(metrics['calmar_ratio'][1])
+    assert metrics['hit_rate'].tolist() == [0.4, 1.0]
+    # Constant returns have no volatility
+    assert metrics['volatility'][1] == pytest.approx(0)
+    assert np.isnan(metrics['turnover']).all()
+
+    # Annualized from the per step figures
+    running = RunningMetrics.of(VALUES[0].tolist())
+    assert metrics['sharpe_ratio'][0] == pytest.approx(
+        running.sharpe_ratio() * np.sqrt(5),
+    )
+    assert metrics['sortino_ratio'][0] == pytest.approx(
+        running.sortino_ratio() * np.sqrt(5),
+    )
+
+
+def test_turnover():
+    traded = np.zeros(VALUES.shape)
+    traded[:, 0] = 100
+    metrics = window_metrics(VALUES, traded=traded)
+    assert metrics['turnover'].tolist() == pytest.approx(
+        100 / VALUES.mean(axis=1),
+    )
+
+
+def test_bootstrap():
+    rng = np.random.RandomState(0)
+    values = np.cumprod(1 + rng.normal(0.001, 0.01, size=(50, 100)), axis=1)
+    metrics = window_metrics(values)
+    intervals = bootstrap(metrics, seed=0)
+    assert list(intervals.index) == list(metrics.columns)
+    means = metrics.mean()
+    finite = intervals.drop('turnover')
+    assert (finite['estimate'] == means.drop('turnover')).all()
+    assert (finite['lower'] <= finite['estimate']).all()
+    assert (finite['estimate'] <= finite['upper']).all()
+    # No trades given, so no turnover
+    assert intervals.loc['turnover'].isnull().all()
+
+    # Reproducible with a seed
+    assert report(values, seed=1).equals(report(values, seed=1))
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import errno
+import json
+import os
+import pickle
+import shutil
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from pandas import Timestamp
+
+from moneybot.market.store import ChartStore
+from moneybot.market.store import ColumnarMarketHistory
+
+
+@pytest.fixture(scope='module')
+def charts():
+    with open('tests/mock-data/charts.json', 'r') as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope='module')
+def store(charts):
+    return ChartStore.from_charts(charts)
+
+
+def test_latest_matches_charts(charts, store):
+    for time, rows in charts.items():
+        latest = store.latest(Timestamp(time))
+        assert set(latest) == set(rows)
+        for pair, row in rows.items():
+            for key, value in row.items():
+                if key == 'time':
+                    assert latest[pair][key] == Timestamp(value).tz_convert(None)
+                else:
+                    assert latest[pair][key] == value
+
+
+def test_latest_outside_range(store):
+    assert store.latest(Timestamp('2016-01-01')) == {}
+
+
+def test_history(charts, store):
+    history = store.history(Timestamp('2017-05-10'), 'BTC_ETH', days_back=3)
+    assert list(history.index) == sorted(history.index, reverse=True)
+    assert len(history) == 3
+    assert history.iloc[0] == charts['2017-05-10 00:00:00']['BTC_ETH']['price_usd']
+
+
+def test_history_unknown_pair(store):
+    assert len(store.history(Timestamp('2017-05-10'), 'BTC_WAT')) == 0
+
+
+def test_histories_match_history(store):
+    time = Timestamp('2017-05-10')
+    pairs = ['BTC_ETH', 'BTC_XMR', 'BTC_WAT']
+    frame = store.histories(time, pairs, days_back=5)
+    assert list(frame.columns) == pairs
+    assert list(frame.index) == sorted(frame.index, reverse=True)
+    for pair in pairs[:2]:
+        history = store.history(time, pair, days_back=5)
+        assert frame[pair].dropna().equals(history)
+    assert frame['BTC_WAT'].isna().all()
+
+
+def test_save_and_load(tmpdir, store):
+    path = str(tmpdir.join('charts.snapshot'))
+    store.save(path)
+    for mmap in [True, False]:
+        loaded = ChartStore.load(path, mmap=mmap)
+        assert loaded.pairs == store.pairs
+        assert loaded.column_names == store.column_names
+        assert (loaded.times == store.times).all()
+        assert (loaded.present == store.present).all()
+        for name in store.column_names:
+            np.testing.assert_array_equal(loaded.column(name), store.column(name))
+        time = Timestamp('2017-05-10')
+        assert loaded.latest(time) == store.latest(time)
+
+
+def test_load_is_read_only(tmpdir, store):
+    path = str(tmpdir.join('charts.snapshot'))
+    store.save(path)
+    with pytest.raises(ValueError):
+        ChartStore.load(path).column('price_usd')[0, 0] = 0
+
+
+def test_load_rejects_other_files(tmpdir):
+    path = tmpdir.join('charts.json')
+    path.write('{}')
+    with pytest.raises(ValueError):
+        ChartStore.load(str(path))
+
+
+def test_as_of_matches_latest(charts, store):
+    times = [Timestamp(t) for t in ['2016-01-01', '2017-05-10', '2017-05-10 12:00']]
+    times += [Timestamp(t) for t in charts]
+    values = store.as_of(times, key='price_usd')
+    for time, row in zip(times, values):
+        latest = store.latest(time)
+        for pair, value in zip(store.pairs, row.tolist()):
+            expected = latest.get(pair, {}).get('price_usd')
+            if expected is None:
+                assert np.isnan(value)
+            else:
+                assert value == expected
+
+
+def test_pickle_copies_unmapped_store(store):
+    copy = pickle.loads(pickle.dumps(store))
+    assert copy is not store
+    assert copy.path is None
+    assert copy.latest(Timestamp('2017-05-10')) == store.latest(Timestamp('2017-05-10'))
+
+
+def test_shared_store_pickles_by_path(tmpdir, store):
+    time = Timestamp('2017-05-10')
+    with store.shared(str(tmpdir)) as shared:
+        assert os.path.exists(shared.path)
+        data = pickle.dumps(shared)
+        # Just the path, not the arrays
+        assert len(data) < 1024
+        attached = pickle.loads(data)
+        assert attached.path == shared.path
+        assert attached.latest(time) == store.latest(time)
+        # Already shared
+        with shared.shared() as again:
+            assert again is shared
+    assert not os.path.exists(shared.path)
+    # Still mapped after the file is gone
+    assert attached.latest(time) == store.latest(time)
+
+
+def test_shared_store_falls_back_to_temporary_directory(tmpdir, store):
+    shm = tmpdir.mkdir('shm')
+    temp = tmpdir.mkdir('temp')
+    save = ChartStore.save
+
+    def save_or_run_out(self, path):
+        if path.startswith(str(shm)):
+            raise OSError(errno.ENOSPC, 'No space left on device', path)
+        save(self, path)
+
+    with patch.object(ChartStore, 'save', save_or_run_out), \
+            patch('tempfile.tempdir', str(temp)):
+        with store.shared(str(shm)) as shared:
+            assert os.path.dirname(shared.path) == str(temp)
+            assert shared.latest(Timestamp('2017-05-10')) == \
+                store.latest(Timestamp('2017-05-10'))
+    # Nothing left behind in either
+    assert not shm.listdir()
+    assert not temp.listdir()
+
+
+def test_shared_store_checks_for_space_first(tmpdir, store):
+    shm = tmpdir.mkdir('shm')
+    temp = tmpdir.mkdir('temp')
+    full = shutil.disk_usage(str(shm))._replace(free=store.nbytes - 1)
+    with patch('shutil.disk_usage', return_value=full), \
+            patch('tempfile.tempdir', str(temp)):
+        with store.shared(str(shm)) as shared:
+            assert os.path.dirname(shared.path) == str(temp)
+            assert not shm.listdir()
+
+
+def test_columnar_history_scrape_latest_is_a_no_op(store):
+    history = ColumnarMarketHistory(store)
+    time = Timestamp('2017-05-10')
+    before = history.latest(time)
+    assert history.scrape_latest() is None
+    assert history.latest(time) == before
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+from threading import Thread
+from unittest.mock import patch
+
+import psycopg2
+import pytest
+from staticconf.testing import MockConfiguration
+
+from moneybot import CONFIG_NS
+from moneybot.clients import Postgres
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakeCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query):
+        if self.conn.broken:
+            self.conn.closed = 2
+            raise psycopg2.OperationalError('server closed the connection')
+
+
+class FakePool:
+    '''
+    Like ThreadedConnectionPool, raises when asked for more than `maxconn`.
+    '''
+
+    def __init__(self, minconn, maxconn, **kwargs):
+        self.maxconn = maxconn
+        self.idle = []
+        self.used = set()
+        self.opened = []
+
+    def getconn(self):
+        if len(self.used) >= self.maxconn:
+            raise psycopg2.pool.PoolError('connection pool exhausted')
+        conn = self.idle.pop() if self.idle else FakeConnection()
+        if conn not in self.opened:
+            self.opened.append(conn)
+        self.used.add(conn)
+        return conn
+
+    def putconn(self, conn, close=False):
+        self.used.remove(conn)
+        if not close:
+            self.idle.append(conn)
+
+
+@pytest.fixture
+def pool():
+    settings = {
+        'postgres': {
+            'host': 'localhost',
+            'port': 5432,
+            'username': 'postgres',
+            'password': 'secretpass',
+            'dbname': 'postgres',
+            'pool_max': 2,
+            'health_check_seconds': 0,
+        },
+    }
+    with MockConfiguration(settings, namespace=CONFIG_NS), \
+            patch('moneybot.clients.ThreadedConnectionPool', FakePool), \
+            patch.object(Postgres, '_pool', None):
+        yield Postgres.get_pool()
+
+
+def test_connection_commits_and_returns(pool):
+    with Postgres.connection() as conn:
+        assert conn in pool.used
+    assert conn.commits == 1
+    assert pool.idle == [conn]
+
+
+def test_connection_rolls_back_on_error(pool):
+    with pytest.raises(ValueError):
+        with Postgres.connection() as conn:
+            conn.rollbacks = 0
+            raise ValueError
+    assert conn.rollbacks == 1
+    assert conn.commits == 0
+
+
+def test_broken_connection_is_replaced(pool):
+    with Postgres.connection() as first:
+        pass
+    first.broken = True
+    with Postgres.connection() as second:
+        assert second is not first
+    assert pool.idle == [second]
+
+
+def test_every_broken_connection_is_replaced(pool):
+    # e.g. after the database restarts
+    with Postgres.connection() as first, Postgres.connection() as second:
+        pass
+    first.broken = second.broken = True
+    with Postgres.connection() as third:
+        assert third not in (first, second)
+    assert pool.idle == [third]
+
+
+def test_checkout_gives_up_without_a_working_connection(pool):
+    with patch.object(Postgres, '_is_healthy', return_value=False):
+        with pytest.raises(psycopg2.OperationalError):
+            with Postgres.connection():
+                pass
+    assert not pool.used
+
+
+def test_checkout_waits_for_a_free_connection(pool):
+    def use():
+        with Postgres.connection():
+            pass
+
+    threads = [Thread(target=use) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Never more than pool_max connections, and no PoolError
+    assert len(pool.opened) <= 2
+    assert not pool.used
+
+
+def test_new_pool_after_fork(pool):
+    with patch('os.getpid', return_value=-1):
+        assert Postgres.get_pool() is not pool
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import json
+
+import numpy as np
+import pytest
+from pandas import Timedelta
+from pandas import Timestamp
+from pyloniex.constants import OrderType
+
+from moneybot.examples.strategies import BuffedCoinStrategy
+from moneybot.fund import Fund
+from moneybot.market import Order
+from moneybot.market.adapters.backtest import BacktestMarketAdapter
+from moneybot.market.fills import ExecutionModel
+from moneybot.market.fills import Fees
+from moneybot.market.fills import NextCandle
+from moneybot.market.fills import OrderBatch
+from moneybot.market.fills import VolumeSlippage
+from moneybot.market.fills import realistic
+from moneybot.market.store import ChartStore
+from moneybot.market.store import ColumnarMarketHistory
+
+
+CHARTS = {
+    'BTC_ETH': {'weighted_average': 0.07, 'volume': 100.0},
+    'BTC_XMR': {'weighted_average': 0.02, 'volume': None},
+}
+
+
+@pytest.fixture
+def batch():
+    return OrderBatch([
+        Order('BTC_ETH', 0.07, 100, Order.Direction.BUY, OrderType.fill_or_kill),
+        Order('BTC_ETH', 0.07, 100, Order.Direction.SELL, OrderType.post_only),
+        Order('BTC_XMR', 0.02, 10, Order.Direction.BUY, OrderType.fill_or_kill),
+    ])
+
+
+def test_ideal(batch):
+    fills = ExecutionModel().fill(batch, CHARTS)
+    assert fills.prices.tolist() == [0.07, 0.07, 0.02]
+    assert fills.fees.tolist() == [0, 0, 0]
+
+
+def test_fees(batch):
+    fills = ExecutionModel(Fees(maker=0.001, taker=0.002)).fill(batch, CHARTS)
+    assert fills.fees.tolist() == [0.002, 0.001, 0.002]
+
+
+def test_volume_slippage(batch):
+    model = ExecutionModel(VolumeSlippage(impact=0.5, max_slippage=0.01))
+    fills = model.fill(batch, CHARTS)
+    # 7 BTC is 7% of the candle's volume, moving the price 3.5%...
+    np.testing.assert_allclose(fills.prices[:2], [0.07 * 1.01, 0.07 * 0.99])
+    # ...which is capped at 1%, as is a market with no volume recorded
+    np.testing.assert_allclose(fills.prices[2], 0.02 * 1.01)
+
+
+def test_next_candle(batch):
+    model = ExecutionModel(NextCandle(delay=60))
+    assert model.delay == 60
+    later = {'BTC_ETH': {'weighted_average': 0.071}}
+    fills = model.fill(batch, CHARTS, later)
+    assert fills.prices.tolist() == [0.071, 0.071, 0.02]
+
+
+def test_volume_slippage_after_next_candle(batch):
+    model = ExecutionModel(
+        NextCandle(delay=60),
+        VolumeSlippage(impact=0.5, max_slippage=0.05),
+    )
+    later = {'BTC_ETH': {'weighted_average': 0.08, 'volume': 400.0}}
+    fills = model.fill(batch, CHARTS, later)
+    # 8 BTC is 2% of the later candle's volume (not 8% of this one's),
+    # moving the price 1%
+    np.testing.assert_allclose(fills.prices[:2], [0.08 * 1.01, 0.08 * 0.99])
+    # Without a later candle, it's this candle's volume
+    fills = model.fill(batch, CHARTS, {})
+    np.testing.assert_allclose(fills.prices[:2], [0.07 * 1.035, 0.07 * 0.965])
+
+
+def test_realistic_backtest_is_worse():
+    with open('tests/mock-data/charts.json', 'r') as f:
+        history = ColumnarMarketHistory(ChartStore.from_charts(json.load(f)))
+
+    def run(model):
+        adapter = BacktestMarketAdapter('BTC', history, {'BTC': 1.0}, model)
+        fund = Fund(BuffedCoinStrategy('BTC', 86400), adapter)
+        return list(fund.run_backtest('2017-05-01', '2017-05-10'))
+
+    ideal = run(None)
+    assert ideal == run(ExecutionModel())
+    fees = run(ExecutionModel(Fees()))
+    assert all(f <= i for f, i in zip(fees, ideal))
+    assert fees[-1] < ideal[-1]
+    assert run(realistic())[-1] < ideal[-1]
+
+
+def test_backtest_fill_at_worse_price_is_affordable():
+    time = Timestamp('2017-05-01')
+    store = ChartStore.from_charts({
+        str(time): {'BTC_ETH': dict(CHARTS['BTC_ETH'], time=time)},
+    })
+    model = ExecutionModel(VolumeSlippage(impact=10, max_slippage=0.01))
+    adapter = BacktestMarketAdapter(
+        'BTC',
+        ColumnarMarketHistory(store),
+        {'BTC': 1.0},
+        model,
+    )
+    adapter.update_market_state(time)
+    # All our BTC at the quoted price, which slips by 1%
+    order = Order('BTC_ETH', 0.1, 10, Order.Direction.BUY, OrderType.fill_or_kill)
+    assert adapter.execute_order(order) == 0
+    balances = adapter.market_state.balances
+    assert balances['BTC'] == pytest.approx(0)
+    assert balances['ETH'] == pytest.approx(10 / 1.01)
+
+
+def test_next_candle_without_a_later_candle(caplog):
+    time = Timestamp('2017-05-01')
+    later = time + Timedelta(minutes=15)
+    store = ChartStore.from_charts({
+        str(time): {
+            'BTC_ETH': dict(CHARTS['BTC_ETH'], time=time),
+            'BTC_XMR': dict(CHARTS['BTC_XMR'], time=time),
+        },
+        str(later): {
+            'BTC_ETH': dict(CHARTS['BTC_ETH'], weighted_average=0.08, time=later),
+        },
+    })
+    adapter = BacktestMarketAdapter(
+        'BTC',
+        ColumnarMarketHistory(store),
+        {'BTC': 1.0},
+        ExecutionModel(NextCandle()),
+    )
+    adapter.update_market_state(time)
+    orders = [
+        Order('BTC_ETH', 0.07, 1, Order.Direction.BUY, OrderType.fill_or_kill),
+        Order('BTC_XMR', 0.02, 1, Order.Direction.BUY, OrderType.fill_or_kill),
+    ]
+    adapter.prepare_orders(orders)
+    # XMR has no candle after this one, which `latest` would have given us
+    # again as its "next"; it fills at this one, and we hear about it
+    assert [adapter._fills[id(order)][0] for order in orders] == [0.08, 0.02]
+    assert 'for 1 markets (BTC_XMR)' in caplog.text
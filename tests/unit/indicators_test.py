@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import json
+
+import numpy as np
+import pytest
+from pandas import Series
+from pandas import Timestamp
+from pandas import date_range
+
+from moneybot.indicators import EMA
+from moneybot.indicators import IndicatorCache
+from moneybot.indicators import PPOHistogram
+from moneybot.market.store import ChartStore
+from moneybot.market.store import ColumnarMarketHistory
+
+
+@pytest.fixture
+def prices():
+    rng = np.random.RandomState(0)
+    values = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, 500)))
+    values[[0, 17, 18, 250]] = np.nan
+    return Series(values)
+
+
+@pytest.fixture(scope='module')
+def market_history():
+    with open('tests/mock-data/charts.json', 'r') as f:
+        charts = json.load(f)
+    return ColumnarMarketHistory(ChartStore.from_charts(charts))
+
+
+@pytest.mark.parametrize('com', [1, 9, 96, 2400])
+def test_ema_matches_pandas(prices, com):
+    ema = EMA(com)
+    incremental = [ema.update(price) for price in prices]
+    expected = prices.ewm(com=com).mean()
+    np.testing.assert_allclose(incremental, expected, rtol=1e-12)
+
+
+def test_ppo_histogram_matches_pandas(prices):
+    hist = PPOHistogram(shortw=5, longw=20)
+    incremental = [hist.update(price) for price in prices]
+    short = prices.ewm(com=5).mean()
+    long = prices.ewm(com=20).mean()
+    ppo = (short - long) / long
+    expected = ppo - ppo.ewm(com=9).mean()
+    np.testing.assert_allclose(incremental, expected, rtol=1e-9, atol=1e-15)
+
+
+def test_cache_matches_recomputing(market_history):
+    cache = IndicatorCache(warmup_days=5)
+    start = Timestamp('2017-05-10')
+    for time in date_range(start, '2017-06-01'):
+        value = cache.ema(market_history, time, 'BTC', 'ETH', com=3)
+        # Everything since the warm-up began, oldest first
+        prices = market_history.asset_history(
+            time, 'BTC', 'ETH', (time - start).days + 5,
+        ).iloc[::-1]
+        assert value == pytest.approx(prices.ewm(com=3).mean().iloc[-1])
+
+
+def test_cache_starts_over_going_back_in_time(market_history):
+    cache = IndicatorCache(warmup_days=5)
+    cache.ema(market_history, Timestamp('2017-05-30'), 'BTC', 'ETH', com=3)
+    fresh = IndicatorCache(warmup_days=5)
+    time = Timestamp('2017-05-10')
+    value = cache.ema(market_history, time, 'BTC', 'ETH', com=3)
+    assert value == fresh.ema(market_history, time, 'BTC', 'ETH', com=3)
+
+
+def test_cache_keeps_history_since_warm_up(market_history):
+    # The EMA runs over every candle since it was warmed up, not a rolling
+    # window of `warmup_days`
+    cache = IndicatorCache(warmup_days=5)
+    start = Timestamp('2017-05-10')
+    cache.ema(market_history, start, 'BTC', 'ETH', com=3)
+    time = Timestamp('2017-05-25')
+    value = cache.ema(market_history, time, 'BTC', 'ETH', com=3)
+    since_warm_up = market_history.asset_history(
+        time, 'BTC', 'ETH', (time - start).days + 5,
+    ).iloc[::-1]
+    window = market_history.asset_history(time, 'BTC', 'ETH', 5).iloc[::-1]
+    assert value == pytest.approx(since_warm_up.ewm(com=3).mean().iloc[-1])
+    assert value != pytest.approx(window.ewm(com=3).mean().iloc[-1])
+
+
+class FlakyHistory:
+
+    def __init__(self, history):
+        self.history = history
+        self.fail = False
+
+    def asset_histories(self, *args, **kwargs):
+        if self.fail:
+            raise ConnectionError('lost the database')
+        return self.history.asset_histories(*args, **kwargs)
+
+
+def test_cache_refetches_after_a_failed_fetch(market_history):
+    flaky = FlakyHistory(market_history)
+    cache = IndicatorCache(warmup_days=5)
+    fresh = IndicatorCache(warmup_days=5)
+    times = list(date_range('2017-05-10', '2017-05-20'))
+    for time in times[:5]:
+        cache.ema(flaky, time, 'BTC', 'ETH', com=3)
+    flaky.fail = True
+    with pytest.raises(ConnectionError):
+        cache.ema(flaky, times[5], 'BTC', 'ETH', com=3)
+    flaky.fail = False
+    for time in times:
+        expected = fresh.ema(market_history, time, 'BTC', 'ETH', com=3)
+    # The candles the failed call should have fed aren't skipped
+    assert cache.ema(flaky, times[-1], 'BTC', 'ETH', com=3) == pytest.approx(expected)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import json
+import pickle
+
+import pytest
+from pandas import Timestamp
+
+from moneybot.examples.strategies import BuyHoldStrategy
+from moneybot.fund import Fund
+from moneybot.instrumentation import FileExporter
+from moneybot.instrumentation import Histogram
+from moneybot.instrumentation import HistogramCollector
+from moneybot.instrumentation import Instrumented
+from moneybot.instrumentation import Observer
+from moneybot.instrumentation import prometheus_text
+from moneybot.market.adapters.backtest import BacktestMarketAdapter
+from moneybot.market.cache import CachedMarketHistory
+from moneybot.market.store import ChartStore
+from moneybot.market.store import ColumnarMarketHistory
+
+
+START, END = '2017-05-01', '2017-05-05'
+
+
+@pytest.fixture(scope='module')
+def store():
+    with open('tests/mock-data/charts.json', 'r') as f:
+        return ChartStore.from_charts(json.load(f))
+
+
+def make_fund(store):
+    adapter = BacktestMarketAdapter(
+        'BTC',
+        ColumnarMarketHistory(store),
+        {'BTC': 1.0},
+    )
+    return Fund(BuyHoldStrategy('BTC', 86400), adapter)
+
+
+class Broken(Observer):
+
+    def on_step(self, time, seconds, value):
+        raise RuntimeError('broken')
+
+
+def test_collects_step_metrics(store):
+    expected = list(make_fund(store).run_backtest(START, END))
+
+    fund = make_fund(store)
+    collector = HistogramCollector()
+    fund.add_observer(Broken())
+    fund.add_observer(collector)
+    assert list(fund.run_backtest(START, END)) == expected
+
+    snapshot = collector.snapshot()
+    histograms = {
+        (sample['name'], tuple(sample['labels'].values())): sample['count']
+        for sample in snapshot['histograms']
+    }
+    steps = len(expected)
+    assert histograms[('moneybot_step_seconds', ())] == steps
+    for phase in ['update_market_state', 'snapshot', 'propose_trades']:
+        assert histograms[('moneybot_phase_seconds', (phase,))] == steps
+    # Only the first step buys anything
+    assert histograms[('moneybot_phase_seconds', ('execute_orders',))] == 1
+    # Before and after trading, every step
+    calls = histograms[('moneybot_api_call_seconds', ('market_history', 'latest'))]
+    assert calls == 2 * steps
+
+    counters = {sample['name']: sample['value'] for sample in snapshot['counters']}
+    attempted = counters['moneybot_orders_attempted_total']
+    assert attempted > 0
+    assert counters['moneybot_orders_filled_total'] == attempted
+    assert snapshot['gauges'][0]['value'] == expected[-1]
+
+
+def test_instrumented_reports_errors():
+    collector = HistogramCollector()
+
+    class Client:
+        def ok(self):
+            return 1
+
+        def fail(self):
+            raise ValueError
+
+    client = Instrumented(Client(), 'poloniex', collector)
+    assert client.ok() == 1
+    with pytest.raises(ValueError):
+        client.fail()
+    counters = collector.snapshot()['counters']
+    assert counters == [{
+        'name': 'moneybot_api_errors_total',
+        'labels': {'service': 'poloniex', 'method': 'fail'},
+        'value': 1,
+    }]
+
+
+def test_histogram():
+    histogram = Histogram([1, 2, 5])
+    for value in [0.5, 1, 1.5, 3, 10]:
+        histogram.observe(value)
+    assert histogram.cumulative() == [(1, 2), (2, 3), (5, 4), (float('inf'), 5)]
+    assert histogram.quantile(0.5) == 2
+    assert histogram.quantile(1) == float('inf')
+
+
+def test_prometheus_text():
+    collector = HistogramCollector(buckets=[0.1, 1])
+    collector.on_phase('propose_trades', 0.5)
+    collector.on_orders(3, 2)
+    text = prometheus_text(collector)
+    assert '# TYPE moneybot_phase_seconds histogram\n' in text
+    assert 'moneybot_phase_seconds_bucket{phase="propose_trades",le="0.1"} 0\n' in text
+    assert 'moneybot_phase_seconds_bucket{phase="propose_trades",le="+Inf"} 1\n' in text
+    assert 'moneybot_phase_seconds_count{phase="propose_trades"} 1\n' in text
+    assert 'moneybot_orders_filled_total 2\n' in text
+
+
+def test_merge_pickled_collector():
+    collector = HistogramCollector(buckets=[0.1, 1])
+    collector.on_phase('snapshot', 0.05)
+    collector.on_orders(3, 2)
+    other = HistogramCollector(buckets=[0.1, 1])
+    other.on_phase('snapshot', 0.5)
+    other.on_phase('propose_trades', 2)
+    other.on_orders(1, 1)
+    other.on_step(Timestamp(START), 0.01, 42.0)
+
+    collector.merge(pickle.loads(pickle.dumps(other)))
+    snapshot = collector.snapshot()
+    phases = {
+        sample['labels']['phase']: sample for sample in snapshot['histograms']
+        if sample['name'] == 'moneybot_phase_seconds'
+    }
+    assert phases['snapshot']['buckets'] == [['0.1', 1], ['1', 2], ['inf', 2]]
+    assert phases['propose_trades']['count'] == 1
+    counters = {sample['name']: sample['value'] for sample in snapshot['counters']}
+    assert counters['moneybot_orders_attempted_total'] == 4
+    assert counters['moneybot_orders_filled_total'] == 3
+    assert snapshot['gauges'][0]['value'] == 42.0
+
+    with pytest.raises(ValueError):
+        collector.merge(HistogramCollector())
+
+
+def test_exports_cache_stats(store):
+    history = CachedMarketHistory(ColumnarMarketHistory(store))
+    collector = HistogramCollector()
+    collector.add_stats(
+        'moneybot_history_cache',
+        history.stats,
+        counters=('hits', 'misses', 'evictions'),
+    )
+    time = Timestamp('2017-05-01')
+    history.latest(time)
+    history.latest(time)
+    text = prometheus_text(collector)
+    assert '# TYPE moneybot_history_cache_hits_total counter\n' in text
+    assert 'moneybot_history_cache_hits_total 1\n' in text
+    assert 'moneybot_history_cache_misses_total 1\n' in text
+    assert '# TYPE moneybot_history_cache_entries gauge\n' in text
+    assert 'moneybot_history_cache_entries 1\n' in text
+    # Read afresh every time
+    history.latest(time)
+    assert 'moneybot_history_cache_hits_total 2\n' in prometheus_text(collector)
+
+
+def test_file_exporter(tmpdir):
+    collector = HistogramCollector()
+    path = str(tmpdir.join('metrics.json'))
+    exporter = FileExporter(collector, path, format='json')
+    collector.on_step(None, 0.25, 100.0)
+    exporter.on_step(None, 0.25, 100.0)
+    with open(path) as f:
+        assert json.load(f)['histograms'][0]['count'] == 1
+    with pytest.raises(ValueError):
+        FileExporter(collector, path, format='xml')
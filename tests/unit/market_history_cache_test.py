@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import json
+import pickle
+from copy import deepcopy
+
+import pandas as pd
+from pandas import Timestamp
+
+from moneybot.market.cache import CachedMarketHistory
+from moneybot.market.store import ChartStore
+from moneybot.market.store import ColumnarMarketHistory
+
+
+class CountingHistory:
+
+    def __init__(self):
+        self.calls = []
+
+    def latest(self, time):
+        self.calls.append(('latest', time))
+        return {'BTC_ETH': {'price_usd': 300.0, 'time': time}}
+
+    def asset_history(self, time, base, quote, days_back=30, key='price_usd'):
+        self.calls.append(('asset_history', time))
+        index = pd.date_range(end=time, periods=100, freq='15min')
+        return pd.Series(range(100), index=index, dtype=float)
+
+    def scrape_latest(self):
+        self.calls.append(('scrape_latest',))
+
+    def currency_pairs(self):
+        return ['BTC_ETH']
+
+
+def test_times_within_a_candle_share_an_entry():
+    history = CountingHistory()
+    cached = CachedMarketHistory(history, period=900)
+    first = cached.latest(Timestamp('2017-05-01 00:03'))
+    second = cached.latest(Timestamp('2017-05-01 00:14:59'))
+    assert first == second
+    assert history.calls == [('latest', Timestamp('2017-05-01 00:00'))]
+    cached.latest(Timestamp('2017-05-01 00:15'))
+    assert cached.stats()['hits'] == 1
+    assert cached.stats()['misses'] == 2
+
+
+def test_keys_on_the_exact_time_by_default():
+    history = CountingHistory()
+    cached = CachedMarketHistory(history)
+    cached.latest(Timestamp('2017-05-01 00:03'))
+    cached.latest(Timestamp('2017-05-01 00:03'))
+    cached.latest(Timestamp('2017-05-01 00:14:59'))
+    assert history.calls == [
+        ('latest', Timestamp('2017-05-01 00:03')),
+        ('latest', Timestamp('2017-05-01 00:14:59')),
+    ]
+    assert cached.stats()['hits'] == 1
+
+
+def test_matches_uncached_between_candles():
+    with open('tests/mock-data/charts.json', 'r') as f:
+        charts = json.load(f)
+    # Daily candles, with readings part way through some days
+    history = ColumnarMarketHistory(ChartStore.from_charts(charts))
+    cached = CachedMarketHistory(history)
+    time = Timestamp('2017-05-10 13:59:30')
+    assert cached.latest(time) == history.latest(time)
+    assert cached.asset_histories(time, ['BTC_ETH', 'USD_BTC']).equals(
+        history.asset_histories(time, ['BTC_ETH', 'USD_BTC']),
+    )
+    assert cached.asset_history(time, 'BTC', 'ETH').equals(
+        history.asset_history(time, 'BTC', 'ETH'),
+    )
+    # ...and again from the cache
+    assert cached.latest(time) == history.latest(time)
+    assert cached.stats()['hits'] == 1
+
+
+def test_results_are_copies():
+    cached = CachedMarketHistory(CountingHistory())
+    time = Timestamp('2017-05-01')
+    cached.latest(time)['BTC_ETH']['price_usd'] = 0
+    cached.asset_history(time, 'BTC', 'ETH')[:] = 0
+    assert cached.latest(time)['BTC_ETH']['price_usd'] == 300.0
+    assert cached.asset_history(time, 'BTC', 'ETH').iloc[-1] == 99.0
+
+
+def test_evicts_least_recently_used():
+    history = CountingHistory()
+    time = Timestamp('2017-05-01')
+    size = history.asset_history(time, 'BTC', 'ETH').memory_usage(deep=True)
+    cached = CachedMarketHistory(history, max_bytes=2 * size)
+    cached.asset_history(time, 'BTC', 'ETH')
+    cached.asset_history(time, 'BTC', 'XMR')
+    cached.asset_history(time, 'BTC', 'ETH')  # ETH is now the most recent
+    cached.asset_history(time, 'BTC', 'ZEC')
+    stats = cached.stats()
+    assert stats['evictions'] == 1
+    assert stats['entries'] == 2
+    assert stats['bytes'] <= 2 * size
+    misses = stats['misses']
+    cached.asset_history(time, 'BTC', 'ETH')
+    assert cached.stats()['misses'] == misses
+    cached.asset_history(time, 'BTC', 'XMR')
+    assert cached.stats()['misses'] == misses + 1
+
+
+def test_scrape_latest_invalidates():
+    history = CountingHistory()
+    cached = CachedMarketHistory(history)
+    time = Timestamp('2017-05-01')
+    cached.latest(time)
+    cached.scrape_latest()
+    cached.latest(time)
+    assert [c[0] for c in history.calls] == [
+        'latest',
+        'scrape_latest',
+        'latest',
+    ]
+
+
+def test_passes_other_attributes_through():
+    cached = CachedMarketHistory(CountingHistory())
+    assert cached.currency_pairs() == ['BTC_ETH']
+
+
+def test_copies_start_empty():
+    cached = CachedMarketHistory(CountingHistory(), period=300)
+    cached.latest(Timestamp('2017-05-01'))
+    for copy in [deepcopy(cached), pickle.loads(pickle.dumps(cached))]:
+        assert copy.period == 300
+        assert copy.stats()['entries'] == 0
+        assert copy.latest(Timestamp('2017-05-01'))
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import struct
+from contextlib import contextmanager
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from pandas import Timestamp
+
+from moneybot.market.history import COPY_SIGNATURE
+from moneybot.market.history import HISTORY_FIELDS
+from moneybot.market.history import MarketHistory
+from moneybot.market.history import decode_copy
+from moneybot.testing import MarketHistoryMock
+
+
+def binary_copy(rows):
+    '''
+    Encode (pair, epoch, value) rows the way Postgres's binary COPY would.
+    '''
+    data = COPY_SIGNATURE + struct.pack('>ii', 0, 0)
+    for pair, epoch, value in rows:
+        data += struct.pack('>hiiidid', 3, 4, pair, 8, epoch, 8, value)
+    return data + struct.pack('>h', -1)
+
+
+class FakeCursor:
+
+    def __init__(self, data):
+        self.data = data
+        self.queries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def mogrify(self, query, params):
+        return repr((query, params)).encode()
+
+    def copy_expert(self, query, file):
+        self.queries.append(query)
+        file.write(self.data)
+
+
+def test_decode_copy_rejects_nulls():
+    data = binary_copy([(1, 0.0, 1.0)])
+    # Turn the value's length into -1, i.e. NULL
+    data = data[:-14] + struct.pack('>i', -1) + data[-10:]
+    with pytest.raises(ValueError):
+        decode_copy(data, HISTORY_FIELDS)
+
+
+def test_pair_histories():
+    may_1 = Timestamp('2017-05-01', tz='UTC').timestamp()
+    cursor = FakeCursor(binary_copy([
+        (1, may_1 + 600, 3.0),
+        (1, may_1 + 300, 2.0),
+        (1, may_1, 1.0),
+        (3, may_1, np.nan),
+    ]))
+
+    @contextmanager
+    def connection():
+        yield type('FakeConnection', (), {'cursor': lambda self: cursor})()
+
+    with patch('moneybot.clients.Postgres.connection', connection):
+        histories = MarketHistory().pair_histories(
+            Timestamp('2017-05-02'),
+            ['BTC_ETH', 'BTC_XMR', 'BTC_ZEC'],
+            days_back=365,
+        )
+    assert 'price_usd' in cursor.queries[0]
+    assert list(histories) == ['BTC_ETH', 'BTC_XMR', 'BTC_ZEC']
+    eth = histories['BTC_ETH']
+    assert list(eth) == [3.0, 2.0, 1.0]
+    # Naive UTC, like every other backend
+    assert eth.index[0] == Timestamp('2017-05-01 00:10')
+    assert len(histories['BTC_XMR']) == 0
+    assert np.isnan(histories['BTC_ZEC'].iloc[0])
+
+
+class TableCursor(FakeCursor):
+    '''
+    Answers each query from `table`, a dict of pair -> (epoch, value) rows,
+    for just the pairs and times it asks for.
+    '''
+
+    def __init__(self, table):
+        super().__init__(b'')
+        self.table = table
+
+    def mogrify(self, query, params):
+        self.params = params
+        return super().mogrify(query, params)
+
+    def copy_expert(self, query, file):
+        start = Timestamp(self.params['start'], tz='UTC').timestamp()
+        end = Timestamp(self.params['end'], tz='UTC').timestamp()
+        self.data = binary_copy(
+            (i, epoch, value)
+            for i, pair in enumerate(self.params['pairs'], 1)
+            for epoch, value in sorted(self.table.get(pair, []), reverse=True)
+            if start < epoch <= end
+        )
+        super().copy_expert(query, file)
+
+
+def test_asset_histories_match_asset_history():
+    may_1 = Timestamp('2017-05-01', tz='UTC').timestamp()
+    cursor = TableCursor({
+        'BTC_ETH': [(may_1 + 300 * i, float(i)) for i in range(6)],
+        'BTC_XMR': [(may_1 + 600 * i, 10.0 + i) for i in range(3)],
+        'BTC_ZEC': [(may_1 - 86400 * 40, 1.0)],
+    })
+
+    @contextmanager
+    def connection():
+        yield type('FakeConnection', (), {'cursor': lambda self: cursor})()
+
+    pairs = ['BTC_ETH', 'BTC_XMR', 'BTC_ZEC']
+    time = Timestamp('2017-05-01 00:20')
+    with patch('moneybot.clients.Postgres.connection', connection):
+        history = MarketHistory()
+        histories = history.asset_histories(time, pairs)
+        singles = {
+            pair: history.asset_history(time, *pair.split('_'))
+            for pair in pairs
+        }
+        volumes = history.asset_history(time, 'BTC', 'ETH', key='volume')
+    assert list(histories) == pairs
+    assert histories.index.is_monotonic_decreasing
+    for pair, single in singles.items():
+        assert histories[pair].dropna().equals(single)
+    # Readings after `time`, or too long before it, are left out
+    assert list(histories['BTC_ETH'].dropna()) == [4.0, 3.0, 2.0, 1.0, 0.0]
+    assert histories['BTC_ZEC'].isnull().all()
+    assert histories.index.tz is None
+    assert 'volume' in cursor.queries[-1]
+    assert volumes.index.tz is None
+
+
+def test_mock_asset_histories_match_asset_history():
+    history = MarketHistoryMock()
+    time = Timestamp('2017-05-20')
+    pairs = ['BTC_ETH', 'BTC_XMR', 'USD_BTC']
+    histories = history.asset_histories(
+        time,
+        pairs,
+        days_back=10,
+        key='weighted_average',
+    )
+    assert list(histories) == pairs
+    assert histories.index.is_monotonic_decreasing
+    for pair in pairs:
+        single = history.asset_history(
+            time,
+            *pair.split('_'),
+            days_back=10,
+            key='weighted_average',
+        )
+        assert histories[pair].dropna().equals(single)
+    eth = histories['BTC_ETH']
+    assert eth.iloc[0] == history.latest(time)['BTC_ETH']['weighted_average']
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import json
 from datetime import datetime
 
 import pytest
@@ -46,3 +47,64 @@ def test_estimate_values(state):
         'BTC': 8.3,
         'ETH': 0.539370024,
     }
+
+
+def test_snapshot_is_read_only(state):
+    snapshot = state.snapshot()
+    with pytest.raises(TypeError):
+        snapshot.chart_data['BTC_ETH'] = {}
+    with pytest.raises(TypeError):
+        snapshot.chart_data['BTC_ETH']['weighted_average'] = 0
+    with pytest.raises(TypeError):
+        snapshot.balances['BTC'] = 1.0
+    assert state.chart_data['BTC_ETH']['weighted_average'] == 0.07096974
+    assert state.balances == {}
+
+
+def test_snapshot_estimates(state):
+    snapshot = state.snapshot()
+    assert snapshot.estimate_value('ETH', 2.5, 'BTC') == 0.17742435
+    assert snapshot.available_markets() == state.available_markets()
+
+
+def naive_estimate_value(chart_data, coin, amount, reference_coin):
+    if coin == reference_coin:
+        return amount
+    if f'{reference_coin}_{coin}' in chart_data:
+        return amount * chart_data[f'{reference_coin}_{coin}']['weighted_average']
+    if f'{coin}_{reference_coin}' in chart_data:
+        return amount / chart_data[f'{coin}_{reference_coin}']['weighted_average']
+    return None
+
+
+@pytest.mark.parametrize('reference_coin', ['BTC', 'ETH', 'XMR', 'USDT', 'WAT'])
+def test_estimates_match_per_market_lookups(reference_coin):
+    with open('tests/mock-data/charts.json', 'r') as f:
+        chart_data = json.load(f)['2017-05-01 00:00:00']
+    coins = sorted({c for market in chart_data for c in market.split('_')})
+    balances = {coin: 1.5 + i for i, coin in enumerate(coins + ['WAT'])}
+    state = MarketState(chart_data, balances, datetime.now(), 'BTC')
+
+    values = state.estimate_values(balances, reference_coin)
+    for coin, amount in balances.items():
+        value = naive_estimate_value(chart_data, coin, amount, reference_coin)
+        if value is not None:
+            # Coins with a market to the reference coin match exactly
+            assert state.estimate_value(coin, amount, reference_coin) == value
+            assert values[coin] == value
+        else:
+            # Anything else has to go through more than one market, if at all
+            path = state.conversion_path(coin, reference_coin)
+            assert path is None or len(path) > 2
+            assert (coin in values) == (path is not None)
+
+    assert state.estimate_total_value(balances, reference_coin) == sum(values.values())
+
+
+def test_estimate_value_multiple_hops(state):
+    # BTC -> ETH -> BCH
+    assert state.conversion_path('BCH', 'BTC') == ['BCH', 'ETH', 'BTC']
+    assert state.estimate_value('BCH', 4.2, 'BTC') == 4.2 * (0.07096974 * 1.842011)
+    assert state.conversion_path('BTC', 'BCH') == ['BTC', 'ETH', 'BCH']
+    assert state.estimate_value('BTC', 1.0, 'BCH') == 1.0 * (1 / 1.842011 / 0.07096974)
+    assert state.conversion_path('ETH', 'XRP') is None
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import math
+
+import numpy as np
+import pytest
+
+from moneybot.evaluate import max_drawdown
+from moneybot.evaluate import roi
+from moneybot.evaluate import summary
+from moneybot.metrics import batch_metrics
+from moneybot.metrics import RunningMetrics
+
+
+def test_max_drawdown_before_the_highest_peak():
+    # The worst fall is from the first peak, not the highest
+    values = [100, 50, 120, 110]
+    assert max_drawdown(values) == 0.5
+    assert max_drawdown([100, 90, 100, 80, 100]) == 0.2
+    assert max_drawdown([1, 2, 3]) == 0
+
+
+def test_consumes_generators():
+    values = (v for v in [2.0, 3.0, 1.0, 4.0])
+    metrics = RunningMetrics.of(values)
+    assert metrics.count == 4
+    assert metrics.roi == 1.0
+    assert roi(v for v in [2.0, 1.0]) == -0.5
+
+
+def test_running_metrics():
+    values = [100.0, 110.0, 99.0, 108.9, 130.68]
+    returns = np.diff(values) / values[:-1]
+    metrics = RunningMetrics.of(values)
+
+    assert metrics.volatility == pytest.approx(np.std(returns, ddof=1))
+    assert metrics.sharpe_ratio() == pytest.approx(
+        returns.mean() / np.std(returns, ddof=1),
+    )
+    downside = np.sqrt(np.mean(np.minimum(returns, 0) ** 2))
+    assert metrics.sortino_ratio() == pytest.approx(returns.mean() / downside)
+    assert metrics.sterling_ratio() == pytest.approx(0.3068 / 0.1)
+
+
+def test_undefined_metrics_are_nan():
+    metrics = RunningMetrics.of([1.0, 1.0])
+    assert metrics.roi == 0
+    assert metrics.max_drawdown == 0
+    assert math.isnan(metrics.volatility)
+    assert math.isnan(metrics.sterling_ratio())
+    assert math.isnan(RunningMetrics().roi)
+
+
+def test_batch_matches_running():
+    rng = np.random.RandomState(0)
+    values = np.cumprod(1 + rng.normal(0, 0.02, size=(20, 200)), axis=1)
+    batch = batch_metrics(values)
+    assert len(batch) == 20
+    for row, window in zip(batch.to_dict('records'), values):
+        expected = RunningMetrics.of(window.tolist()).as_dict()
+        assert row == pytest.approx(expected, rel=1e-9)
+
+
+def test_batch_of_short_series():
+    batch = batch_metrics(np.array([[1.0, 2.0]]))
+    expected = RunningMetrics.of([1.0, 2.0]).as_dict()
+    assert batch.iloc[0].to_dict() == pytest.approx(expected, nan_ok=True)
+
+
+def test_summary_of_values_or_metrics():
+    many_values = [[100.0, 90.0, 120.0], [100.0, 110.0, 105.0], [50.0, 40.0]]
+    from_values = summary(many_values, 90)
+    from_metrics = summary([RunningMetrics.of(v) for v in many_values], 90)
+    assert list(from_values) == list(from_metrics)
+    assert from_values['mean'] == pytest.approx((0.2 + 0.05 - 0.2) / 3)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import Mock
+from unittest.mock import patch
+
+import pytest
+from pyloniex.constants import OrderType
+
+from moneybot.market import Order
+from moneybot.market.adapters.poloniex import PoloniexMarketAdapter
+from moneybot.market.execution import FixedStep
+from moneybot.market.execution import OrderBookStep
+from moneybot.market.execution import OrderExecutor
+from moneybot.market.execution import PercentStep
+
+
+def buy(amount, price=0.07, type_=OrderType.fill_or_kill):
+    return Order('BTC_ETH', price, amount, Order.Direction.BUY, type_)
+
+
+def sell(amount, price=0.07, type_=OrderType.fill_or_kill):
+    return Order('BTC_ETH', price, amount, Order.Direction.SELL, type_)
+
+
+@pytest.fixture
+def api():
+    return Mock()
+
+
+@pytest.fixture
+def executor(api):
+    return OrderExecutor(
+        api,
+        PoloniexMarketAdapter.validate_order,
+        PercentStep(1),
+        backoff=0,
+    )
+
+
+def test_price_steps():
+    assert FixedStep(0.001).next_price(buy(1)) == 0.07 + 0.001
+    assert FixedStep(0.001).next_price(sell(1)) == 0.07 - 0.001
+    assert PercentStep(10).next_price(buy(1, price=2)) == 2.2
+    assert PercentStep(10).next_price(sell(1, price=2)) == 1.8
+
+
+def test_order_book_step(api):
+    api.return_order_book.return_value = {
+        'asks': [['0.0701', 1], ['0.0703', 2], ['0.0706', 5]],
+        'bids': [['0.0699', 1], ['0.0697', 2], ['0.0694', 5]],
+    }
+    step = OrderBookStep(api, max_percent=0.5)
+    # Deep enough to fill 3 ETH at 0.0703
+    assert step.next_price(buy(3)) == 0.0703
+    assert step.next_price(sell(3)) == 0.0697
+    # ...but no further than 0.5% away
+    assert step.next_price(buy(8)) == pytest.approx(0.07035)
+    assert step.next_price(sell(8)) == pytest.approx(0.06965)
+
+
+def test_partial_fills_are_retried(api, executor):
+    api.buy.side_effect = [
+        {
+            'orderNumber': 1,
+            'amountUnfilled': '6',
+            'resultingTrades': [{'amount': '4', 'rate': '0.07', 'total': '0.28'}],
+        },
+        {
+            'orderNumber': 2,
+            'resultingTrades': [{'amount': '6', 'rate': '0.0707', 'total': '0.4242'}],
+        },
+    ]
+    order = buy(10, type_=OrderType.immediate_or_cancel)
+    execution = executor.execute(order, {'BTC': 1})
+
+    assert execution.filled
+    assert execution.order_ids == [1, 2]
+    assert [a.order.amount for a in execution.attempts] == [10, 6]
+    assert execution.attempts[1].order.price == pytest.approx(0.0707)
+    assert execution.average_price == pytest.approx(0.07042)
+    assert execution.slippage == pytest.approx(0.006)
+    assert list(executor.history) == [execution]
+
+
+def test_retries_are_validated_against_what_is_left(api, executor):
+    api.buy.return_value = {
+        'orderNumber': 1,
+        'amountUnfilled': '5',
+        'resultingTrades': [{'amount': '5', 'rate': '0.07', 'total': '0.35'}],
+    }
+    # Enough for all 10 at 0.07, but 0.35 of it is spent on the first half,
+    # leaving too little for the rest at 0.0707
+    execution = executor.execute(buy(10), {'BTC': 0.7})
+    assert api.buy.call_count == 1
+    assert execution.filled_amount == 5
+    assert not execution.filled
+
+
+def test_gives_up_on_other_errors(api, executor):
+    api.sell.return_value = {'error': 'Total must be at least 0.0001.'}
+    execution = executor.execute(sell(1), {'ETH': 1})
+    assert api.sell.call_count == 1
+    assert execution.attempts[0].error == 'Total must be at least 0.0001.'
+    assert execution.average_price is None
+
+
+def test_deadline(api, executor):
+    api.sell.return_value = {'error': 'Unable to fill order completely.'}
+    executor.backoff = 1
+    executor.deadline = 1.5
+    with patch('moneybot.market.execution.sleep') as sleep:
+        with patch('moneybot.market.execution.random.uniform', return_value=1):
+            execution = executor.execute(sell(1), {'ETH': 1})
+    # Waiting 1 then 2 seconds would pass the deadline
+    assert len(execution.attempts) == 2
+    sleep.assert_called_once_with(1)
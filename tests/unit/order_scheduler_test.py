@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+import json
+import random
+from threading import Lock
+from time import sleep
+from unittest.mock import patch
+from urllib.parse import parse_qs
+
+import pytest
+import tenacity
+from pyloniex.constants import OrderType
+from requests import Response
+
+from moneybot.clients import SerializedPrivateAPI
+from moneybot.errors import InsufficientBalanceError
+from moneybot.market import Order
+from moneybot.market.adapters import MarketAdapter
+from moneybot.market.adapters.poloniex import PoloniexMarketAdapter
+from moneybot.market.scheduler import OrderFill
+from moneybot.market.scheduler import OrderScheduler
+from moneybot.market.scheduler import order_waves
+from moneybot.utils import simulate_order
+
+
+class FakeExchange(MarketAdapter):
+    '''
+    Fills every order it's given (bar those for `broken_markets`) after a
+    short wait, tracking how many it was working on at once.
+    '''
+
+    def __init__(self, balances, concurrency, broken_markets=()):
+        super().__init__('BTC', None, {})
+        self.balances = dict(balances)
+        self._concurrency = concurrency
+        self.broken_markets = broken_markets
+        self.balance_fetches = 0
+        self.submitted = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = Lock()
+
+    @classmethod
+    def reify_trades(cls, trades, market_state):
+        raise NotImplementedError
+
+    @classmethod
+    def validate_order(cls, order, balances):
+        if order.direction == Order.Direction.BUY:
+            coin, amount = order.base_currency, order.base_amount
+        else:
+            coin, amount = order.quote_currency, order.quote_amount
+        if amount > balances.get(coin, 0):
+            raise InsufficientBalanceError(f'Not enough {coin} for [{order}]')
+
+    @property
+    def concurrency(self):
+        return self._concurrency
+
+    def get_balances(self):
+        with self.lock:
+            self.balance_fetches += 1
+            return dict(self.balances)
+
+    def submit_order(self, order, balances, attempts=8):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.submitted.append(order)
+        sleep(0.05)
+        with self.lock:
+            self.in_flight -= 1
+            if order.market in self.broken_markets:
+                raise ConnectionError('Connection reset by peer')
+            self.balances = simulate_order(order, self.balances)
+            return len(self.submitted)
+
+
+def order(market, amount, direction):
+    return Order(market, 0.1, amount, direction, OrderType.fill_or_kill)
+
+
+@pytest.fixture
+def rebalance():
+    # Fan in to BTC, then fan out again
+    return [
+        order('BTC_ETH', 10, Order.Direction.SELL),
+        order('BTC_XMR', 10, Order.Direction.SELL),
+        order('BTC_ZEC', 10, Order.Direction.SELL),
+        order('BTC_LTC', 10, Order.Direction.BUY),
+        order('BTC_DASH', 10, Order.Direction.BUY),
+    ]
+
+
+def test_order_waves(rebalance):
+    assert order_waves(rebalance) == [[0, 1, 2], [3, 4]]
+    # A second hop waits for the first
+    hops = [
+        order('ETH_BCH', 1, Order.Direction.SELL),
+        order('BTC_ETH', 1, Order.Direction.SELL),
+    ]
+    assert order_waves(hops) == [[0], [1]]
+
+
+def test_run_concurrently(rebalance):
+    exchange = FakeExchange({'ETH': 10, 'XMR': 10, 'ZEC': 10}, concurrency=4)
+    results = OrderScheduler(exchange).run(rebalance)
+
+    assert [result.order for result in results] == rebalance
+    assert all(result.filled for result in results)
+    assert all(result.seconds > 0 for result in results)
+    assert exchange.max_in_flight == 3
+    # The buys could only be validated once the sells' BTC came in
+    buys = sorted(order.market for order in exchange.submitted[3:])
+    assert buys == ['BTC_DASH', 'BTC_LTC']
+    # Everything filled as placed, so the ledger never needed checking
+    assert exchange.balance_fetches == 1
+
+
+def test_run_respects_max_workers(rebalance):
+    exchange = FakeExchange({'ETH': 10, 'XMR': 10, 'ZEC': 10}, concurrency=4)
+    OrderScheduler(exchange, max_workers=2).run(rebalance)
+    assert exchange.max_in_flight == 2
+
+
+def test_orders_in_a_wave_reserve_balances():
+    exchange = FakeExchange({'ETH': 15}, concurrency=4)
+    orders = [
+        order('BTC_ETH', 10, Order.Direction.SELL),
+        order('BTC_ETH', 10, Order.Direction.SELL),
+    ]
+    results = OrderScheduler(exchange).run(orders)
+    assert results[0].filled
+    assert not results[1].filled
+    assert 'Not enough ETH' in results[1].error
+    assert exchange.submitted == orders[:1]
+
+
+def test_serial_matches_execute_orders(rebalance):
+    balances = {'ETH': 10, 'XMR': 10, 'ZEC': 10}
+    serial = FakeExchange(balances, concurrency=1)
+    results = OrderScheduler(serial).run(rebalance)
+    batch = FakeExchange(balances, concurrency=1)
+    order_ids = batch.execute_orders(rebalance)
+
+    assert [result.order_id for result in results] == order_ids
+    assert serial.submitted == batch.submitted == rebalance
+    assert serial.balances == batch.balances
+    assert serial.balance_fetches == batch.balance_fetches
+
+
+class PartialExchange(FakeExchange):
+    '''
+    Fills only half of every order.
+    '''
+
+    def fill_order(self, order, balances, attempts=8):
+        half = Order(
+            order.market,
+            order.price,
+            order.amount / 2,
+            order.direction,
+            order.type,
+        )
+        return OrderFill(self.submit_order(half, balances, attempts), half)
+
+
+def test_balances_looked_up_once_when_everything_fills():
+    coins = [f'C{i:02d}' for i in range(20)]
+    exchange = FakeExchange({coin: 10 for coin in coins}, concurrency=1)
+    orders = [order(f'BTC_{coin}', 10, Order.Direction.SELL) for coin in coins]
+    orders += [order(f'BTC_{coin}', 5, Order.Direction.BUY) for coin in coins]
+    results = OrderScheduler(exchange).run(orders)
+    assert all(result.filled for result in results)
+    assert exchange.balance_fetches == 1
+
+
+def test_whole_list_validated_up_front(rebalance):
+    # The sells raise 3 BTC, which won't pay for a third buy
+    exchange = FakeExchange({'ETH': 10, 'XMR': 10, 'ZEC': 10}, concurrency=4)
+    orders = rebalance + [order('BTC_BCH', 15, Order.Direction.BUY)]
+    results = OrderScheduler(exchange).run(orders)
+    assert 'Not enough BTC' in results[-1].error
+    submitted = sorted(order.market for order in exchange.submitted)
+    assert submitted == sorted(order.market for order in rebalance)
+    assert exchange.balance_fetches == 1
+
+
+def test_ledger_follows_partial_fills():
+    exchange = PartialExchange({'ETH': 10}, concurrency=1)
+    orders = [
+        order('BTC_ETH', 10, Order.Direction.SELL),
+        # Both affordable had the sell filled in full, but it only raises
+        # 0.5 BTC
+        order('BTC_LTC', 6, Order.Direction.BUY),
+        order('BTC_XMR', 3, Order.Direction.BUY),
+    ]
+    results = OrderScheduler(exchange).run(orders)
+    assert [result.filled for result in results] == [True, False, True]
+    assert 'Not enough BTC' in results[1].error
+    # Worked out from the fills, without asking the exchange
+    assert exchange.balance_fetches == 1
+
+
+def test_balances_looked_up_again_after_an_error(rebalance):
+    exchange = FakeExchange(
+        {'ETH': 10, 'XMR': 10, 'ZEC': 10},
+        concurrency=4,
+        broken_markets=['BTC_XMR'],
+    )
+    OrderScheduler(exchange).run(rebalance)
+    # The broken sell may or may not have gone through
+    assert exchange.balance_fetches == 2
+
+
+def test_errors_are_reported(rebalance):
+    exchange = FakeExchange(
+        {'ETH': 10, 'XMR': 10, 'ZEC': 10},
+        concurrency=4,
+        broken_markets=['BTC_XMR'],
+    )
+    results = OrderScheduler(exchange).run(rebalance)
+    assert not results[1].filled
+    assert 'Connection reset' in results[1].error
+    assert all(result.filled for result in results[:1] + results[2:])
+
+
+class ExchangeServer:
+    '''
+    Stands in for Poloniex behind a private API client's session: every
+    request takes a while to arrive, and then its nonce is recorded. The
+    first `busy` requests are turned away with a 429.
+    '''
+
+    def __init__(self, busy=0):
+        self.nonces = []
+        self.busy = busy
+        self.lock = Lock()
+        self.random = random.Random(0)
+
+    def send(self, prepared, **kwargs):
+        params = parse_qs(prepared.body)
+        with self.lock:
+            delay = self.random.uniform(0, 0.02)
+        sleep(delay)
+        with self.lock:
+            self.nonces.append(int(params['nonce'][0]))
+            number = len(self.nonces)
+        response = Response()
+        if number <= self.busy:
+            response.status_code = 429
+            response._content = b'{"error": "Too many requests"}'
+            return response
+        response.status_code = 200
+        if params['command'] == ['returnCompleteBalances']:
+            body = {coin: {'available': '10'} for coin in ['ETH', 'XMR', 'ZEC']}
+        else:
+            body = {'orderNumber': number, 'resultingTrades': []}
+        response._content = json.dumps(body).encode()
+        return response
+
+
+def test_concurrent_orders_reach_poloniex_in_nonce_order(rebalance):
+    client = SerializedPrivateAPI(key='polo key', secret='polo secret')
+    server = ExchangeServer()
+    with patch.object(client._session, 'send', server.send), \
+            patch.object(client._limiter, 'wait'):
+        adapter = PoloniexMarketAdapter('BTC', None, {})
+        adapter.private_api = adapter.executor.private_api = client
+        with patch.object(PoloniexMarketAdapter, 'concurrency', 4):
+            results = OrderScheduler(adapter).run(rebalance)
+
+    assert all(result.filled for result in results)
+    # A balance lookup and five orders, three of them at once
+    assert len(server.nonces) == 6
+    assert server.nonces == sorted(set(server.nonces))
+
+
+def test_retries_take_a_fresh_nonce():
+    client = SerializedPrivateAPI(key='polo key', secret='polo secret')
+    server = ExchangeServer(busy=2)
+    retrying = SerializedPrivateAPI.private_request.retry
+    with patch.object(client._session, 'send', server.send), \
+            patch.object(client._limiter, 'wait'), \
+            patch.object(retrying, 'wait', tenacity.wait_none()):
+        balances = client.return_complete_balances()
+
+    assert balances['ETH'] == {'available': '10'}
+    assert len(server.nonces) == 3
+    assert server.nonces == sorted(set(server.nonces))
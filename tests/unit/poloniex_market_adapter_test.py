@@ -18,7 +18,10 @@ from moneybot.trade import AbstractTrade
 
 @pytest.fixture
 def market_adapter():
-    return PoloniexMarketAdapter('BTC', MarketHistoryMock(), {})
+    adapter = PoloniexMarketAdapter('BTC', MarketHistoryMock(), {})
+    # Don't wait between retries
+    adapter.executor.backoff = 0
+    return adapter
 
 
 @pytest.fixture
@@ -74,6 +77,35 @@ def test_reify_trade(market_state, trade, expected):
     assert orders == expected
 
 
+def test_reify_trade_indirect():
+    chart_data = {
+        'BTC_ETH': {'weighted_average': 0.07420755},  # BTC/ETH
+        'BTC_XMR': {'weighted_average': 0.01745315},  # BTC/XMR
+        'XMR_ZEC': {'weighted_average': 4.08195975},  # XMR/ZEC
+    }
+    market_state = MarketState(chart_data, {}, datetime.now(), 'BTC')
+
+    # No BTC_ZEC market, so we go through XMR
+    trade = AbstractTrade('BTC', 'ZEC', 'BTC', 0.5)
+    orders = PoloniexMarketAdapter.reify_trade(trade, market_state)
+    assert orders == [
+        Order(
+            'BTC_XMR',
+            0.01745315,
+            0.5 / 0.01745315,
+            Order.Direction.BUY,
+            OrderType.fill_or_kill,
+        ),
+        Order(
+            'XMR_ZEC',
+            4.08195975,
+            0.5 * (1 / 0.01745315 / 4.08195975),
+            Order.Direction.BUY,
+            OrderType.fill_or_kill,
+        ),
+    ]
+
+
 def test_reify_trade_no_market(market_state):
     # Don't have a market for this one
     trade = AbstractTrade('BTC', 'WAT', 'BTC', 1.4)
@@ -267,7 +299,7 @@ def test_execute_order_buy_retry(market_adapter):
         ),
         call(
             currency_pair=order.market,
-            rate=order.price + PoloniexMarketAdapter.ORDER_ADJUSTMENT,
+            rate=order.price + order.price * PoloniexMarketAdapter.PRICE_STEP_PERCENT / 100,
             amount=order.amount,
             order_type=order.type,
         ),
@@ -328,7 +360,7 @@ def test_execute_order_sell_retry(market_adapter):
         ),
         call(
             currency_pair=order.market,
-            rate=order.price - PoloniexMarketAdapter.ORDER_ADJUSTMENT,
+            rate=order.price - order.price * PoloniexMarketAdapter.PRICE_STEP_PERCENT / 100,
             amount=order.amount,
             order_type=order.type,
         ),
@@ -395,3 +427,60 @@ def test_execute_order_unknown_error(market_adapter):
             order_id = market_adapter.execute_order(order)
 
     assert order_id is None
+
+
+def test_execute_orders_refetches_balances_after_a_refusal(market_adapter):
+    orders = [
+        Order('BTC_ETH', 0.07420755, amount, direction, OrderType.fill_or_kill)
+        for amount, direction in [
+            (2, Order.Direction.BUY),   # fills
+            (3, Order.Direction.SELL),  # more ETH than we hold
+            (2, Order.Direction.BUY),   # isn't filled
+            (2, Order.Direction.BUY),   # fills
+        ]
+    ]
+    balances = [
+        {'BTC': {'available': '1'}},
+        {'BTC': {'available': '0.85'}, 'ETH': {'available': '2'}},
+    ]
+    responses = [
+        {'orderNumber': 1, 'resultingTrades': []},
+        {'error': 'You are a bad person and you should feel bad.'},
+        {'orderNumber': 2, 'resultingTrades': []},
+    ]
+    with patch.object(market_adapter.private_api, 'return_complete_balances', side_effect=balances) as mock_balances:
+        with patch.object(market_adapter.private_api, 'buy', side_effect=responses):
+            order_ids = market_adapter.execute_orders(orders)
+
+    assert order_ids == [1, None, None, 2]
+    # Once up front, then again once Poloniex refused an order we'd
+    # validated, but not after fills
+    assert mock_balances.call_count == 2
+
+
+def test_execute_orders_tracks_fills_without_lookups(market_adapter):
+    orders = [
+        Order('BTC_ETH', 0.07, 2, Order.Direction.BUY, OrderType.fill_or_kill),
+        Order('BTC_ETH', 0.07, 2, Order.Direction.BUY, OrderType.fill_or_kill),
+        Order('BTC_XMR', 0.02, 5, Order.Direction.BUY, OrderType.fill_or_kill),
+    ]
+    balances = {'BTC': {'available': '0.4'}}
+    responses = [
+        {
+            'orderNumber': 1,
+            'resultingTrades': [{'amount': '2', 'total': '0.14'}],
+        },
+        # Filled at a worse price than planned, leaving too little BTC for
+        # the last order
+        {
+            'orderNumber': 2,
+            'resultingTrades': [{'amount': '2', 'total': '0.2'}],
+        },
+    ]
+    with patch.object(market_adapter.private_api, 'return_complete_balances', return_value=balances) as mock_balances:
+        with patch.object(market_adapter.private_api, 'buy', side_effect=responses) as mock_buy:
+            order_ids = market_adapter.execute_orders(orders)
+
+    assert order_ids == [1, 2, None]
+    assert mock_buy.call_count == 2
+    assert mock_balances.call_count == 1
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from pandas import Timestamp
+
+from moneybot.market.schema import create_partitions
+from moneybot.market.schema import month_starts
+
+
+class RecordingCursor:
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+
+
+def test_month_starts():
+    months = month_starts(
+        Timestamp('2016-11-15 12:00', tz='UTC'),
+        Timestamp('2017-02-01'),
+    )
+    assert months == [
+        Timestamp('2016-11-01'),
+        Timestamp('2016-12-01'),
+        Timestamp('2017-01-01'),
+        Timestamp('2017-02-01'),
+    ]
+
+
+def test_create_partitions():
+    cursor = RecordingCursor()
+    names = create_partitions(
+        cursor,
+        Timestamp('2017-12-31'),
+        Timestamp('2018-01-01'),
+    )
+    assert names == ['scraped_chart_2017_12', 'scraped_chart_2018_01']
+    query, params = cursor.executed[-1]
+    assert 'scraped_chart_2018_01 PARTITION OF scraped_chart' in query
+    assert params == ('2018-01-01 00:00:00', '2018-02-01 00:00:00')
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock
+from threading import Thread
+from time import sleep
+from time import time
+from time import tzset
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import numpy as np
+import pytest
+from pandas import DataFrame
+from pandas import Timestamp
+from pandas import date_range
+from pyloniex import PoloniexPublicAPI
+
+from moneybot.clients import RateLimiter
+from moneybot.market.scrape import COLUMNS
+from moneybot.market.scrape import copy_buffer
+from moneybot.market.scrape import fetch_markets
+from moneybot.market.scrape import marshall_chart_data
+
+
+MARKETS = [f'BTC_X{i}' for i in range(12)]
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ChartDataHandler(BaseHTTPRequestHandler):
+    '''
+    Answers returnChartData with two candles for any market, slowly enough
+    that concurrent fetches overlap.
+    '''
+    lock = Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        params = parse_qs(urlparse(self.path).query)
+        start = int(float(params['start'][0]))
+        body = json.dumps([
+            {
+                'date': start + 300 * i,
+                'high': 0.06,
+                'low': 0.05,
+                'open': 0.05,
+                'close': 0.06,
+                'volume': 10.0,
+                'quoteVolume': 200.0,
+                'weightedAverage': 0.05 + i / 100,
+            }
+            for i in range(2)
+        ]).encode()
+        sleep(0.05)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with cls.lock:
+            cls.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_api():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ChartDataHandler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    ChartDataHandler.in_flight = ChartDataHandler.max_in_flight = 0
+    host = f'http://127.0.0.1:{server.server_address[1]}/public'
+    # pyloniex reads `host` off the class
+    yield type('StubPublicAPI', (PoloniexPublicAPI,), {'host': host})()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def btc_price_history():
+    index = date_range('2017-01-01', periods=365)
+    return DataFrame({'price_usd': 1000.0}, index=index)
+
+
+def test_copy_buffer():
+    rows = DataFrame([
+        {
+            'time': datetime(2017, 5, 1),
+            'currency_pair': 'BTC_ETH',
+            'high': 0.06,
+            'low': 0.05,
+            'price_usd': 77.6473541023,
+            'quote_volume': None,
+            'volume': 376.0086505,
+            'weighted_average': 0.05890363,
+            'date': 1493596800.0,
+        },
+        {
+            'time': datetime(2017, 5, 1),
+            'currency_pair': 'BTC_ETH',
+            'high': 0.07,
+            'low': 0.05,
+            'price_usd': 77.6473541023,
+            'quote_volume': None,
+            'volume': 376.0086505,
+            'weighted_average': 0.05890363,
+            'date': 1493596800.0,
+        },
+    ])
+    lines = list(csv.reader(copy_buffer(rows)))
+    # Duplicate readings collapse to the last one; extra columns are dropped
+    assert len(lines) == 1
+    row = dict(zip(COLUMNS, lines[0]))
+    assert row['time'] == '2017-05-01'
+    assert row['high'] == '0.07'
+    # NULL in CSV COPY format
+    assert row['quote_volume'] == ''
+    assert float(row['price_usd']) == 77.6473541023
+
+
+def test_fetch_markets(stub_api, btc_price_history):
+    start = datetime(2017, 5, 1).timestamp()
+    fetched = dict(fetch_markets(
+        stub_api,
+        btc_price_history,
+        MARKETS,
+        start=start,
+        end=start + 600,
+        concurrency=4,
+        limiter=RateLimiter(1000),
+    ))
+    assert set(fetched) == set(MARKETS)
+    for market, rows in fetched.items():
+        assert list(rows['currency_pair']) == [market, market]
+        assert list(rows['price_usd']) == pytest.approx([50.0, 60.0])
+    assert 1 < ChartDataHandler.max_in_flight <= 4
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(per_second=100)
+    start = time()
+    for _ in range(21):
+        limiter.wait()
+    # One request right away, then one every 10ms
+    assert time() - start == pytest.approx(0.2, abs=0.05)
+
+
+def test_marshall_chart_data():
+    btc_price_history = DataFrame(
+        {'price_usd': [1000.0, np.nan, 1200.0]},
+        index=date_range('2017-05-01', periods=3),
+    )
+    candle = {
+        'high': 0.06,
+        'low': 0.05,
+        'open': 0.05,
+        'close': 0.06,
+        'volume': 10.0,
+        'quoteVolume': 200.0,
+        'weightedAverage': 0.05,
+    }
+    times = [
+        Timestamp('2017-04-30 12:00'),  # before any BTC price
+        Timestamp('2017-05-01 00:00'),
+        Timestamp('2017-05-02 12:00'),  # skips the missing BTC price
+        Timestamp('2017-05-03 12:00'),
+    ]
+    ex_trades = [
+        dict(candle, date=datetime.timestamp(time)) for time in times
+    ]
+    # An all-zero "no data" reading
+    ex_trades.append(dict(
+        {key: 0 for key in candle},
+        date=datetime.timestamp(Timestamp('2017-05-04')),
+    ))
+    rows = marshall_chart_data(ex_trades, btc_price_history, 'BTC_ETH')
+    assert list(rows['time']) == times
+    assert list(rows['currency_pair']) == ['BTC_ETH'] * 4
+    np.testing.assert_array_equal(
+        rows['price_usd'],
+        [np.nan, 0.05 * 1000, 0.05 * 1000, 0.05 * 1200],
+    )
+
+
+def test_marshall_chart_data_in_local_time(monkeypatch, btc_price_history):
+    monkeypatch.setenv('TZ', 'America/Los_Angeles')
+    tzset()
+    try:
+        # Hourly candles across the start of daylight saving time
+        dates = [datetime(2017, 3, 12).timestamp() + 3600 * i for i in range(6)]
+        ex_trades = [
+            {'date': date, 'volume': 1.0, 'weightedAverage': 0.05}
+            for date in dates
+        ]
+        rows = marshall_chart_data(ex_trades, btc_price_history, 'BTC_ETH')
+        assert list(rows['time']) == [datetime.fromtimestamp(d) for d in dates]
+    finally:
+        monkeypatch.undo()
+        tzset()
@@ -71,3 +71,11 @@ def test_simulate_trades():
         'BTC': 6.89916995,
         'ETH': 13.834475063521165,
     }
+
+
+def test_simulate_order_fee():
+    buy = Order('BTC_ETH', 0.07, 2, Order.Direction.BUY, OrderType.fill_or_kill)
+    sell = Order('BTC_ETH', 0.07, 2, Order.Direction.SELL, OrderType.fill_or_kill)
+    balances = {'BTC': 1.0, 'ETH': 2.0}
+    assert simulate_order(buy, balances, fee=0.5)['ETH'] == 3.0
+    assert simulate_order(sell, balances, fee=0.5)['BTC'] == 1.07